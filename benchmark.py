@@ -0,0 +1,341 @@
+import requests
+import time
+import threading
+import random
+import logging
+import sys
+import os
+import json
+import argparse
+import subprocess
+import tempfile
+import shutil
+from collections import Counter
+
+import worker
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+# Per-task worker logging would dominate the measurement
+worker.logger.setLevel(logging.CRITICAL)
+
+# Configuration
+COORDINATOR_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'coordinator.py')
+STARTUP_TIMEOUT = 30  # Seconds to wait for a launched coordinator to answer
+HEARTBEAT_INTERVAL = 3  # An idle simulated worker sends an empty /report this often
+CLAIM_WAIT = 1  # Long-poll seconds per claim, bounds how quickly workers notice shutdown
+PERCENTILES = (50, 99, 99.9)
+
+# Measurements shared by the submitter and the simulated workers
+stats_lock = threading.Lock()
+all_done = threading.Condition(stats_lock)
+submitted_at = {}  # task_id -> perf_counter() when its submit request was sent
+completed_at = {}  # task_id -> perf_counter() when the report carrying its result was acknowledged
+claim_to_start = []  # Seconds from the claim response to a task starting, per execution
+claim_counts = Counter()  # task_id -> times a worker started it
+failure_count = 0
+worker_errors = 0  # Requests or tasks that raised in a simulated worker; it carries on after each
+
+def load_workload(args):
+    # Returns a list of (offset_seconds or None, task dict)
+    if args.replay:
+        workload = []
+        with open(args.replay) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                if isinstance(item, str):
+                    workload.append((None, {'description': item}))
+                    continue
+                # Records without a description (e.g. request logs) use their title
+                task = {'description': str(item.get('description') or item.get('title') or line.strip())}
+                for key in ('priority', 'queue'):
+                    if key in item:
+                        task[key] = item[key]
+                workload.append((item.get('at'), task))
+        if args.tasks:
+            workload = workload[:args.tasks]
+        return workload
+
+    queues = args.queues.split(',') if args.queues else [None]
+    workload = []
+    for i in range(args.tasks):
+        task = {'description': f'bench-{i}'}
+        if args.priorities > 1:
+            task['priority'] = random.randrange(args.priorities)
+        if queues[0]:
+            task['queue'] = queues[i % len(queues)]
+        offset = i / args.rate if args.rate else None
+        workload.append((offset, task))
+    return workload
+
+def next_batch(workload, start, batch_size, began):
+    # Tasks due now, up to batch_size; sleeps until the next scheduled task
+    offset = workload[start][0]
+    if offset is not None:
+        delay = began + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    now = time.perf_counter() - began
+    end = start + 1
+    while end < len(workload) and end - start < batch_size:
+        offset = workload[end][0]
+        if offset is not None and offset > now:
+            break
+        end += 1
+    return [task for _, task in workload[start:end]]
+
+def submit_workload(url, workload, batch_size):
+    # Returns (number submitted, seconds spent submitting)
+    session = requests.Session()
+    submitted = 0
+    began = time.perf_counter()
+    start = 0
+    while start < len(workload):
+        batch = next_batch(workload, start, batch_size, began)
+        start += len(batch)
+        sent = time.perf_counter()
+        if batch_size == 1:
+            response = session.post(f'{url}/submit', json=batch[0], timeout=60)
+            response.raise_for_status()
+            task_ids = [response.json()['task_id']]
+        else:
+            response = session.post(f'{url}/submit_batch', json=batch, timeout=60)
+            response.raise_for_status()
+            task_ids = response.json()['task_ids']
+        with stats_lock:
+            for task_id in task_ids:
+                submitted_at[task_id] = sent
+            submitted += len(task_ids)
+    return submitted, time.perf_counter() - began
+
+def record_worker_error(message):
+    # A simulated worker logs and counts what went wrong, then keeps going
+    global worker_errors
+    logger.error(message)
+    with stats_lock:
+        worker_errors += 1
+
+def run_worker(url, stop, prefetch, duration_range, failure_rate):
+    session = requests.Session()
+    worker_id = None
+    while worker_id is None and not stop.is_set():
+        try:
+            response = session.post(f'{url}/register', json={'name': 'bench', 'capacity': prefetch}, timeout=10)
+            response.raise_for_status()
+            worker_id = response.json()['worker_id']
+        except Exception as e:
+            record_worker_error(f"Registration error: {str(e)}")
+            stop.wait(CLAIM_WAIT)
+    if worker_id is None:
+        return
+
+    # Finished tasks waiting for a report, as (task_id, result or None if failed, started_at, finished_at)
+    outbox = []
+    last_report = time.perf_counter()
+    while not stop.is_set():
+        try:
+            last_report = run_claimed_batch(session, url, worker_id, prefetch, duration_range, failure_rate,
+                                            outbox, last_report)
+        except Exception as e:
+            record_worker_error(f"Worker {worker_id} error: {str(e)}")
+            stop.wait(CLAIM_WAIT)
+
+def run_claimed_batch(session, url, worker_id, prefetch, duration_range, failure_rate, outbox, last_report):
+    # Returns when the last accepted report was sent. Like worker.py, results and failures go
+    # out in batched /report requests, which also serve as the worker's heartbeat.
+    response = session.post(
+        f'{url}/claim_batch',
+        json={'worker_id': worker_id, 'max_tasks': prefetch, 'wait': CLAIM_WAIT},
+        timeout=10 + CLAIM_WAIT
+    )
+    if response.status_code != 200:
+        logger.error(f"Claim failed: {response.text}")
+        time.sleep(CLAIM_WAIT)
+        return last_report
+
+    # Tasks run one after another, so waiting behind earlier tasks in the batch counts too
+    claimed = time.perf_counter()
+    for task in response.json()['tasks']:
+        started = time.perf_counter()
+        with stats_lock:
+            claim_to_start.append(started - claimed)
+            claim_counts[task['id']] += 1
+        started_at = time.time()
+        result = worker.execute_task(task, f'Bench-{worker_id}', duration_range, failure_rate)
+        outbox.append((task['id'], result, started_at, time.time()))
+        if len(outbox) >= worker.REPORT_BATCH_SIZE or time.perf_counter() - last_report >= worker.REPORT_INTERVAL:
+            last_report = send_report(session, url, worker_id, outbox, last_report)
+
+    # Finished tasks hold their leases until reported, and the next claim needs those slots
+    if outbox or time.perf_counter() - last_report >= HEARTBEAT_INTERVAL:
+        last_report = send_report(session, url, worker_id, outbox, last_report)
+    return last_report
+
+def send_report(session, url, worker_id, outbox, last_report):
+    # Returns when this report was sent, or last_report if it failed; unsent entries stay in the
+    # outbox for the next attempt, since a live worker's leases are never requeued for it
+    global failure_count
+    entries = list(outbox)
+    sent_at = time.perf_counter()
+    try:
+        session.post(
+            f'{url}/report',
+            json={'worker_id': worker_id,
+                  'results': [{'task_id': task_id, 'result': result,
+                               'started_at': started_at, 'finished_at': finished_at}
+                              for task_id, result, started_at, finished_at in entries if result],
+                  'failed': [entry[0] for entry in entries if not entry[1]]},
+            timeout=10
+        ).raise_for_status()
+    except Exception as e:
+        record_worker_error(f"Worker {worker_id} report error: {str(e)}")
+        return last_report
+
+    del outbox[:len(entries)]
+    acknowledged = time.perf_counter()
+    with stats_lock:
+        for task_id, result, _, _ in entries:
+            if result:
+                completed_at[task_id] = acknowledged
+            else:
+                failure_count += 1
+        all_done.notify_all()
+    return sent_at
+
+def launch_coordinator(args, workdir):
+    command = [sys.executable, COORDINATOR_SCRIPT, '--host', '127.0.0.1', '--port', str(args.port),
+               '--db', os.path.join(workdir, 'tasks.db'), '--mode', args.mode]
+    log = open(os.path.join(workdir, 'coordinator.log'), 'w')
+    process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{args.port}'
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Coordinator exited with code {process.returncode}, "
+                               f"see {log.name}")
+        try:
+            requests.get(f'{url}/status/0', timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('Coordinator did not start in time')
+
+def summarize(samples):
+    if not samples:
+        return {'count': 0}
+    samples = sorted(samples)
+    summary = {'count': len(samples), 'mean': sum(samples) / len(samples), 'max': samples[-1]}
+    for pct in PERCENTILES:
+        # Nearest-rank percentile
+        rank = max(int(len(samples) * pct / 100 + 0.999999) - 1, 0)
+        summary[f'p{pct:g}'.replace('.', '')] = samples[min(rank, len(samples) - 1)]
+    return summary
+
+def run_benchmark(args):
+    workload = load_workload(args)
+    workdir = tempfile.mkdtemp(prefix='scheduler-bench-')
+    process = None
+    stop = threading.Event()
+    try:
+        if args.url:
+            url = args.url.rstrip('/')
+        else:
+            process, url = launch_coordinator(args, workdir)
+
+        duration_range = (args.min_duration, max(args.max_duration, args.min_duration))
+        threads = [threading.Thread(target=run_worker, daemon=True,
+                                    args=(url, stop, args.prefetch, duration_range, args.failure_rate))
+                   for _ in range(args.workers)]
+        for thread in threads:
+            thread.start()
+
+        logger.info(f"Submitting {len(workload)} tasks to {url} with {args.workers} workers")
+        began = time.perf_counter()
+        submitted, submit_seconds = submit_workload(url, workload, args.batch_size)
+        with stats_lock:
+            finished = all_done.wait_for(lambda: len(completed_at) >= submitted, args.timeout)
+        elapsed = time.perf_counter() - began
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=CLAIM_WAIT + 10)
+
+        with stats_lock:
+            end_to_end = [completed_at[task_id] - submitted_at[task_id]
+                          for task_id in completed_at if task_id in submitted_at]
+            requeues = sum(count - 1 for count in claim_counts.values())
+            return {
+                'config': {key: value for key, value in vars(args).items() if key != 'output'},
+                'finished': finished,
+                'elapsed_seconds': elapsed,
+                'submit': {'tasks': submitted, 'seconds': submit_seconds,
+                           'tasks_per_second': submitted / submit_seconds if submit_seconds else None},
+                'completed': len(completed_at),
+                'completions_per_second': len(completed_at) / elapsed if elapsed else None,
+                'claim_to_start_seconds': summarize(claim_to_start),
+                'end_to_end_seconds': summarize(end_to_end),
+                'executions': sum(claim_counts.values()),
+                'failures': failure_count,
+                'worker_errors': worker_errors,
+                'requeues': requeues,
+            }
+    finally:
+        stop.set()
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+        if args.keep_workdir:
+            logger.info(f"Coordinator files kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load generator and benchmark for the task scheduler')
+    parser.add_argument('--url', help='Benchmark a running coordinator instead of launching one')
+    parser.add_argument('--port', type=int, default=5099, help='Port for the launched coordinator')
+    parser.add_argument('--mode', choices=['threaded', 'async'], default='threaded',
+                        help='Server mode for the launched coordinator')
+    parser.add_argument('--workers', type=int, default=8, help='Simulated workers')
+    parser.add_argument('--prefetch', type=int, default=4, help='Tasks each worker claims per batch')
+    parser.add_argument('--tasks', type=int, default=1000,
+                        help='Tasks to generate (or the maximum to replay)')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Generated submissions per second; 0 submits as fast as possible')
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='Tasks per /submit_batch request; 1 uses /submit')
+    parser.add_argument('--priorities', type=int, default=1, help='Spread generated tasks over this many priorities')
+    parser.add_argument('--queues', help='Comma-separated queues to spread generated tasks over')
+    parser.add_argument('--replay', help='JSONL workload to replay; each line is a task object '
+                                         '(description, priority, queue, optional "at" offset in seconds)')
+    parser.add_argument('--min-duration', type=float, default=0, help='Shortest simulated task in seconds')
+    parser.add_argument('--max-duration', type=float, default=0, help='Longest simulated task in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0, help='Probability a simulated task fails')
+    parser.add_argument('--timeout', type=float, default=600, help='Seconds to wait for every task to complete')
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+    parser.add_argument('--keep-workdir', action='store_true',
+                        help="Keep the launched coordinator's database and log")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    args.workers = max(args.workers, 1)
+    args.prefetch = max(args.prefetch, 1)
+    args.batch_size = max(args.batch_size, 1)
+    results = run_benchmark(args)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        logger.info(f"Results written to {args.output}")
+    else:
+        print(output)
+    if not results['finished']:
+        logger.error(f"Only {results['completed']} of {results['submit']['tasks']} tasks completed")
+        sys.exit(1)
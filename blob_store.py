@@ -0,0 +1,151 @@
+import hashlib
+import os
+import re
+import tempfile
+import zlib
+
+CODECS = ('zstd', 'zlib', 'none')
+HEADER_SIZE = 8  # Uncompressed size, big-endian, at the start of every blob file
+READ_CHUNK = 64 * 1024
+HASH_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+def load_zstd():
+    # zstandard is optional; only needed when zstd compression is chosen or found on disk
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd compression requires zstandard: pip install zstandard")
+    return zstandard
+
+
+# Content-addressed blobs under root/<first two hex digits>/<sha256>.<codec>.
+# The hash covers the uncompressed bytes, so identical payloads share one
+# file and storing them again costs nothing. The size header lets range
+# requests be answered without decompressing the whole blob first.
+class BlobStore:
+    def __init__(self, root, compression='zlib'):
+        if compression not in CODECS:
+            raise ValueError(f"Unknown compression {compression!r}")
+        if compression == 'zstd':
+            load_zstd()
+        self.root = root
+        self.compression = compression
+
+    def path(self, blob_hash, codec):
+        return os.path.join(self.root, blob_hash[:2], f'{blob_hash}.{codec}')
+
+    def find(self, blob_hash):
+        # Returns (path, codec) for a stored blob, or None
+        if not HASH_PATTERN.fullmatch(blob_hash):
+            return None
+        for codec in CODECS:
+            path = self.path(blob_hash, codec)
+            if os.path.exists(path):
+                return path, codec
+        return None
+
+    def put(self, data):
+        # Store bytes and return their sha256 hex digest
+        blob_hash = hashlib.sha256(data).hexdigest()
+        if self.find(blob_hash):
+            return blob_hash
+
+        codec = self.compression
+        if codec == 'zlib':
+            body = zlib.compress(data)
+        elif codec == 'zstd':
+            body = load_zstd().ZstdCompressor().compress(data)
+        else:
+            body = data
+        if len(body) >= len(data):
+            # Incompressible content is kept as is
+            codec, body = 'none', data
+
+        path = self.path(blob_hash, codec)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(len(data).to_bytes(HEADER_SIZE, 'big'))
+                f.write(body)
+            # Atomic, so concurrent writers of the same content are harmless
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return blob_hash
+
+    def size(self, blob_hash):
+        # Uncompressed size, or None if the blob is unknown
+        found = self.find(blob_hash)
+        if not found:
+            return None
+        with open(found[0], 'rb') as f:
+            return int.from_bytes(f.read(HEADER_SIZE), 'big')
+
+    def get(self, blob_hash):
+        found = self.find(blob_hash)
+        if not found:
+            return None
+        return b''.join(self.read(blob_hash))
+
+    def read(self, blob_hash, start=0, end=None):
+        # Yields the uncompressed bytes in [start, end) in chunks
+        path, codec = self.find(blob_hash)
+        with open(path, 'rb') as f:
+            size = int.from_bytes(f.read(HEADER_SIZE), 'big')
+            end = size if end is None else min(end, size)
+            if codec == 'none':
+                f.seek(HEADER_SIZE + start)
+                remaining = end - start
+                while remaining > 0:
+                    chunk = f.read(min(READ_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+                return
+
+            # Compressed streams are decoded from the start, skipping up to the range
+            if codec == 'zlib':
+                decompressor = zlib.decompressobj()
+                decoded = (decompressor.decompress(chunk) for chunk in iter(lambda: f.read(READ_CHUNK), b''))
+            else:
+                reader = load_zstd().ZstdDecompressor().stream_reader(f)
+                decoded = iter(lambda: reader.read(READ_CHUNK), b'')
+            position = 0
+            for chunk in decoded:
+                chunk_start = position
+                position += len(chunk)
+                if position <= start:
+                    continue
+                chunk = chunk[max(start - chunk_start, 0):end - chunk_start]
+                if chunk:
+                    yield chunk
+                if position >= end:
+                    return
+
+
+def parse_range(header, size):
+    # Returns (start, end) with end exclusive, None for no, unsupported or invalid range, or False if unsatisfiable
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                return False
+            return max(size - length, 0), size
+        start = int(first)
+        end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if last and end <= start:
+        # A last byte before the first is invalid, so the header is ignored
+        return None
+    if start >= size:
+        return False
+    return start, min(end, size)
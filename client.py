@@ -4,6 +4,13 @@ from urllib3.util.retry import Retry
 import time
 import json
 import logging
+import uuid
+import random
+import argparse
+import threading
+import sys
+from sharding import HashRing, shard_for_task
+import wire
 
 # Configure logging
 logging.basicConfig(
@@ -14,27 +21,111 @@ logger = logging.getLogger(__name__)
 
 # Configuration
 MASTER_URL = 'http://localhost:5000'
+SHARD_URLS = []  # One URL per coordinator shard, in shard order; empty means MASTER_URL alone
+STATUS_BATCH_SIZE = 10000  # Ids per /status_batch request
+OVERLOAD_MAX_WAIT = 300  # Seconds to keep retrying submissions the coordinator refuses with 429
+OVERLOAD_BACKOFF_CAP = 60  # Longest single wait between those retries
+WIRE_FORMAT = 'json'  # Or 'msgpack' (needs the msgpack package) for cheaper encoding
 
-# Configure HTTP session with retry
+# Configure HTTP session with retry. Submissions carry an idempotency key,
+# so POSTs are safe to retry: a repeat returns the original task.
+# 429s are left to post_with_backoff, which adds jitter to Retry-After.
 session = requests.Session()
 retry_strategy = Retry(
     total=3,
     backoff_factor=1,
-    status_forcelist=[500, 502, 503, 504]
+    status_forcelist=[500, 502, 503, 504],
+    allowed_methods=frozenset(['GET', 'POST']),
+    respect_retry_after_header=False
 )
 adapter = HTTPAdapter(max_retries=retry_strategy)
 session.mount("http://", adapter)
 session.mount("https://", adapter)
 
-def submit_task(description):
+def overload_delay(response, attempt):
+    # The coordinator's Retry-After hint plus random jitter that grows with each attempt,
+    # so clients throttled together do not all come back at the same moment
     try:
-        response = session.post(
-            f'{MASTER_URL}/submit',
-            json={'description': description},
-            timeout=10
-        )
+        hint = max(float(response.headers.get('Retry-After', 1)), 1)
+    except ValueError:
+        hint = 1
+    return min(hint + random.uniform(0, hint * 2 ** attempt), max(hint, OVERLOAD_BACKOFF_CAP))
+
+def post_with_backoff(url, **kwargs):
+    # POST, waiting out 429 responses; safe for submissions because they carry idempotency keys
+    deadline = time.monotonic() + OVERLOAD_MAX_WAIT
+    attempt = 0
+    while True:
+        response = session.post(url, **kwargs)
+        if response.status_code != 429:
+            return response
+        delay = overload_delay(response, attempt)
+        if time.monotonic() + delay > deadline:
+            return response
+        logger.warning(f"Coordinator is overloaded, retrying in {delay:.1f}s")
+        time.sleep(delay)
+        attempt += 1
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+def shard_urls():
+    return SHARD_URLS or [MASTER_URL]
+
+_rings = {}
+
+def shard_for_key(key):
+    # New tasks are routed by key, so retries of the same key reach the same shard
+    urls = shard_urls()
+    if len(urls) == 1:
+        return 0
+    ring = _rings.get(len(urls))
+    if ring is None:
+        ring = _rings[len(urls)] = HashRing(range(len(urls)))
+    return ring.shard_for(key)
+
+def url_for_task(task_id):
+    # Existing tasks are found through the shard encoded in their id
+    urls = shard_urls()
+    return urls[shard_for_task(task_id, len(urls))]
+
+def group_by_shard(task_ids):
+    urls = shard_urls()
+    groups = {}
+    for task_id in task_ids:
+        groups.setdefault(urls[shard_for_task(task_id, len(urls))], []).append(task_id)
+    return groups
+
+def submit_task(description, priority=0, queue='default', idempotency_key=None, depends_on=None,
+                requires=None, min_cores=0, min_memory=0, affinity_key=None):
+    # The idempotency key doubles as the routing key. A task with depends_on is
+    # held by the coordinator until those tasks complete, so it must go to their
+    # shard; all of its parents have to live on one shard.
+    # requires (worker tags), min_cores and min_memory (MB) limit which workers
+    # may run the task; tasks sharing an affinity_key prefer the worker that
+    # ran the last one.
+    idempotency_key = idempotency_key or new_idempotency_key()
+    url = url_for_task(depends_on[0]) if depends_on else shard_urls()[shard_for_key(idempotency_key)]
+    task = {
+        'description': description,
+        'priority': priority,
+        'queue': queue,
+        'idempotency_key': idempotency_key
+    }
+    if depends_on:
+        task['depends_on'] = list(depends_on)
+    if requires:
+        task['requires'] = list(requires)
+    if min_cores:
+        task['min_cores'] = min_cores
+    if min_memory:
+        task['min_memory'] = min_memory
+    if affinity_key is not None:
+        task['affinity_key'] = affinity_key
+    try:
+        response = post_with_backoff(f'{url}/submit', **wire.encode_request(task, WIRE_FORMAT), timeout=10)
         if response.status_code == 200:
-            task_id = response.json()['task_id']
+            task_id = wire.decode_response(response)['task_id']
             logger.info(f"Task submitted with ID: {task_id}")
             return task_id
         else:
@@ -44,25 +135,72 @@ def submit_task(description):
         logger.error(f"Submission error: {str(e)}")
         return None
 
+def submit_chain(descriptions, priority=0, queue='default'):
+    # Submit a pipeline in one pass: each step depends on the one before it.
+    # Returns the task IDs in order, stopping at the first failed submission.
+    task_ids = []
+    for description in descriptions:
+        task_id = submit_task(description, priority, queue, depends_on=task_ids[-1:] or None)
+        if task_id is None:
+            break
+        task_ids.append(task_id)
+    return task_ids
+
+def submit_many(descriptions, batch_size=10000):
+    # Submit descriptions in bulk, one batch per shard per chunk; returns the new task IDs in order
+    task_ids = []
+    descriptions = list(descriptions)
+    urls = shard_urls()
+    for start in range(0, len(descriptions), batch_size):
+        chunk = [{'description': description, 'idempotency_key': new_idempotency_key()}
+                 for description in descriptions[start:start + batch_size]]
+        by_shard = {}
+        for i, task in enumerate(chunk):
+            by_shard.setdefault(shard_for_key(task['idempotency_key']), []).append(i)
+        
+        chunk_ids = [None] * len(chunk)
+        try:
+            for shard, indexes in by_shard.items():
+                response = post_with_backoff(
+                    f'{urls[shard]}/submit_batch',
+                    **wire.encode_batch([chunk[i] for i in indexes], WIRE_FORMAT),
+                    timeout=60
+                )
+                if response.status_code != 200:
+                    logger.error(f"Batch submission failed: {response.text}")
+                    break
+                for i, task_id in zip(indexes, wire.decode_response(response)['task_ids']):
+                    chunk_ids[i] = task_id
+        except Exception as e:
+            logger.error(f"Batch submission error: {str(e)}")
+        task_ids.extend(task_id for task_id in chunk_ids if task_id is not None)
+        if None in chunk_ids:
+            break
+    
+    logger.info(f"Submitted {len(task_ids)} of {len(descriptions)} tasks")
+    return task_ids
+
 def check_status(task_id):
     try:
         response = session.get(
-            f'{MASTER_URL}/status/{task_id}',
+            f'{url_for_task(task_id)}/status/{task_id}',
             timeout=5
         )
         if response.status_code == 200:
             task = response.json()
             print("\nTask Status:")
             print(f"ID: {task['id']}")
-            print(f"Description: {task['description']}")
+            print(f"Description: {describe_value(task, 'description')}")
             print(f"Status: {task['status']}")
             if task['status'] == 'completed':
-                print(f"Result: {task['result']}")
+                print(f"Result: {describe_value(task, 'result')}")
                 print(f"Worker: {task['worker_id']}")
+            elif task['status'] == 'blocked':
+                print(f"Waiting on: {task.get('waiting_on')}")
             print(f"Created: {task['created_at']}")
             if task['completed_at']:
                 print(f"Completed: {task['completed_at']}")
-            return True
+            return task
         else:
             logger.error(f"Status check failed: {response.text}")
             return False
@@ -70,32 +208,128 @@ def check_status(task_id):
         logger.error(f"Status error: {str(e)}")
         return False
 
+def describe_value(task, field):
+    # Large descriptions and results are stored as blobs; show the reference instead
+    blob_hash = task.get(f'{field}_blob')
+    if blob_hash:
+        return f"<stored as blob {blob_hash}, fetch with fetch_blob({task['id']}, '{blob_hash}')>"
+    return task[field]
+
+def fetch_blob(task_id, blob_hash):
+    # Download a task's large description or result from its shard
+    response = session.get(f'{url_for_task(task_id)}/blob/{blob_hash}', timeout=60)
+    response.raise_for_status()
+    return response.content
+
 def monitor_task(task_id):
-    while True:
-        if check_status(task_id):
-            response = session.get(
-                f'{MASTER_URL}/status/{task_id}',
-                timeout=5
+    task = check_status(task_id)
+    if task and task['status'] != 'completed':
+        wait_all([task_id], on_event=lambda event: print(f"Task {event['id']}: {event['status']}"))
+        check_status(task_id)
+
+def get_statuses(task_ids):
+    # Look up many tasks in one request per chunk per shard; returns {task_id: task}
+    tasks = {}
+    for url, shard_ids in group_by_shard(task_ids).items():
+        for start in range(0, len(shard_ids), STATUS_BATCH_SIZE):
+            response = session.post(
+                f'{url}/status_batch',
+                **wire.encode_request({'task_ids': shard_ids[start:start + STATUS_BATCH_SIZE]}, WIRE_FORMAT),
+                timeout=30
             )
-            if response.status_code == 200 and response.json()['status'] == 'completed':
-                break
-        time.sleep(2)
+            response.raise_for_status()
+            for task in wire.decode_response(response)['tasks']:
+                tasks[task['id']] = task
+    return tasks
 
-def list_workers():
+def wait_all(task_ids, timeout=None, on_event=None):
+    # Block until every task is completed; returns {task_id: status}.
+    # Watches each shard involved on its own thread.
+    task_ids = list(dict.fromkeys(task_ids))
+    deadline = time.monotonic() + timeout if timeout else None
+    groups = group_by_shard(task_ids)
+    if len(groups) <= 1:
+        return wait_on_shard(shard_urls()[0] if not groups else next(iter(groups)),
+                             task_ids, deadline, on_event)
+    
+    statuses = {}
+    event_lock = threading.Lock()
+    
+    def deliver(event):
+        with event_lock:
+            on_event(event)
+    
+    def watch(url, shard_ids):
+        result = wait_on_shard(url, shard_ids, deadline, deliver if on_event else None)
+        with event_lock:
+            statuses.update(result)
+    
+    threads = [threading.Thread(target=watch, args=item, daemon=True) for item in groups.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+def wait_on_shard(url, task_ids, deadline, on_event):
+    # Uses the shard's /watch event stream and falls back to batched polling
+    statuses = {}
+    remaining = set(task_ids)
     try:
-        response = session.get(
-            f'{MASTER_URL}/workers',
-            timeout=5
-        )
-        if response.status_code == 200:
-            workers = response.json()
-            print("\nActive Workers:")
-            for worker in workers:
-                print(f"ID: {worker['id']}, Last Heartbeat: {worker['last_heartbeat']}")
-        else:
-            logger.error(f"Worker list failed: {response.text}")
+        with session.post(
+            f'{url}/watch',
+            json={'task_ids': task_ids},
+            stream=True,
+            timeout=(5, 30)
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if deadline and time.monotonic() > deadline:
+                    return statuses
+                if not line or not line.startswith('data: '):
+                    continue
+                event = json.loads(line[len('data: '):])
+                statuses[event['id']] = event['status']
+                if on_event:
+                    on_event(event)
+                if event['status'] in ('completed', 'missing'):
+                    remaining.discard(event['id'])
+                if not remaining:
+                    return statuses
     except Exception as e:
-        logger.error(f"Worker list error: {str(e)}")
+        logger.warning(f"Watch stream unavailable, polling instead: {str(e)}")
+    
+    while remaining and not (deadline and time.monotonic() > deadline):
+        try:
+            tasks = get_statuses(sorted(remaining))
+        except Exception as e:
+            logger.error(f"Status error: {str(e)}")
+            tasks = {}
+        for task_id in list(remaining):
+            task = tasks.get(task_id)
+            statuses[task_id] = task['status'] if task else 'missing'
+            if statuses[task_id] in ('completed', 'missing'):
+                remaining.discard(task_id)
+        if remaining:
+            time.sleep(2)
+    return statuses
+
+def list_workers():
+    for url in shard_urls():
+        try:
+            response = session.get(
+                f'{url}/workers',
+                timeout=5
+            )
+            if response.status_code == 200:
+                workers = response.json()
+                print(f"\nActive Workers ({url}):")
+                for worker in workers:
+                    print(f"ID: {worker['id']}, Last Heartbeat: {worker['last_heartbeat']}")
+            else:
+                logger.error(f"Worker list failed: {response.text}")
+        except Exception as e:
+            logger.error(f"Worker list error: {str(e)}")
 
 def main():
     print("Distributed Task Scheduler Client")
@@ -146,7 +380,25 @@ def main():
         else:
             print("Invalid choice. Please enter 1-5")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Distributed task scheduler client')
+    parser.add_argument('--master', default=MASTER_URL, help='Coordinator URL when not sharded')
+    parser.add_argument('--shards', help='Comma-separated coordinator URLs, in shard order')
+    parser.add_argument('--client-id', help='Identity the coordinators rate-limit by (default: our address)')
+    parser.add_argument('--wire', choices=wire.FORMATS, default=WIRE_FORMAT,
+                        help='Encoding for submissions and status lookups (msgpack needs the msgpack package)')
+    return parser.parse_args()
+
 if __name__ == '__main__':
+    args = parse_args()
+    MASTER_URL = args.master
+    if args.shards:
+        SHARD_URLS = [url.strip().rstrip('/') for url in args.shards.split(',') if url.strip()]
+    if args.client_id:
+        session.headers['X-Client-Id'] = args.client_id
+    WIRE_FORMAT = args.wire
+    if WIRE_FORMAT == 'msgpack' and not wire.available():
+        sys.exit("--wire msgpack requires msgpack: pip install msgpack")
     try:
         main()
     except KeyboardInterrupt:
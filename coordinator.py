@@ -1,20 +1,238 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify, has_request_context
+from flask.json.provider import DefaultJSONProvider
 import threading
 import time
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
+import json
+import queue
+import argparse
+import heapq
+import zlib
+import asyncio
+import io
+import math
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+from task_queue import DEFAULT_QUEUE
+from placement import Dispatcher, NO_REQUIREMENTS
+from key_cache import KeyCache
+from rate_limit import RateLimiter
+from sharding import MAX_SHARDS, shard_for_task
+from blob_store import BlobStore, parse_range
+import metrics
+import wire
+
+# Content negotiation: request bodies may be msgpack (Content-Type
+# application/msgpack) and jsonify() answers in msgpack when the Accept header
+# prefers it. JSON stays the default, and msgpack is only needed once a peer
+# asks for it.
+WIRE_MSGPACK = wire.available()
+WIRE_MIMETYPES = [wire.JSON_MIMETYPE, *sorted(wire.MSGPACK_MIMETYPES)]  # JSON wins ties
+
+class WireRequest(Request):
+    def get_json(self, force=False, silent=False, cache=True):
+        if WIRE_MSGPACK and self.mimetype in wire.MSGPACK_MIMETYPES:
+            try:
+                return wire.unpack(self.get_data(cache=cache))
+            except ValueError as e:
+                if silent:
+                    return None
+                return self.on_json_loading_failed(e)
+        return super().get_json(force=force, silent=silent, cache=cache)
+
+def wants_msgpack():
+    # The substring test keeps Accept parsing off requests that never mention msgpack
+    return (WIRE_MSGPACK and 'msgpack' in request.headers.get('Accept', '')
+            and request.accept_mimetypes.best_match(WIRE_MIMETYPES) in wire.MSGPACK_MIMETYPES)
+
+class WireJSONProvider(DefaultJSONProvider):
+    def response(self, *args, **kwargs):
+        if has_request_context() and wants_msgpack():
+            obj = args[0] if len(args) == 1 else (args or kwargs)
+            return self._app.response_class(wire.pack(obj), mimetype=wire.MSGPACK_MIMETYPE)
+        return super().response(*args, **kwargs)
 
 app = Flask(__name__)
+app.request_class = WireRequest
+app.json = WireJSONProvider(app)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+TASK_COLUMNS = ['id', 'description', 'status', 'result', 'worker_id',
+                'created_at', 'completed_at', 'lease_expires_at', 'priority', 'queue',
+                'description_blob', 'result_blob', 'requires', 'min_cores', 'min_memory', 'affinity_key']
+TASK_SELECT = f"SELECT {', '.join(TASK_COLUMNS)} FROM tasks"
+
+# Metrics are aggregated per thread, so recording one never takes a lock
+REQUEST_SECONDS = metrics.Histogram('scheduler_request_duration_seconds',
+                                    'HTTP request latency by route', label='route')
+COMMIT_SECONDS = metrics.Histogram('scheduler_db_commit_duration_seconds',
+                                   'Time spent in SQLite commits')
+LOCK_WAIT_SECONDS = metrics.Histogram('scheduler_lock_wait_seconds',
+                                      'Time spent waiting for a contended lock', label='lock')
+TASK_WAIT_SECONDS = metrics.Histogram('scheduler_task_wait_seconds',
+                                      'Time from submission until a worker claims the task',
+                                      buckets=metrics.DURATION_BUCKETS)
+TASK_RUN_SECONDS = metrics.Histogram('scheduler_task_run_seconds',
+                                     'Time from claim until the worker reports completion',
+                                     buckets=metrics.DURATION_BUCKETS)
+TASKS_SUBMITTED = metrics.Counter('scheduler_tasks_submitted_total', 'Tasks accepted')
+DUPLICATE_SUBMISSIONS = metrics.Counter('scheduler_duplicate_submissions_total',
+                                        'Submissions answered with an existing task by idempotency key',
+                                        label='source')
+TASKS_REQUEUED = metrics.Counter('scheduler_tasks_requeued_total',
+                                 'Leased tasks returned to the queue', label='reason')
+SUBMISSIONS_REJECTED = metrics.Counter('scheduler_submissions_rejected_total',
+                                       'Submit requests refused with 429 by admission control', label='reason')
+
+def ensure_column(c, table, column, decl):
+    # Add columns introduced after a database file was first created
+    c.execute(f'PRAGMA table_info({table})')
+    if column not in [row[1] for row in c.fetchall()]:
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {decl}')
+
+# Storage configuration
+DB_PATH = 'tasks.db'
+DB_POOL_SIZE = 16  # Persistent connections shared by request handlers
+DB_CACHE_SIZE_KB = 64 * 1024  # Page cache per connection
+DB_MMAP_SIZE = 256 * 1024 * 1024  # Bytes of the database file to memory-map
+DB_STATEMENT_CACHE = 256  # Prepared statements kept per connection
+
+db_pool = queue.Queue()
+db_pool_lock = threading.Lock()
+db_pool_created = 0
+
+def connect_db():
+    conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False,
+                           cached_statements=DB_STATEMENT_CACHE)
+    # WAL lets readers proceed while a writer commits; NORMAL sync is safe under WAL
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+def acquire_db():
+    global db_pool_created
+    try:
+        return db_pool.get_nowait()
+    except queue.Empty:
+        pass
+    
+    with db_pool_lock:
+        if db_pool_created < DB_POOL_SIZE:
+            db_pool_created += 1
+            try:
+                return connect_db()
+            except sqlite3.Error:
+                db_pool_created -= 1
+                raise
+    return db_pool.get()
+
+def release_db(conn):
+    # Never hand a half-finished transaction to the next borrower
+    if conn.in_transaction:
+        conn.rollback()
+    db_pool.put(conn)
+
+def init_db_pool():
+    # Open every pooled connection up front so none is opened on a request
+    conns = [acquire_db() for _ in range(DB_POOL_SIZE)]
+    for conn in conns:
+        release_db(conn)
+
+# Group commit: one writer thread batches small mutations into shared transactions
+WRITE_BATCH_SIZE = 256  # Flush after this many queued writes
+WRITE_FLUSH_INTERVAL = 0.005  # Or after this many seconds, whichever comes first
+
+write_queue = queue.Queue()  # PendingWrite entries
+
+class PendingWrite:
+    __slots__ = ('sql', 'params', 'done', 'error', 'rowcount')
+    
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.params = params
+        self.done = threading.Event()
+        self.error = None
+        self.rowcount = 0  # Rows the write changed, once it has committed
+
+def queue_write(sql, params):
+    # Queue a mutation without waiting; writes commit in the order they were queued
+    write = PendingWrite(sql, params)
+    write_queue.put(write)
+    return write
+
+def wait_for_write(write):
+    write.done.wait()
+    if write.error:
+        raise write.error
+
+def submit_write(sql, params):
+    # Queue a mutation and block until the batch containing it has committed
+    wait_for_write(queue_write(sql, params))
+
+def timed_commit(conn):
+    started = time.perf_counter()
+    conn.commit()
+    COMMIT_SECONDS.observe(time.perf_counter() - started)
+
+def flush_writes(conn, writes):
+    # Any exception lands on its write: the writer thread must outlive bad parameters
+    c = conn.cursor()
+    try:
+        for write in writes:
+            try:
+                c.execute(write.sql, write.params)
+                write.rowcount = c.rowcount
+            except Exception as e:
+                write.error = e
+        timed_commit(conn)
+    except Exception as e:
+        logger.error(f"Write batch failed: {str(e)}")
+        if conn.in_transaction:
+            conn.rollback()
+        for write in writes:
+            write.error = write.error or e
+            write.rowcount = 0
+    finally:
+        # Replies are released only once their batch is durable
+        for write in writes:
+            write.done.set()
+
+def write_behind_loop():
+    conn = connect_db()
+    while True:
+        batch = [write_queue.get()]
+        deadline = time.monotonic() + WRITE_FLUSH_INTERVAL
+        while len(batch) < WRITE_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(write_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            flush_writes(conn, batch)
+        except Exception as e:
+            # Waiters were already released with the error; keep serving later writes
+            logger.error(f"Write-behind error: {str(e)}")
+
 # Initialize database
 def init_db():
-    conn = sqlite3.connect('tasks.db', timeout=10)
+    conn = sqlite3.connect(DB_PATH, timeout=10)
     c = conn.cursor()
+    # Must precede the first table (and WAL switch) on a new file; existing files need a manual VACUUM
+    c.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    c.execute('PRAGMA journal_mode=WAL')
     c.execute('''CREATE TABLE IF NOT EXISTS tasks
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
                   description TEXT,
@@ -22,65 +240,843 @@ def init_db():
                   result TEXT,
                   worker_id INTEGER,
                   created_at TIMESTAMP,
-                  completed_at TIMESTAMP)''')
+                  completed_at TIMESTAMP,
+                  lease_expires_at REAL,
+                  priority INTEGER NOT NULL DEFAULT 0,
+                  queue TEXT NOT NULL DEFAULT 'default')''')
+    ensure_column(c, 'tasks', 'lease_expires_at', 'REAL')
+    ensure_column(c, 'tasks', 'priority', 'INTEGER NOT NULL DEFAULT 0')
+    ensure_column(c, 'tasks', 'queue', "TEXT NOT NULL DEFAULT 'default'")
+    ensure_column(c, 'tasks', 'idempotency_key', 'TEXT')
+    # sha256 of a description or result kept in the blob store instead of the row
+    ensure_column(c, 'tasks', 'description_blob', 'TEXT')
+    ensure_column(c, 'tasks', 'result_blob', 'TEXT')
+    # Placement: comma-separated tags a worker must have, minimum cores and memory (MB),
+    # and a key whose tasks prefer the worker that ran the last one
+    ensure_column(c, 'tasks', 'requires', 'TEXT')
+    ensure_column(c, 'tasks', 'min_cores', 'INTEGER NOT NULL DEFAULT 0')
+    ensure_column(c, 'tasks', 'min_memory', 'INTEGER NOT NULL DEFAULT 0')
+    ensure_column(c, 'tasks', 'affinity_key', 'TEXT')
+    # A client-chosen key identifies a submission so retries return the original task
+    c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_tasks_idempotency_key ON tasks(idempotency_key)
+                 WHERE idempotency_key IS NOT NULL''')
+    # Partial indexes covering only unfinished tasks, used by recovery and the lease sweep
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_tasks_pending ON tasks(id)
+                 WHERE status = 'pending' ''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_tasks_processing ON tasks(lease_expires_at)
+                 WHERE status = 'processing' ''')
+    # The archive pass finds expired completed tasks oldest first
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_tasks_completed_at ON tasks(completed_at)
+                 WHERE status = 'completed' ''')
+    # The partial indexes serve every status lookup a plain status index did
+    c.execute('DROP INDEX IF EXISTS idx_tasks_status')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tasks_worker_status ON tasks(worker_id, status)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks(created_at)')
+    # Completed tasks past the retention window, one zlib-compressed JSON row each
+    c.execute('''CREATE TABLE IF NOT EXISTS tasks_archive
+                 (id INTEGER PRIMARY KEY,
+                  archived_at TIMESTAMP,
+                  payload BLOB)''')
+    # Dependency edges: task_id stays 'blocked' until every parent_id has completed
+    c.execute('''CREATE TABLE IF NOT EXISTS task_deps
+                 (task_id INTEGER NOT NULL,
+                  parent_id INTEGER NOT NULL,
+                  PRIMARY KEY (task_id, parent_id))''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_task_deps_parent ON task_deps(parent_id)')
+    # One lifecycle trace per task, for the latest attempt; epoch seconds throughout
+    c.execute('''CREATE TABLE IF NOT EXISTS task_traces
+                 (task_id INTEGER PRIMARY KEY,
+                  queued_at REAL,
+                  fetched_at REAL,
+                  acknowledged_at REAL,
+                  started_at REAL,
+                  finished_at REAL,
+                  committed_at REAL,
+                  worker_id INTEGER,
+                  requeues INTEGER NOT NULL DEFAULT 0,
+                  ack_conflicts INTEGER NOT NULL DEFAULT 0)''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_task_traces_committed_at ON task_traces(committed_at)')
     c.execute('''CREATE TABLE IF NOT EXISTS workers
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
                   last_heartbeat TIMESTAMP,
-                  status TEXT)''')
+                  status TEXT,
+                  capacity INTEGER)''')
+    ensure_column(c, 'workers', 'capacity', 'INTEGER')
+    ensure_column(c, 'workers', 'cores', 'INTEGER')
+    ensure_column(c, 'workers', 'memory_mb', 'INTEGER')
+    ensure_column(c, 'workers', 'tags', 'TEXT')
     conn.commit()
     conn.close()
 
-init_db()
+# Payloads and results above BLOB_THRESHOLD bytes live in a content-addressed
+# blob store; the row keeps only their hash. Shards may share one directory.
+BLOB_DIR = 'blobs'
+BLOB_THRESHOLD = 64 * 1024
+BLOB_COMPRESSION = 'zlib'  # 'zlib', 'zstd' (needs zstandard) or 'none'
+BLOB_STORE = BlobStore(BLOB_DIR, BLOB_COMPRESSION)
+
+def offload(text):
+    # Returns (text, None) for small values, or (None, blob hash) for large ones
+    if text is None:
+        return None, None
+    data = text.encode()
+    if len(data) <= BLOB_THRESHOLD:
+        return text, None
+    return None, BLOB_STORE.put(data)
+
+# Sharding: each shard is its own coordinator process with its own database.
+# Sharded ids are seq * MAX_SHARDS + SHARD_ID, so any id names its shard.
+SHARD_ID = 0
+NUM_SHARDS = 1
+task_id_lock = threading.Lock()
+next_task_id = None  # Set by init_task_ids() at startup
+
+def task_id_stride():
+    return MAX_SHARDS if NUM_SHARDS > 1 else 1
+
+def init_task_ids():
+    # Continue after every id this shard has handed out, including archived and deleted ones
+    global next_task_id
+    conn = acquire_db()
+    try:
+        c = conn.cursor()
+        c.execute('''SELECT MAX(id) FROM (
+                         SELECT MAX(id) AS id FROM tasks
+                         UNION ALL SELECT MAX(id) FROM tasks_archive
+                         UNION ALL SELECT seq FROM sqlite_sequence WHERE name = 'tasks')''')
+        max_id = c.fetchone()[0] or 0
+    finally:
+        release_db(conn)
+    stride = task_id_stride()
+    candidate = max_id // stride * stride + SHARD_ID
+    with task_id_lock:
+        next_task_id = candidate if candidate > max_id else candidate + stride
+
+def allocate_task_ids(count):
+    # Ids are never reused; a failed insert just leaves a gap
+    global next_task_id
+    stride = task_id_stride()
+    with task_id_lock:
+        first = next_task_id
+        next_task_id += count * stride
+    return range(first, first + count * stride, stride)
+
+def foreign_shard(task_id):
+    # Returns the owning shard for an id that does not belong here, else None
+    shard = shard_for_task(task_id, NUM_SHARDS)
+    return shard if shard != SHARD_ID else None
 
 # Worker and task management
-TASK_QUEUE = []
+QUEUE_WEIGHTS = {}  # Queue name -> dequeue weight; unlisted queues weigh 1
+MAX_QUEUE_NAME_LENGTH = 128
+# Tasks may require worker tags, cores or memory, and may carry an affinity key.
+# TASK_QUEUE keeps a queue per distinct requirement and a local queue per worker
+# for affinity, so a claim only looks at queues the worker can serve.
+STEAL_THRESHOLD = 8  # Local backlog at which other workers may take a worker's affinity tasks
+LOCAL_QUEUE_LIMIT = 64  # Affinity tasks queued for one worker before the rest go to the shared queues
+AFFINITY_CACHE_SIZE = 100000  # Affinity keys remembered with the worker that last ran them
+AFFINITY_TTL = 3600  # Seconds an affinity key stays bound to a worker
+MAX_TAGS = 32
+MAX_TAG_LENGTH = 64
+MAX_AFFINITY_KEY_LENGTH = 256
+MAX_TASK_CORES = 4096  # Larger min_cores / min_memory requests are rejected: no worker could run them
+MAX_TASK_MEMORY_MB = 1 << 24
+NO_PLACEMENT = (NO_REQUIREMENTS, None)
+TASK_QUEUE = Dispatcher(QUEUE_WEIGHTS, STEAL_THRESHOLD, LOCAL_QUEUE_LIMIT, AFFINITY_CACHE_SIZE, AFFINITY_TTL)
+RECOVERY_BATCH_SIZE = 10000  # Rows fetched per round trip while rebuilding the queue
+RECOVERY_STATS = {}  # Filled in by recover_task_queue() at startup
+
+# Archival of completed tasks
+ARCHIVE_RETENTION = 7 * 24 * 3600  # Seconds a completed task stays in the hot table
+ARCHIVE_INTERVAL = 60  # Seconds between archive passes
+ARCHIVE_BATCH_SIZE = 1000  # Rows moved per transaction
+ARCHIVE_BATCH_PAUSE = 0.05  # Seconds to pause between batches within a pass
+VACUUM_PAGES = 1000  # Free pages returned to the filesystem per pass
 HEARTBEAT_INTERVAL = 5
 WORKER_TIMEOUT = 15
-workers_lock = threading.Lock()
-queue_lock = threading.Lock()
+LEASE_DURATION = 60  # Seconds a claimed task may go unrenewed before it is requeued
+MAX_CLAIM_BATCH = 100
+MAX_SUBMIT_BATCH = 100000
+MAX_STATUS_BATCH = 10000  # Ids per /status_batch or /watch request
+MAX_REPORT_BATCH = 1000  # Results or failed ids per /report request
+MAX_DEPENDENCIES = 1000  # Parent ids per task
+MIN_ROW_ID, MAX_ROW_ID = -2 ** 63, 2 ** 63 - 1  # SQLite's integer range; larger ids cannot be bound
+STATUS_BATCH_CHUNK = 500  # Ids per IN (...) query, under SQLite's variable limit
+MAX_LONG_POLL = 30  # Longest a fetch may wait for work, in seconds
+MAX_IDEMPOTENCY_KEY_LENGTH = 256
+IDEMPOTENCY_CACHE_SIZE = 100000  # Recent keys answered without touching the database
+IDEMPOTENCY_TTL = 3600  # Seconds a key stays cached; the unique index still dedups after that
+IDEMPOTENCY_CACHE = KeyCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+idempotency_lock = threading.Lock()
+
+# Admission control for /submit and /submit_batch: a token bucket per client
+# (X-Client-Id header, else its address) and a global high-water mark on
+# pending tasks. Worker traffic (heartbeats, claims, completions) is never
+# throttled, so a submission flood cannot get healthy workers marked failed.
+SUBMIT_RATE = 0  # Tasks per second each client may submit; 0 disables rate limiting
+SUBMIT_BURST = 1000  # Tasks a client may submit at once after being idle
+QUEUE_HIGH_WATER = 1000000  # Pending tasks at which new submissions are refused; 0 disables
+OVERLOAD_RETRY_AFTER = 5  # Seconds clients are asked to wait while the queue is full
+MAX_RATE_LIMIT_CLIENTS = 10000  # Client buckets kept in memory
+SUBMIT_LIMITER = RateLimiter(SUBMIT_RATE, SUBMIT_BURST, MAX_RATE_LIMIT_CLIENTS)
+rate_limit_lock = threading.Lock()
+workers_lock = metrics.TimedLock(LOCK_WAIT_SECONDS, 'workers_lock')
+queue_lock = metrics.TimedLock(LOCK_WAIT_SECONDS, 'queue_lock')
+queue_changed = threading.Condition(queue_lock)  # Notified when tasks become claimable
+queue_listeners = []  # Callables told how many tasks just became claimable
+
+# Tasks waiting on unfinished parents, guarded by queue_lock. A child enters
+# TASK_QUEUE as soon as its last parent completes; task_deps in the database
+# lets recover_task_queue() rebuild both maps after a restart.
+blocked_tasks = {}  # task id -> (set of unfinished parent ids, priority, queue)
+task_dependents = {}  # parent id -> set of blocked child ids
+# Parents of dependent submissions still being written: parent id -> [submissions
+# watching it, whether it completed meanwhile]. Lets a submission read parent
+# status and commit without holding queue_lock, then catch a parent that
+# completed in between.
+watched_parents = {}
+
+# Lifecycle tracing. Each phase boundary upserts the task's task_traces row
+# inside a transaction the transition already has, or through the group-commit
+# writer without waiting. queued_at stays NULL until a task is requeued or
+# unblocked, meaning it has been queued since created_at. started_at and
+# finished_at come from the worker's clock.
+TRACING = True
+TRACE_SUMMARY_WINDOW = 3600  # Default /trace/summary window, in seconds
+MAX_TRACE_SUMMARY_ROWS = 100000  # Most recent traces aggregated per summary
+TRACE_PHASES = [
+    ('queued', 'queued_at', 'fetched_at'),
+    ('acknowledge', 'fetched_at', 'acknowledged_at'),
+    ('dispatch', 'acknowledged_at', 'started_at'),
+    ('run', 'started_at', 'finished_at'),
+    ('report', 'finished_at', 'committed_at'),
+    ('total', 'created_at', 'committed_at'),
+]
+
+def trace_sql(*columns):
+    # Upsert setting the given columns on a task's trace; parameters are task_id then the columns
+    assignments = ', '.join(f'{column} = excluded.{column}' for column in columns)
+    return (f"INSERT INTO task_traces (task_id, {', '.join(columns)}) VALUES (?{', ?' * len(columns)}) "
+            f"ON CONFLICT(task_id) DO UPDATE SET {assignments}")
+
+TRACE_QUEUED_SQL = trace_sql('queued_at')
+TRACE_FETCHED_SQL = trace_sql('fetched_at')
+TRACE_ACKNOWLEDGED_SQL = trace_sql('acknowledged_at', 'worker_id')
+TRACE_CLAIMED_SQL = trace_sql('fetched_at', 'acknowledged_at', 'worker_id')
+TRACE_FINISHED_SQL = trace_sql('started_at', 'finished_at', 'committed_at')
+# A requeue starts a new attempt, so the previous attempt's timestamps are cleared
+TRACE_REQUEUED_SQL = '''INSERT INTO task_traces (task_id, queued_at, requeues) VALUES (?, ?, 1)
+                        ON CONFLICT(task_id) DO UPDATE SET queued_at = excluded.queued_at,
+                        requeues = requeues + 1, fetched_at = NULL, acknowledged_at = NULL,
+                        started_at = NULL, finished_at = NULL, worker_id = NULL'''
+TRACE_ACK_CONFLICT_SQL = 'UPDATE task_traces SET ack_conflicts = ack_conflicts + 1 WHERE task_id = ?'
+
+def trace_requeued(c, task_ids):
+    # Within the caller's transaction
+    if TRACING and task_ids:
+        now = time.time()
+        c.executemany(TRACE_REQUEUED_SQL, [(task_id, now) for task_id in task_ids])
+
+def notify_tasks_available(count=1):
+    # Caller holds queue_lock. Tasks that suit only some workers wake every parked
+    # fetch to check whether one of them is its own; shared tasks suit anyone, so
+    # waking count fetches is enough.
+    if count and TASK_QUEUE.restricted_pushed:
+        TASK_QUEUE.restricted_pushed = False
+        queue_changed.notify_all()
+        count = math.inf
+    else:
+        queue_changed.notify(count)
+    for listener in queue_listeners:
+        listener(count)
+
+# Task state transitions pushed to /watch subscribers
+TERMINAL_STATUSES = {'completed'}
+WATCH_KEEPALIVE = 15  # Seconds between keepalive comments on an idle stream
+watchers_lock = threading.Lock()
+task_watchers = {}  # task_id -> set of deliver callables
+queue_watchers = {}  # queue name -> set of deliver callables
+
+def publish_task_event(task_id, status, queue_name=None):
+    if not task_watchers and not queue_watchers:
+        return
+    event = {'id': task_id, 'status': status, 'queue': queue_name}
+    with watchers_lock:
+        targets = set(task_watchers.get(task_id, ()))
+        if queue_name is not None:
+            targets.update(queue_watchers.get(queue_name, ()))
+    for deliver in targets:
+        deliver(event)
+
+def subscribe(task_ids, queue_name, deliver):
+    with watchers_lock:
+        for task_id in task_ids:
+            task_watchers.setdefault(task_id, set()).add(deliver)
+        if queue_name is not None:
+            queue_watchers.setdefault(queue_name, set()).add(deliver)
+
+def unsubscribe(task_ids, queue_name, deliver):
+    with watchers_lock:
+        for task_id in task_ids:
+            subscribers = task_watchers.get(task_id)
+            if subscribers is not None:
+                subscribers.discard(deliver)
+                if not subscribers:
+                    del task_watchers[task_id]
+        if queue_name is not None:
+            subscribers = queue_watchers.get(queue_name)
+            if subscribers is not None:
+                subscribers.discard(deliver)
+                if not subscribers:
+                    del queue_watchers[queue_name]
+
+# Worker liveness lives in memory; the workers table only records transitions
+worker_heartbeats = {}  # worker_id -> time.time() of the last heartbeat, active workers only
+worker_deadlines = []  # Min-heap of (deadline, worker_id); stale entries are re-armed lazily
+liveness_changed = threading.Condition(workers_lock)
+failed_workers = set()  # Workers marked failed and not heard from since, for /metrics
+
+# Slot accounting so a worker is never leased more tasks than it can hold
+worker_capacity = {}  # worker_id -> max tasks held at once; absent means unlimited
+worker_leases = {}  # worker_id -> set of task ids currently leased to it
+lease_started = {}  # task_id -> time.time() it was claimed, for run time metrics
+lease_queues = {}  # task_id -> queue name while leased, so watch events need no lookup
+
+def available_slots(worker_id, wanted):
+    # Caller holds workers_lock
+    capacity = worker_capacity.get(worker_id)
+    if capacity is None:
+        return wanted
+    return max(0, min(wanted, capacity - len(worker_leases.get(worker_id, ()))))
+
+def drop_leases(worker_id, task_ids):
+    # Returns {task_id: queue name} for the tasks that were leased
+    queues = {}
+    with workers_lock:
+        leases = worker_leases.get(worker_id)
+        if leases:
+            leases.difference_update(task_ids)
+        for task_id in task_ids:
+            lease_started.pop(task_id, None)
+            queue_name = lease_queues.pop(task_id, None)
+            if queue_name is not None:
+                queues[task_id] = queue_name
+    return queues
+
+def track_worker(worker_id, now):
+    # Caller holds workers_lock; returns True if the worker was not already active
+    is_new = worker_id not in worker_heartbeats
+    worker_heartbeats[worker_id] = now
+    if is_new:
+        failed_workers.discard(worker_id)
+        heapq.heappush(worker_deadlines, (now + WORKER_TIMEOUT, worker_id))
+        liveness_changed.notify()
+    return is_new
+
+def load_worker_liveness():
+    # Workers active before a restart get a fresh timeout to reconnect
+    conn = acquire_db()
+    try:
+        c = conn.cursor()
+        c.execute("SELECT id, capacity, cores, memory_mb, tags FROM workers WHERE status = 'active'")
+        workers = c.fetchall()
+        c.execute("SELECT id FROM workers WHERE status = 'failed'")
+        failed = [row[0] for row in c.fetchall()]
+        c.execute("SELECT worker_id, id, queue FROM tasks WHERE status = 'processing'")
+        leases = c.fetchall()
+        
+        now = time.time()
+        with workers_lock:
+            failed_workers.update(failed)
+            for worker_id, capacity, _, _, _ in workers:
+                track_worker(worker_id, now)
+                if capacity is not None:
+                    worker_capacity[worker_id] = capacity
+            for worker_id, task_id, queue_name in leases:
+                worker_leases.setdefault(worker_id, set()).add(task_id)
+                lease_queues[task_id] = queue_name
+        with queue_lock:
+            for worker_id, _, cores, memory_mb, tags in workers:
+                TASK_QUEUE.set_worker(worker_id, (cores or 0, memory_mb or 0, split_tags(tags)))
+    finally:
+        release_db(conn)
+
+def parse_idempotency_key(key):
+    # Returns the key, None when absent, or False when malformed
+    if key is None:
+        return None
+    if not isinstance(key, str) or not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        return False
+    return key
+
+def is_row_id(value):
+    return isinstance(value, int) and not isinstance(value, bool) and MIN_ROW_ID <= value <= MAX_ROW_ID
+
+def is_count(value):
+    return is_row_id(value) and value >= 0
+
+def parse_tags(values):
+    # Returns a frozenset of tags (empty when absent), or None if malformed
+    if values is None:
+        return frozenset()
+    if not isinstance(values, list) or len(values) > MAX_TAGS:
+        return None
+    if not all(isinstance(tag, str) and 0 < len(tag) <= MAX_TAG_LENGTH and ',' not in tag
+               for tag in values):
+        return None
+    return frozenset(values)
+
+def join_tags(tags):
+    # Stored as comma-separated text, NULL when empty
+    return ','.join(sorted(tags)) or None
+
+def split_tags(text):
+    return frozenset(text.split(',')) if text else frozenset()
+
+def parse_placement(task_data):
+    # Returns ((tags, cores, memory), affinity key) or None if malformed
+    tags = parse_tags(task_data.get('requires'))
+    min_cores = task_data.get('min_cores', 0)
+    min_memory = task_data.get('min_memory', 0)
+    affinity_key = task_data.get('affinity_key')
+    if tags is None or not is_count(min_cores) or not is_count(min_memory):
+        return None
+    if min_cores > MAX_TASK_CORES or min_memory > MAX_TASK_MEMORY_MB:
+        return None
+    if affinity_key is not None and (not isinstance(affinity_key, str) or not affinity_key
+                                     or len(affinity_key) > MAX_AFFINITY_KEY_LENGTH):
+        return None
+    return (tags, min_cores, min_memory), affinity_key
+
+def placement_columns(placement):
+    # Values for the requires, min_cores, min_memory and affinity_key columns
+    (tags, min_cores, min_memory), affinity_key = placement
+    return join_tags(tags), min_cores, min_memory, affinity_key
+
+def parse_profile(data):
+    # A worker's (cores, memory in MB, tags), or None if it did not describe itself.
+    # Invalid values count as absent, like an invalid capacity.
+    if not any(key in data for key in ('cores', 'memory_mb', 'tags')):
+        return None
+    cores = data.get('cores')
+    memory_mb = data.get('memory_mb')
+    return (cores if is_count(cores) else 0, memory_mb if is_count(memory_mb) else 0,
+            parse_tags(data.get('tags')) or frozenset())
+
+def parse_task_fields(task_data):
+    # Returns (description, priority, queue, idempotency key, placement) or None if the task is malformed
+    if isinstance(task_data, str):
+        return task_data, 0, DEFAULT_QUEUE, None, NO_PLACEMENT
+    if not isinstance(task_data, dict) or not isinstance(task_data.get('description'), str):
+        return None
+    
+    priority = task_data.get('priority', 0)
+    queue_name = task_data.get('queue', DEFAULT_QUEUE)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        return None
+    if not isinstance(queue_name, str) or not queue_name or len(queue_name) > MAX_QUEUE_NAME_LENGTH:
+        return None
+    idempotency_key = parse_idempotency_key(task_data.get('idempotency_key'))
+    placement = parse_placement(task_data)
+    if idempotency_key is False or placement is None:
+        return None
+    return task_data['description'], priority, queue_name, idempotency_key, placement
+
+def parse_dependencies(values):
+    # Returns a list of parent task ids (empty when absent), or None if malformed
+    if values is None:
+        return []
+    if not isinstance(values, list) or len(values) > MAX_DEPENDENCIES:
+        return None
+    if not all(is_row_id(task_id) for task_id in values):
+        return None
+    return list(dict.fromkeys(values))
+
+def insert_dependent_task(conn, task_id, row, depends_on):
+    # Insert a task with parents and either queue it or register it as blocked.
+    # The parents are watched from before their status is read until the child
+    # is indexed, so one that completes in between is not missed even though
+    # the reads and the commit run outside queue_lock. Returns the new status.
+    c = conn.cursor()
+    description, priority, queue_name, idempotency_key, description_blob, placement = row
+    with queue_lock:
+        for parent_id in depends_on:
+            watched_parents.setdefault(parent_id, [0, False])[0] += 1
+    committed = False
+    try:
+        statuses = {}
+        for start in range(0, len(depends_on), STATUS_BATCH_CHUNK):
+            chunk = depends_on[start:start + STATUS_BATCH_CHUNK]
+            placeholders = ', '.join('?' * len(chunk))
+            c.execute(f'SELECT id, status FROM tasks WHERE id IN ({placeholders})', chunk)
+            statuses.update(c.fetchall())
+        for parent_id in depends_on:
+            # Archived tasks were completed
+            if parent_id not in statuses and load_archived_task(c, parent_id):
+                statuses[parent_id] = 'completed'
+        unknown = [parent_id for parent_id in depends_on if parent_id not in statuses]
+        if unknown:
+            raise ValueError(f"Unknown dependencies {unknown}")
+        unfinished = {parent_id for parent_id in depends_on if statuses[parent_id] != 'completed'}
+        
+        status = 'blocked' if unfinished else 'pending'
+        c.execute('''INSERT INTO tasks (id, description, status, created_at, priority, queue,
+                                       idempotency_key, description_blob, requires, min_cores,
+                                       min_memory, affinity_key)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                  (task_id, description, status, datetime.now(), priority, queue_name,
+                   idempotency_key, description_blob, *placement_columns(placement)))
+        c.executemany('INSERT INTO task_deps (task_id, parent_id) VALUES (?, ?)',
+                      [(task_id, parent_id) for parent_id in depends_on])
+        timed_commit(conn)
+        committed = True
+    finally:
+        with queue_lock:
+            for parent_id in depends_on:
+                watch = watched_parents[parent_id]
+                if committed and watch[1]:
+                    unfinished.discard(parent_id)
+                watch[0] -= 1
+                if not watch[0]:
+                    del watched_parents[parent_id]
+            if committed:
+                TASK_QUEUE.set_spec(task_id, *placement)
+                if unfinished:
+                    blocked_tasks[task_id] = (unfinished, priority, queue_name)
+                    for parent_id in unfinished:
+                        task_dependents.setdefault(parent_id, set()).add(task_id)
+    
+    if unfinished:
+        logger.info("Task %s blocked on %s", task_id, sorted(unfinished))
+        return status
+    if status == 'blocked':
+        # Its last parent completed while the row was being written
+        queue_ready([(task_id, priority, queue_name)])
+    else:
+        with queue_lock:
+            TASK_QUEUE.push(task_id, priority, queue_name)
+            notify_tasks_available()
+    logger.info("Task %s added to queue", task_id)
+    return 'pending'
+
+def unblock_dependents(parent_ids):
+    # Queue the children whose last unfinished parent is among parent_ids
+    if not task_dependents and not watched_parents:
+        return
+    ready = []
+    with queue_lock:
+        for parent_id in parent_ids:
+            watch = watched_parents.get(parent_id)
+            if watch is not None:
+                watch[1] = True
+            for child_id in task_dependents.pop(parent_id, ()):
+                unfinished, priority, queue_name = blocked_tasks[child_id]
+                unfinished.discard(parent_id)
+                if not unfinished:
+                    del blocked_tasks[child_id]
+                    ready.append((child_id, priority, queue_name))
+    if not ready:
+        return
+    queue_ready(ready)
+    for task_id, _, queue_name in ready:
+        publish_task_event(task_id, 'pending', queue_name)
+    logger.info("Tasks %s unblocked", [entry[0] for entry in ready])
+
+def queue_ready(ready):
+    # Move blocked tasks, as (task id, priority, queue), into TASK_QUEUE.
+    # Claims only take 'pending' rows, so the status must be durable before the push.
+    # If this write fails the children stay blocked until recovery re-derives them.
+    writes = []
+    for start in range(0, len(ready), STATUS_BATCH_CHUNK):
+        chunk = [entry[0] for entry in ready[start:start + STATUS_BATCH_CHUNK]]
+        placeholders = ', '.join('?' * len(chunk))
+        writes.append(queue_write(f'''UPDATE tasks SET status = 'pending'
+                                      WHERE status = 'blocked' AND id IN ({placeholders})''', chunk))
+    if TRACING:
+        now = time.time()
+        for task_id, _, _ in ready:
+            queue_write(TRACE_QUEUED_SQL, (task_id, now))
+    for write in writes:
+        wait_for_write(write)
+    with queue_lock:
+        for entry in ready:
+            TASK_QUEUE.push(*entry)
+        notify_tasks_available(len(ready))
+
+def cached_task_id(idempotency_key):
+    with idempotency_lock:
+        return IDEMPOTENCY_CACHE.get(idempotency_key)
+
+def remember_keys(pairs):
+    # pairs of (idempotency key, task id)
+    now = time.monotonic()
+    with idempotency_lock:
+        for idempotency_key, task_id in pairs:
+            IDEMPOTENCY_CACHE.put(idempotency_key, task_id, now)
+
+def find_task_keys(c, keys):
+    # (idempotency key, task id) for each of keys already stored
+    found = []
+    for start in range(0, len(keys), STATUS_BATCH_CHUNK):
+        chunk = keys[start:start + STATUS_BATCH_CHUNK]
+        placeholders = ', '.join('?' * len(chunk))
+        c.execute(f'SELECT idempotency_key, id FROM tasks WHERE idempotency_key IN ({placeholders})', chunk)
+        found.extend(c.fetchall())
+    return found
+
+def stored_duplicate(c, idempotency_key):
+    # The duplicate response for a key submitted before but no longer cached, or None
+    found = find_task_keys(c, [idempotency_key])
+    if not found:
+        return None
+    task_id = found[0][1]
+    remember_keys(found)
+    DUPLICATE_SUBMISSIONS.inc(1, 'database')
+    return jsonify({'task_id': task_id, 'status': 'submitted', 'duplicate': True})
+
+def client_identity():
+    return request.headers.get('X-Client-Id') or request.remote_addr
+
+def reject_submission(reason, message, retry_after):
+    SUBMISSIONS_REJECTED.inc(1, reason)
+    retry_after = max(1, math.ceil(retry_after))
+    return (jsonify({'error': message, 'retry_after': retry_after}), 429,
+            {'Retry-After': str(retry_after)})
+
+def admit_submission(count):
+    # Returns a 429 response if `count` new tasks must wait, else None
+    if QUEUE_HIGH_WATER and len(TASK_QUEUE) >= QUEUE_HIGH_WATER:
+        return reject_submission('queue_full', 'Queue is full', OVERLOAD_RETRY_AFTER)
+    if SUBMIT_RATE > 0:
+        with rate_limit_lock:
+            wait = SUBMIT_LIMITER.acquire(client_identity(), count)
+        if wait:
+            return reject_submission('rate_limit', 'Submission rate limit exceeded', wait)
+    return None
 
 @app.route('/submit', methods=['POST'])
 def submit_task():
     task_data = request.json
-    if not task_data or 'description' not in task_data:
+    fields = parse_task_fields(task_data) if isinstance(task_data, dict) else None
+    if fields and fields[3] is None:
+        # The key may also come as a header so retries of any body are covered
+        header_key = parse_idempotency_key(request.headers.get('Idempotency-Key'))
+        fields = fields[:3] + (header_key,) + fields[4:] if header_key is not False else None
+    depends_on = parse_dependencies(task_data.get('depends_on')) if fields else None
+    if not fields or depends_on is None:
         return jsonify({'error': 'Invalid task data'}), 400
+    description, priority, queue_name, idempotency_key, placement = fields
+    if any(foreign_shard(parent_id) is not None for parent_id in depends_on):
+        return jsonify({'error': 'Dependencies must belong to the same shard'}), 400
+    
+    if idempotency_key is not None:
+        task_id = cached_task_id(idempotency_key)
+        if task_id is not None:
+            DUPLICATE_SUBMISSIONS.inc(1, 'cache')
+            return jsonify({'task_id': task_id, 'status': 'submitted', 'duplicate': True})
     
+    conn = acquire_db()
     try:
-        conn = sqlite3.connect('tasks.db', timeout=10)
         c = conn.cursor()
-        c.execute('''INSERT INTO tasks (description, status, created_at)
-                     VALUES (?, ?, ?)''',
-                  (task_data['description'], 'pending', datetime.now()))
-        task_id = c.lastrowid
-        conn.commit()
+        if idempotency_key is not None:
+            # Retries are answered before admission, so they never count as new load
+            duplicate = stored_duplicate(c, idempotency_key)
+            if duplicate:
+                return duplicate
         
-        with queue_lock:
-            TASK_QUEUE.append(task_id)
-            logger.info(f"Task {task_id} added to queue")
+        rejected = admit_submission(1)
+        if rejected:
+            return rejected
+        
+        description, description_blob = offload(description)
+        task_id = allocate_task_ids(1)[0]
+        try:
+            if depends_on:
+                status = insert_dependent_task(conn, task_id, (description, priority, queue_name, idempotency_key,
+                                                               description_blob, placement), depends_on)
+            else:
+                c.execute('''INSERT INTO tasks (id, description, status, created_at, priority, queue,
+                                               idempotency_key, description_blob, requires, min_cores,
+                                               min_memory, affinity_key)
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                          (task_id, description, 'pending', datetime.now(), priority, queue_name,
+                           idempotency_key, description_blob, *placement_columns(placement)))
+                timed_commit(conn)
+                status = 'pending'
+        except ValueError as e:
+            conn.rollback()
+            return jsonify({'error': str(e)}), 400
+        except sqlite3.IntegrityError:
+            # A concurrent retry got there first
+            conn.rollback()
+            duplicate = stored_duplicate(c, idempotency_key)
+            if duplicate is None:
+                raise
+            return duplicate
+        if idempotency_key is not None:
+            remember_keys([(idempotency_key, task_id)])
+        
+        if not depends_on:
+            with queue_lock:
+                TASK_QUEUE.set_spec(task_id, *placement)
+                TASK_QUEUE.push(task_id, priority, queue_name)
+                notify_tasks_available()
+                logger.info("Task %s added to queue", task_id)
+        TASKS_SUBMITTED.inc()
+        publish_task_event(task_id, status, queue_name)
         
         return jsonify({'task_id': task_id, 'status': 'submitted'})
     
+    except OSError as e:
+        logger.error(f"Blob store error: {str(e)}")
+        return jsonify({'error': 'Payload storage failed'}), 500
+    except sqlite3.Error as e:
+        logger.error(f"Database error: {str(e)}")
+        return jsonify({'error': 'Database operation failed'}), 500
+    finally:
+        release_db(conn)
+
+def parse_task_batch():
+    # Accept a JSON or msgpack array (or {"tasks": [...]}), an NDJSON stream or msgpack frames of tasks
+    if request.mimetype == 'application/x-ndjson':
+        items = [json.loads(line) for line in request.get_data(as_text=True).splitlines()
+                 if line.strip()]
+    elif request.mimetype == wire.FRAMES_MIMETYPE and WIRE_MSGPACK:
+        items = wire.unpack_frames(request.get_data())
+    else:
+        items = request.get_json(silent=True)
+        if isinstance(items, dict):
+            items = items.get('tasks')
+    if not isinstance(items, list):
+        return None
+    
+    tasks = []
+    for item in items:
+        fields = parse_task_fields(item)
+        if not fields or (isinstance(item, dict) and item.get('depends_on')):
+            # Dependencies are only accepted by /submit
+            return None
+        tasks.append(fields)
+    return tasks
+
+@app.route('/submit_batch', methods=['POST'])
+def submit_batch():
+    try:
+        tasks = parse_task_batch()
+    except ValueError:
+        tasks = None
+    if tasks is None:
+        return jsonify({'error': 'Invalid task data'}), 400
+    if len(tasks) > MAX_SUBMIT_BATCH:
+        return jsonify({'error': f'Batch exceeds {MAX_SUBMIT_BATCH} tasks'}), 413
+    if not tasks:
+        return jsonify({'task_ids': [], 'status': 'submitted', 'duplicates': 0})
+    
+    # Resolve keys from the cache first; repeats within the batch follow their first occurrence
+    task_ids = [None] * len(tasks)
+    first_index = {}  # idempotency key -> index of its first occurrence in the batch
+    if any(task[3] is not None for task in tasks):
+        with idempotency_lock:
+            for i, task in enumerate(tasks):
+                if task[3] is not None and task[3] not in first_index:
+                    first_index[task[3]] = i
+                    task_ids[i] = IDEMPOTENCY_CACHE.get(task[3])
+    cache_hits = sum(1 for i in first_index.values() if task_ids[i] is not None)
+    
+    conn = acquire_db()
+    try:
+        c = conn.cursor()
+        found = find_task_keys(c, [key for key, i in first_index.items() if task_ids[i] is None])
+        for key, task_id in found:
+            task_ids[first_index[key]] = task_id
+        
+        new = [i for i, task in enumerate(tasks)
+               if task_ids[i] is None and (task[3] is None or first_index[task[3]] == i)]
+        if new:
+            # Only tasks that are not retries count against admission
+            rejected = admit_submission(len(new))
+            if rejected:
+                return rejected
+            # Large payloads are written to the blob store before taking the write lock
+            payloads = {i: offload(tasks[i][0]) for i in new}
+            keys = [tasks[i][3] for i in new if tasks[i][3] is not None]
+            if keys:
+                # Look again under the write lock, held through insert, for keys a concurrent submit added
+                c.execute('BEGIN IMMEDIATE')
+                raced = find_task_keys(c, keys)
+                for key, task_id in raced:
+                    task_ids[first_index[key]] = task_id
+                found.extend(raced)
+                new = [i for i in new if task_ids[i] is None]
+        if new:
+            for i, task_id in zip(new, allocate_task_ids(len(new))):
+                task_ids[i] = task_id
+            created_at = datetime.now()
+            c.executemany('''INSERT INTO tasks (id, description, status, created_at, priority, queue,
+                                               idempotency_key, description_blob, requires, min_cores,
+                                               min_memory, affinity_key)
+                             VALUES (?, ?, 'pending', ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                          ((task_ids[i], payloads[i][0], created_at, tasks[i][1], tasks[i][2], tasks[i][3],
+                            payloads[i][1], *placement_columns(tasks[i][4]))
+                           for i in new))
+        timed_commit(conn)
+        
+        for i, task in enumerate(tasks):
+            if task_ids[i] is None:
+                task_ids[i] = task_ids[first_index[task[3]]]
+        remember_keys(found + [(tasks[i][3], task_ids[i]) for i in new if tasks[i][3] is not None])
+        duplicates = len(tasks) - len(new)
+        if duplicates:
+            DUPLICATE_SUBMISSIONS.inc(cache_hits, 'cache')
+            DUPLICATE_SUBMISSIONS.inc(len(found), 'database')
+            DUPLICATE_SUBMISSIONS.inc(duplicates - cache_hits - len(found), 'batch')
+        
+        with queue_lock:
+            for i in new:
+                TASK_QUEUE.set_spec(task_ids[i], *tasks[i][4])
+                TASK_QUEUE.push(task_ids[i], tasks[i][1], tasks[i][2])
+            notify_tasks_available(len(new))
+        for i in new:
+            publish_task_event(task_ids[i], 'pending', tasks[i][2])
+        TASKS_SUBMITTED.inc(len(new))
+        logger.info("%d tasks added to queue", len(new))
+        
+        return jsonify({'task_ids': task_ids, 'status': 'submitted', 'duplicates': duplicates})
+    
+    except OSError as e:
+        logger.error(f"Blob store error: {str(e)}")
+        return jsonify({'error': 'Payload storage failed'}), 500
     except sqlite3.Error as e:
         logger.error(f"Database error: {str(e)}")
         return jsonify({'error': 'Database operation failed'}), 500
     finally:
-        conn.close()
+        release_db(conn)
 
 @app.route('/status/<int:task_id>', methods=['GET'])
 def get_status(task_id):
+    shard = foreign_shard(task_id)
+    if shard is not None:
+        return jsonify({'error': 'Task belongs to another shard', 'shard': shard}), 404
+    
+    conn = acquire_db()
     try:
-        conn = sqlite3.connect('tasks.db', timeout=10)
         c = conn.cursor()
-        c.execute('SELECT * FROM tasks WHERE id = ?', (task_id,))
+        c.execute(f'{TASK_SELECT} WHERE id = ?', (task_id,))
         task = c.fetchone()
         
-        if not task:
-            return jsonify({'error': 'Task not found'}), 404
+        if task:
+            task_dict = dict(zip(TASK_COLUMNS, task))
+        else:
+            task_dict = load_archived_task(c, task_id)
+            if not task_dict:
+                return jsonify({'error': 'Task not found'}), 404
         
-        columns = ['id', 'description', 'status', 'result', 'worker_id', 'created_at', 'completed_at']
-        task_dict = dict(zip(columns, task))
         task_dict['created_at'] = task_dict['created_at'] or None
         task_dict['completed_at'] = task_dict['completed_at'] or None
+        if task_dict['status'] == 'blocked':
+            with queue_lock:
+                entry = blocked_tasks.get(task_id)
+                task_dict['waiting_on'] = sorted(entry[0]) if entry else []
         
         return jsonify(task_dict)
     
@@ -88,52 +1084,259 @@ def get_status(task_id):
         logger.error(f"Database error: {str(e)}")
         return jsonify({'error': 'Database operation failed'}), 500
     finally:
-        conn.close()
+        release_db(conn)
+
+def fetch_tasks(c, task_ids):
+    # One primary-key lookup per chunk of ids, falling back to the archive
+    tasks = {}
+    for start in range(0, len(task_ids), STATUS_BATCH_CHUNK):
+        chunk = task_ids[start:start + STATUS_BATCH_CHUNK]
+        placeholders = ', '.join('?' * len(chunk))
+        c.execute(f'{TASK_SELECT} WHERE id IN ({placeholders})', chunk)
+        for row in c.fetchall():
+            tasks[row[0]] = dict(zip(TASK_COLUMNS, row))
+    for task_id in task_ids:
+        if task_id not in tasks:
+            archived = load_archived_task(c, task_id)
+            if archived:
+                tasks[task_id] = archived
+    return tasks
+
+def parse_task_ids(values):
+    if not isinstance(values, list) or len(values) > MAX_STATUS_BATCH:
+        return None
+    if not all(is_row_id(task_id) for task_id in values):
+        return None
+    return list(dict.fromkeys(values))
+
+@app.route('/status_batch', methods=['POST'])
+def get_status_batch():
+    data = request.get_json(silent=True) or {}
+    task_ids = parse_task_ids(data.get('task_ids'))
+    if task_ids is None:
+        return jsonify({'error': f'task_ids must be a list of at most {MAX_STATUS_BATCH} ids'}), 400
+    
+    conn = acquire_db()
+    try:
+        tasks = fetch_tasks(conn.cursor(), task_ids)
+        return jsonify({
+            'tasks': [tasks[task_id] for task_id in task_ids if task_id in tasks],
+            'missing': [task_id for task_id in task_ids if task_id not in tasks],
+        })
+    
+    except sqlite3.Error as e:
+        logger.error(f"Database error: {str(e)}")
+        return jsonify({'error': 'Database operation failed'}), 500
+    finally:
+        release_db(conn)
+
+def event_queue_name(task_id, queue_name):
+    # The queue for a task's watch event, given the name from lease state if known.
+    # Only a task no longer leased to anyone costs a lookup, and only while queues are watched.
+    if queue_name is None and queue_watchers:
+        return task_queue_name(task_id)
+    return queue_name
+
+def task_queue_name(task_id):
+    conn = acquire_db()
+    try:
+        c = conn.cursor()
+        c.execute('SELECT queue FROM tasks WHERE id = ?', (task_id,))
+        row = c.fetchone()
+        return row[0] if row else None
+    finally:
+        release_db(conn)
+
+def parse_watch_request(args, data):
+    # Returns (task_ids, queue_name) or None; watch ids, a queue, or both
+    if 'task_ids' in data:
+        task_ids = parse_task_ids(data['task_ids'])
+    elif args.get('ids'):
+        try:
+            task_ids = parse_task_ids([int(value) for value in args['ids'].split(',')])
+        except ValueError:
+            task_ids = None
+    else:
+        task_ids = []
+    queue_name = data.get('queue') or args.get('queue')
+    if task_ids is None or (not task_ids and not queue_name):
+        return None
+    return task_ids, queue_name
+
+def watch_snapshot(task_ids):
+    # Current state of each watched id, so no transition before subscribing is missed
+    if not task_ids:
+        return []
+    conn = acquire_db()
+    try:
+        tasks = fetch_tasks(conn.cursor(), task_ids)
+    finally:
+        release_db(conn)
+    return [{'id': task_id,
+             'status': tasks[task_id]['status'] if task_id in tasks else 'missing',
+             'queue': tasks[task_id]['queue'] if task_id in tasks else None}
+            for task_id in task_ids]
+
+def format_sse(event):
+    return f"event: task\ndata: {json.dumps(event)}\n\n"
+
+def watch_finished(event, remaining):
+    # An id-only watch ends once every id reached a terminal state
+    if event['status'] in TERMINAL_STATUSES or event['status'] == 'missing':
+        remaining.discard(event['id'])
+    return not remaining
+
+@app.route('/watch', methods=['GET', 'POST'])
+def watch_tasks():
+    parsed = parse_watch_request(request.args, request.get_json(silent=True) or {})
+    if parsed is None:
+        return jsonify({'error': 'Provide task ids and/or a queue to watch'}), 400
+    task_ids, queue_name = parsed
+    
+    events = queue.Queue()
+    subscribe(task_ids, queue_name, events.put)
+    try:
+        snapshot = watch_snapshot(task_ids)
+    except sqlite3.Error as e:
+        unsubscribe(task_ids, queue_name, events.put)
+        logger.error(f"Database error: {str(e)}")
+        return jsonify({'error': 'Database operation failed'}), 500
+    
+    def stream():
+        remaining = set(task_ids)
+        # WSGI servers only send headers with the first chunk, so open the stream now
+        yield ': watching\n\n'
+        for event in snapshot:
+            yield format_sse(event)
+            if watch_finished(event, remaining) and not queue_name:
+                return
+        while True:
+            try:
+                event = events.get(timeout=WATCH_KEEPALIVE)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            yield format_sse(event)
+            if watch_finished(event, remaining) and not queue_name:
+                return
+    
+    response = app.response_class(stream(), mimetype='text/event-stream',
+                                  headers={'Cache-Control': 'no-cache'})
+    # The server closes every response, even one whose stream never started
+    response.call_on_close(lambda: unsubscribe(task_ids, queue_name, events.put))
+    return response
+
+def parse_capacity(data):
+    capacity = data.get('capacity')
+    if is_row_id(capacity) and capacity > 0:
+        return capacity
+    return None
 
 @app.route('/register', methods=['POST'])
 def register_worker():
+    data = request.get_json(silent=True) or {}
+    capacity = parse_capacity(data)
+    cores, memory_mb, tags = parse_profile(data) or (None, None, frozenset())
+    
+    conn = acquire_db()
     try:
-        conn = sqlite3.connect('tasks.db', timeout=10)
         c = conn.cursor()
         
-        # Get the next worker ID
-        c.execute('SELECT MAX(id) FROM workers')
-        max_id = c.fetchone()[0] or 0
-        worker_id = max_id + 1
-        
-        c.execute('''INSERT INTO workers (id, last_heartbeat, status)
-                     VALUES (?, ?, ?)''',
-                  (worker_id, datetime.now(), 'active'))
-        conn.commit()
+        # Let SQLite assign the ID so concurrent registrations cannot collide
+        now = time.time()
+        c.execute('''INSERT INTO workers (last_heartbeat, status, capacity, cores, memory_mb, tags)
+                     VALUES (?, ?, ?, ?, ?, ?)''',
+                  (datetime.fromtimestamp(now), 'active', capacity, cores, memory_mb, join_tags(tags)))
+        worker_id = c.lastrowid
+        timed_commit(conn)
         
         with workers_lock:
+            track_worker(worker_id, now)
+            if capacity is not None:
+                worker_capacity[worker_id] = capacity
             logger.info(f"Worker {worker_id} registered")
+        with queue_lock:
+            TASK_QUEUE.set_worker(worker_id, (cores or 0, memory_mb or 0, tags))
         
-        return jsonify({'worker_id': worker_id, 'status': 'registered'})
+        return jsonify({'worker_id': worker_id, 'status': 'registered',
+                        'shard_id': SHARD_ID, 'num_shards': NUM_SHARDS})
     
     except sqlite3.Error as e:
         logger.error(f"Database error: {str(e)}")
         return jsonify({'error': 'Registration failed'}), 500
     finally:
-        conn.close()
+        release_db(conn)
+
+def record_heartbeat(worker_id, data):
+    # Returns the load hints sent back to the worker
+    capacity = parse_capacity(data)
+    profile = parse_profile(data)
+    now = time.time()
+    with workers_lock:
+        # Heartbeats restate capacity so a restarted coordinator relearns it
+        if capacity is not None:
+            worker_capacity[worker_id] = capacity
+        if track_worker(worker_id, now):
+            # Only the failed -> active transition touches the database
+            queue_write('''UPDATE workers SET last_heartbeat = ?, status = 'active'
+                           WHERE id = ?''',
+                        (datetime.fromtimestamp(now), worker_id))
+            logger.info("Worker %s is active again", worker_id)
+    with queue_lock:
+        # Reports restate the profile too; a worker revived after failing gets it back
+        if profile is not None and TASK_QUEUE.profiles.get(worker_id) != profile:
+            TASK_QUEUE.set_worker(worker_id, profile)
+            queue_write('UPDATE workers SET cores = ?, memory_mb = ?, tags = ? WHERE id = ?',
+                        (profile[0], profile[1], join_tags(profile[2]), worker_id))
+        elif worker_id not in TASK_QUEUE.profiles:
+            TASK_QUEUE.set_worker(worker_id, profile)
+    
+    # Load hints let workers spread claims across shards
+    return {'pending': len(TASK_QUEUE), 'active_workers': len(worker_heartbeats)}
 
 @app.route('/heartbeat/<int:worker_id>', methods=['POST'])
 def receive_heartbeat(worker_id):
-    try:
-        conn = sqlite3.connect('tasks.db', timeout=10)
-        c = conn.cursor()
-        c.execute('''UPDATE workers SET last_heartbeat = ?, status = ?
-                     WHERE id = ?''',
-                  (datetime.now(), 'active', worker_id))
-        conn.commit()
-        
-        return jsonify({'status': 'heartbeat received'})
+    if not is_row_id(worker_id):
+        return jsonify({'error': 'Invalid worker id'}), 400
+    data = request.get_json(silent=True) or {}
+    return jsonify({'status': 'heartbeat received', **record_heartbeat(worker_id, data)})
+
+def record_results(worker_id, results):
+    # results are (task_id, result, started_at, finished_at); their writes share group commits.
+    # The worker-side timestamps may be None. Returns the ids that were recorded: a task
+    # whose lease has moved on (requeued, or claimed by another worker) keeps its state.
+    completed_at = datetime.now()
+    writes = []
+    for task_id, result, _, _ in results:
+        result, result_blob = offload(result)
+        writes.append(queue_write('''UPDATE tasks SET status = 'completed', result = ?, result_blob = ?,
+                                     completed_at = ?, lease_expires_at = NULL
+                                     WHERE id = ? AND worker_id = ? AND status = 'processing' ''',
+                                  (result, result_blob, completed_at, task_id, worker_id)))
+    for write in writes:
+        wait_for_write(write)
+    results = [entry for entry, write in zip(results, writes) if write.rowcount]
+    if not results:
+        return []
     
-    except sqlite3.Error as e:
-        logger.error(f"Database error: {str(e)}")
-        return jsonify({'error': 'Heartbeat processing failed'}), 500
-    finally:
-        conn.close()
+    now = time.time()
+    if TRACING:
+        for task_id, _, started_at, finished_at in results:
+            queue_write(TRACE_FINISHED_SQL, (task_id, started_at, finished_at, now))
+    task_ids = [task_id for task_id, _, _, _ in results]
+    if TASK_QUEUE.specs:
+        with queue_lock:
+            for task_id in task_ids:
+                TASK_QUEUE.forget(task_id)
+    for task_id in task_ids:
+        started = lease_started.get(task_id)
+        if started is not None:
+            TASK_RUN_SECONDS.observe(now - started)
+    queues = drop_leases(worker_id, task_ids)
+    for task_id in task_ids:
+        publish_task_event(task_id, 'completed', event_queue_name(task_id, queues.get(task_id)))
+    unblock_dependents(task_ids)
+    return task_ids
 
 @app.route('/task/complete', methods=['POST'])
 def complete_task():
@@ -144,48 +1347,235 @@ def complete_task():
     
     if not all([task_id, worker_id]):
         return jsonify({'error': 'Missing data'}), 400
+    if not is_row_id(task_id) or not is_row_id(worker_id):
+        return jsonify({'error': 'Invalid task or worker id'}), 400
     
     try:
-        conn = sqlite3.connect('tasks.db', timeout=10)
-        c = conn.cursor()
+        if result:
+            if not record_results(worker_id, [(task_id, result, parse_timestamp(data.get('started_at')),
+                                               parse_timestamp(data.get('finished_at')))]):
+                return jsonify({'error': 'Task is not leased to this worker'}), 409
+        else:
+            submit_write('''UPDATE tasks SET status = ?, result = ?, 
+                            completed_at = ?, worker_id = ?
+                            WHERE id = ?''',
+                         ('processing', result, None, worker_id, task_id))
+            publish_task_event(task_id, 'processing', event_queue_name(task_id, lease_queues.get(task_id)))
         
-        status = 'completed' if result else 'processing'
-        c.execute('''UPDATE tasks SET status = ?, result = ?, 
-                     completed_at = ?, worker_id = ?
-                     WHERE id = ?''',
-                  (status, result, 
-                   datetime.now() if result else None, 
-                   worker_id, task_id))
-        conn.commit()
-        
-        logger.info(f"Task {task_id} updated by worker {worker_id}")
+        logger.info("Task %s updated by worker %s", task_id, worker_id)
         return jsonify({'status': 'task updated'})
     
+    except OSError as e:
+        logger.error(f"Blob store error: {str(e)}")
+        return jsonify({'error': 'Result storage failed'}), 500
     except sqlite3.Error as e:
         logger.error(f"Database error: {str(e)}")
         return jsonify({'error': 'Task completion failed'}), 500
+
+def parse_timestamp(value):
+    # Worker-supplied epoch seconds; anything else is dropped
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+def parse_report_results(values):
+    # Returns a list of (task_id, result, started_at, finished_at), or None if any entry is malformed
+    if not isinstance(values, list) or len(values) > MAX_REPORT_BATCH:
+        return None
+    results = []
+    for entry in values:
+        if not isinstance(entry, dict):
+            return None
+        task_id = entry.get('task_id')
+        result = entry.get('result')
+        if not is_row_id(task_id):
+            return None
+        if not isinstance(result, str) or not result:
+            return None
+        results.append((task_id, result, parse_timestamp(entry.get('started_at')),
+                        parse_timestamp(entry.get('finished_at'))))
+    return results
+
+@app.route('/report', methods=['POST'])
+def receive_report():
+    # A worker's periodic report: a heartbeat plus every result finished since its last one.
+    # Failed tasks go straight back on the queue.
+    data = request.get_json(silent=True) or {}
+    worker_id = data.get('worker_id')
+    results = parse_report_results(data.get('results', []))
+    failed = parse_task_ids(data.get('failed', []))
+    if (not is_row_id(worker_id) or results is None
+            or failed is None or len(failed) > MAX_REPORT_BATCH):
+        return jsonify({'error': 'Invalid report'}), 400
+    
+    reply = record_heartbeat(worker_id, data)
+    try:
+        completed = record_results(worker_id, results) if results else []
+        requeued = requeue_leased(worker_id, failed, 'failed') if failed else []
+    except OSError as e:
+        logger.error(f"Blob store error: {str(e)}")
+        return jsonify({'error': 'Result storage failed'}), 500
+    except sqlite3.Error as e:
+        logger.error(f"Database error: {str(e)}")
+        return jsonify({'error': 'Report failed'}), 500
+    
+    if results or failed:
+        logger.info("Worker %s reported %d results (%d recorded), requeued %s",
+                    worker_id, len(results), len(completed), requeued)
+    return jsonify({'status': 'report received', 'completed': len(completed), 'requeued': requeued, **reply})
+
+def trace_phases(trace):
+    # Seconds spent in each phase that has both of its timestamps
+    trace = dict(trace, queued_at=trace['queued_at'] or trace['created_at'])
+    return {name: trace[end] - trace[start] for name, start, end in TRACE_PHASES
+            if trace[start] is not None and trace[end] is not None}
+
+def load_traces(c, where, params):
+    # A task that was never fetched has no trace row yet and reads as queued since created_at
+    c.execute(f'''SELECT t.id AS task_id, t.created_at, tr.queued_at, tr.fetched_at, tr.acknowledged_at,
+                         tr.started_at, tr.finished_at, tr.committed_at, tr.worker_id,
+                         COALESCE(tr.requeues, 0) AS requeues, COALESCE(tr.ack_conflicts, 0) AS ack_conflicts
+                  FROM tasks t LEFT JOIN task_traces tr ON tr.task_id = t.id {where}''', params)
+    columns = [column[0] for column in c.description]
+    traces = []
+    for row in c.fetchall():
+        trace = dict(zip(columns, row))
+        trace['created_at'] = datetime.fromisoformat(trace['created_at']).timestamp()
+        traces.append(trace)
+    return traces
+
+@app.route('/trace/<int:task_id>', methods=['GET'])
+def get_trace(task_id):
+    shard = foreign_shard(task_id)
+    if shard is not None:
+        return jsonify({'error': 'Task belongs to another shard', 'shard': shard}), 404
+    
+    conn = acquire_db()
+    try:
+        c = conn.cursor()
+        traces = load_traces(c, 'WHERE t.id = ?', (task_id,))
+        if not traces:
+            # Archived tasks no longer keep a trace
+            return jsonify({'error': 'Trace not found'}), 404
+        trace = traces[0]
+        trace['phases'] = trace_phases(trace)
+        return jsonify(trace)
+    
+    except sqlite3.Error as e:
+        logger.error(f"Database error: {str(e)}")
+        return jsonify({'error': 'Database operation failed'}), 500
+    finally:
+        release_db(conn)
+
+def summarize_samples(samples):
+    samples.sort()
+    summary = {'count': len(samples), 'mean': sum(samples) / len(samples), 'max': samples[-1]}
+    for pct in (50, 95, 99):
+        # Nearest-rank percentile
+        summary[f'p{pct}'] = samples[max(math.ceil(len(samples) * pct / 100) - 1, 0)]
+    return summary
+
+@app.route('/trace/summary', methods=['GET'])
+def trace_summary():
+    # Where tasks committed in the last `window` seconds spent their time
+    try:
+        window = float(request.args.get('window', TRACE_SUMMARY_WINDOW))
+    except ValueError:
+        return jsonify({'error': 'Invalid window'}), 400
+    
+    conn = acquire_db()
+    try:
+        c = conn.cursor()
+        traces = load_traces(c, 'WHERE tr.committed_at >= ? ORDER BY tr.committed_at DESC LIMIT ?',
+                             (time.time() - window, MAX_TRACE_SUMMARY_ROWS))
+    except sqlite3.Error as e:
+        logger.error(f"Database error: {str(e)}")
+        return jsonify({'error': 'Database operation failed'}), 500
     finally:
-        conn.close()
+        release_db(conn)
+    
+    samples = {name: [] for name, _, _ in TRACE_PHASES}
+    for trace in traces:
+        for name, seconds in trace_phases(trace).items():
+            samples[name].append(seconds)
+    return jsonify({
+        'window': window,
+        'tasks': len(traces),
+        'requeues': sum(trace['requeues'] for trace in traces),
+        'ack_conflicts': sum(trace['ack_conflicts'] for trace in traces),
+        'phases': {name: summarize_samples(values) for name, values in samples.items() if values},
+    })
+
+@app.route('/blob/<blob_hash>', methods=['GET'])
+def get_blob(blob_hash):
+    # Streams a stored payload or result; supports a single byte range
+    size = BLOB_STORE.size(blob_hash)
+    if size is None:
+        return jsonify({'error': 'Blob not found'}), 404
+    
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{blob_hash}"',
+        'Cache-Control': 'public, max-age=31536000, immutable',
+    }
+    byte_range = parse_range(request.headers.get('Range'), size)
+    if byte_range is False:
+        headers['Content-Range'] = f'bytes */{size}'
+        return app.response_class(status=416, headers=headers)
+    start, end = byte_range or (0, size)
+    headers['Content-Length'] = str(end - start)
+    if byte_range:
+        headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+    return app.response_class(BLOB_STORE.read(blob_hash, start, end), status=206 if byte_range else 200,
+                              headers=headers, mimetype='application/octet-stream')
+
+def parse_wait(value):
+    # Long-poll timeout in seconds, clamped to MAX_LONG_POLL; 0 means do not wait
+    if request.environ.get(NO_WAIT_ENVIRON_KEY):
+        # The async server already parked this request on its event loop
+        return 0
+    try:
+        return min(max(float(value or 0), 0), MAX_LONG_POLL)
+    except (TypeError, ValueError):
+        return 0
+
+def repark_poll():
+    # The async server woke this request for a task another fetch claimed first;
+    # it parks the request again instead of answering before its deadline
+    if request.environ.get(NO_WAIT_ENVIRON_KEY):
+        request.environ[REPARK_ENVIRON_KEY] = True
+
+def wait_for_tasks(timeout, worker_id=None):
+    # Park until the queue holds a task this worker may claim or the timeout passes
+    with queue_lock:
+        return bool(queue_changed.wait_for(lambda: TASK_QUEUE.has_work_for(worker_id), timeout))
 
 @app.route('/get_task', methods=['GET'])
 def get_task():
+    # Anonymous fetches only see tasks without requirements or affinity
+    wait = parse_wait(request.args.get('wait'))
     with queue_lock:
-        if not TASK_QUEUE:
+        if TASK_QUEUE.peek() is None and wait:
+            queue_changed.wait_for(lambda: TASK_QUEUE.peek() is not None, wait)
+        head = TASK_QUEUE.peek()
+        if head is None:
+            repark_poll()
             return jsonify({'error': 'No tasks available'}), 404
         
-        task_id = TASK_QUEUE[0]  # Peek without removing
+        task_id = head[0]  # Peek without removing
     
+    conn = acquire_db()
     try:
-        conn = sqlite3.connect('tasks.db', timeout=10)
         c = conn.cursor()
-        c.execute('SELECT * FROM tasks WHERE id = ?', (task_id,))
+        c.execute(f'{TASK_SELECT} WHERE id = ?', (task_id,))
         task = c.fetchone()
         
         if not task:
             return jsonify({'error': 'Task not found'}), 404
         
-        columns = ['id', 'description', 'status', 'result', 'worker_id', 'created_at', 'completed_at']
-        task_dict = dict(zip(columns, task))
+        task_dict = dict(zip(TASK_COLUMNS, task))
+        if TRACING:
+            queue_write(TRACE_FETCHED_SQL, (task_id, time.time()))
         
         return jsonify(task_dict)
     
@@ -193,7 +1583,7 @@ def get_task():
         logger.error(f"Database error: {str(e)}")
         return jsonify({'error': 'Database operation failed'}), 500
     finally:
-        conn.close()
+        release_db(conn)
 
 @app.route('/acknowledge_task/<int:task_id>', methods=['POST'])
 def acknowledge_task(task_id):
@@ -202,61 +1592,899 @@ def acknowledge_task(task_id):
         return jsonify({'error': 'Worker ID required'}), 400
     
     with queue_lock:
-        if task_id in TASK_QUEUE:
-            TASK_QUEUE.remove(task_id)
-            logger.info(f"Task {task_id} acknowledged by worker {worker_id}")
+        if TASK_QUEUE.remove(task_id):
+            logger.info("Task %s acknowledged by worker %s", task_id, worker_id)
+            if TRACING:
+                queue_write(TRACE_ACKNOWLEDGED_SQL, (task_id, time.time(), worker_id))
             return jsonify({'status': 'acknowledged'})
     
+    # Another worker acknowledged it first
+    if TRACING:
+        queue_write(TRACE_ACK_CONFLICT_SQL, (task_id,))
     return jsonify({'error': 'Task not in queue'}), 404
 
-def check_workers():
-    while True:
-        time.sleep(HEARTBEAT_INTERVAL)
-        current_time = datetime.now()
+def claim_tasks(conn, worker_id, max_tasks):
+    c = conn.cursor()
+    claimed = []
+    
+    # Pop and lease under the queue lock so no two workers get the same task
+    with queue_lock:
+        with workers_lock:
+            max_tasks = available_slots(worker_id, max_tasks)
+        lease_expires_at = time.time() + LEASE_DURATION
+        popped = []
+        while len(popped) < max_tasks:
+            entry = TASK_QUEUE.pop_for(worker_id)
+            if entry is None:
+                break
+            c.execute('''UPDATE tasks SET status = 'processing', worker_id = ?,
+                         lease_expires_at = ?
+                         WHERE id = ? AND status = 'pending' ''',
+                      (worker_id, lease_expires_at, entry[0]))
+            if c.rowcount:
+                popped.append(entry)
+        if TRACING and popped:
+            # A claim fetches and acknowledges in one step
+            claimed_at = time.time()
+            c.executemany(TRACE_CLAIMED_SQL, [(entry[0], claimed_at, claimed_at, worker_id)
+                                              for entry in popped])
         
         try:
-            conn = sqlite3.connect('tasks.db', timeout=10)
-            c = conn.cursor()
-            
-            # Check for failed workers
-            c.execute('''SELECT id FROM workers 
-                         WHERE status = 'active' 
-                         AND datetime(last_heartbeat) < datetime(?, ?)''',
-                      (current_time, f'-{WORKER_TIMEOUT} seconds'))
-            failed_workers = c.fetchall()
+            timed_commit(conn)
+        except sqlite3.Error:
+            for entry in popped:
+                TASK_QUEUE.push(*entry)
+            notify_tasks_available(len(popped))
+            raise
+        claimed = [task_id for task_id, _, _ in popped]
+        if claimed:
+            claimed_at = time.time()
+            with workers_lock:
+                worker_leases.setdefault(worker_id, set()).update(claimed)
+                for task_id, _, queue_name in popped:
+                    lease_started[task_id] = claimed_at
+                    lease_queues[task_id] = queue_name
+        if TASK_QUEUE:
+            # Pass the wakeup on in case other fetches are still parked
+            notify_tasks_available()
+    
+    if not claimed:
+        return []
+    
+    placeholders = ', '.join('?' * len(claimed))
+    c.execute(f'{TASK_SELECT} WHERE id IN ({placeholders})', claimed)
+    rows = {row[0]: dict(zip(TASK_COLUMNS, row)) for row in c.fetchall()}
+    # Hand tasks back in dequeue order so the worker runs them by priority
+    tasks = [rows[task_id] for task_id in claimed]
+    now = datetime.now()
+    for task in tasks:
+        TASK_WAIT_SECONDS.observe((now - datetime.fromisoformat(task['created_at'])).total_seconds())
+    for task_id, _, queue_name in popped:
+        publish_task_event(task_id, 'processing', queue_name)
+    logger.info("Tasks %s claimed by worker %s", claimed, worker_id)
+    return tasks
+
+def claim_with_wait(worker_id, max_tasks, wait):
+    # Parked requests hold no pooled connection; one is borrowed only to claim
+    deadline = time.monotonic() + wait
+    while True:
+        conn = acquire_db()
+        try:
+            tasks = claim_tasks(conn, worker_id, max_tasks)
+        finally:
+            release_db(conn)
+        
+        if tasks:
+            return tasks
+        with workers_lock:
+            if not available_slots(worker_id, max_tasks):
+                return tasks
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            repark_poll()
+            return tasks
+        if not wait_for_tasks(remaining, worker_id):
+            return tasks
+
+@app.route('/claim', methods=['POST'])
+def claim_task():
+    data = request.json or {}
+    worker_id = data.get('worker_id')
+    if not worker_id:
+        return jsonify({'error': 'Worker ID required'}), 400
+    
+    try:
+        tasks = claim_with_wait(worker_id, 1, parse_wait(data.get('wait')))
+        if not tasks:
+            return jsonify({'error': 'No tasks available'}), 404
+        
+        return jsonify(tasks[0])
+    
+    except sqlite3.Error as e:
+        logger.error(f"Database error: {str(e)}")
+        return jsonify({'error': 'Task claim failed'}), 500
+
+@app.route('/claim_batch', methods=['POST'])
+def claim_batch():
+    data = request.json or {}
+    worker_id = data.get('worker_id')
+    if not worker_id:
+        return jsonify({'error': 'Worker ID required'}), 400
+    
+    try:
+        max_tasks = min(int(data.get('max_tasks', 1)), MAX_CLAIM_BATCH)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid max_tasks'}), 400
+    if max_tasks < 1:
+        return jsonify({'error': 'Invalid max_tasks'}), 400
+    
+    try:
+        tasks = claim_with_wait(worker_id, max_tasks, parse_wait(data.get('wait')))
+        return jsonify({'tasks': tasks, 'lease_duration': LEASE_DURATION})
+    
+    except sqlite3.Error as e:
+        logger.error(f"Database error: {str(e)}")
+        return jsonify({'error': 'Task claim failed'}), 500
+
+def requeue_leased(worker_id, task_ids, reason):
+    # Put tasks this worker holds back on the queue; returns the ids that were requeued
+    conn = acquire_db()
+    try:
+        c = conn.cursor()
+        released = []
+        
+        with queue_lock:
+            for task_id in task_ids:
+                c.execute('''UPDATE tasks SET status = 'pending', worker_id = NULL,
+                             lease_expires_at = NULL
+                             WHERE id = ? AND worker_id = ? AND status = 'processing' ''',
+                          (task_id, worker_id))
+                if c.rowcount:
+                    c.execute('SELECT priority, queue FROM tasks WHERE id = ?', (task_id,))
+                    released.append((task_id, *c.fetchone()))
+            trace_requeued(c, [entry[0] for entry in released])
+            timed_commit(conn)
             
-            for (worker_id,) in failed_workers:
-                # Mark worker as failed
-                c.execute('''UPDATE workers SET status = 'failed'
-                             WHERE id = ?''', (worker_id,))
-                
-                # Requeue tasks assigned to failed worker
-                c.execute('''SELECT id FROM tasks 
-                             WHERE worker_id = ? AND status = 'processing' ''',
-                          (worker_id,))
-                failed_tasks = c.fetchall()
-                
-                with queue_lock:
-                    for (task_id,) in failed_tasks:
-                        TASK_QUEUE.append(task_id)
-                        c.execute('''UPDATE tasks SET status = 'pending', 
-                                     worker_id = NULL WHERE id = ?''',
-                                  (task_id,))
-                
-                logger.warning(f"Worker {worker_id} marked as failed. Requeued {len(failed_tasks)} tasks.")
+            # Queues order by id within a priority, so released tasks regain their place
+            for entry in released:
+                TASK_QUEUE.push(*entry)
+            notify_tasks_available(len(released))
+    finally:
+        release_db(conn)
+    
+    released_ids = [task_id for task_id, _, _ in released]
+    for task_id, _, queue_name in released:
+        publish_task_event(task_id, 'pending', queue_name)
+    drop_leases(worker_id, released_ids)
+    TASKS_REQUEUED.inc(len(released_ids), reason)
+    return released_ids
+
+@app.route('/release', methods=['POST'])
+def release_tasks():
+    data = request.json or {}
+    worker_id = data.get('worker_id')
+    task_ids = data.get('task_ids') or []
+    if not worker_id:
+        return jsonify({'error': 'Worker ID required'}), 400
+    
+    try:
+        released_ids = requeue_leased(worker_id, task_ids, 'released')
+        logger.info("Worker %s released tasks %s", worker_id, released_ids)
+        return jsonify({'status': 'released', 'task_ids': released_ids})
+    
+    except sqlite3.Error as e:
+        logger.error(f"Database error: {str(e)}")
+        return jsonify({'error': 'Task release failed'}), 500
+
+@app.before_request
+def start_request_timer():
+    request.environ['scheduler.started'] = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = request.environ.get('scheduler.started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    with queue_lock:
+        depths = TASK_QUEUE.depths()
+        blocked = len(blocked_tasks)
+        placement_depths = {'shared': len(TASK_QUEUE.shared),
+                            'constrained': sum(map(len, TASK_QUEUE.constrained.values())),
+                            'local': sum(map(len, TASK_QUEUE.local.values()))}
+        steals = TASK_QUEUE.steals
+        affinity_keys = len(TASK_QUEUE.affinity)
+    with workers_lock:
+        active_workers = len(worker_heartbeats)
+        failed = len(failed_workers)
+        processing = sum(len(leases) for leases in worker_leases.values())
+    
+    lines = []
+    metrics.gauge(lines, 'scheduler_queue_depth', 'Pending tasks per named queue', depths, 'queue')
+    metrics.gauge(lines, 'scheduler_tasks', 'Tasks held in memory by state',
+                  {'pending': sum(depths.values()), 'processing': processing, 'blocked': blocked}, 'state')
+    metrics.gauge(lines, 'scheduler_placement_queue_tasks', 'Pending tasks by kind of placement queue',
+                  placement_depths, 'kind')
+    metrics.counter(lines, 'scheduler_affinity_steals_total',
+                    "Tasks claimed from another worker's affinity backlog", steals)
+    metrics.gauge(lines, 'scheduler_affinity_keys', 'Affinity keys bound to a worker', affinity_keys)
+    metrics.gauge(lines, 'scheduler_pending_writes', 'Mutations waiting for the group-commit writer',
+                  write_queue.qsize())
+    metrics.gauge(lines, 'scheduler_workers', 'Workers by liveness state',
+                  {'active': active_workers, 'failed': failed}, 'state')
+    with idempotency_lock:
+        cache_size = len(IDEMPOTENCY_CACHE)
+        cache_lookups = {'hit': IDEMPOTENCY_CACHE.hits, 'miss': IDEMPOTENCY_CACHE.misses}
+        cache_evictions = dict(IDEMPOTENCY_CACHE.evictions)
+    metrics.gauge(lines, 'scheduler_idempotency_cache_entries', 'Idempotency keys cached in memory',
+                  cache_size)
+    metrics.counter(lines, 'scheduler_idempotency_cache_lookups_total',
+                    'Idempotency cache lookups by result', cache_lookups, 'result')
+    metrics.counter(lines, 'scheduler_idempotency_cache_evictions_total',
+                    'Idempotency keys dropped from the cache by reason', cache_evictions, 'reason')
+    with rate_limit_lock:
+        rate_limited_clients = len(SUBMIT_LIMITER)
+    metrics.gauge(lines, 'scheduler_rate_limited_clients', 'Clients with a submission token bucket',
+                  rate_limited_clients)
+    metrics.gauge(lines, 'scheduler_queue_high_water', 'Pending tasks at which submissions are refused',
+                  QUEUE_HIGH_WATER)
+    metrics.gauge(lines, 'scheduler_recovery', 'Startup queue recovery statistics',
+                  RECOVERY_STATS, 'stat')
+    return app.response_class(metrics.render(lines),
+                              mimetype='text/plain; version=0.0.4')
+
+def requeue_expired_leases(c):
+    now = time.time()
+    c.execute('''SELECT id, priority, queue, worker_id FROM tasks
+                 WHERE status = 'processing' AND lease_expires_at < ?''',
+              (now,))
+    expired_tasks = c.fetchall()
+    
+    # Workers still heartbeating keep their leases however long a task runs
+    with workers_lock:
+        renewed = [(now + LEASE_DURATION, task_id, worker_id) for task_id, _, _, worker_id in expired_tasks
+                   if worker_id in worker_heartbeats]
+    c.executemany('''UPDATE tasks SET lease_expires_at = ?
+                     WHERE id = ? AND worker_id = ? AND status = 'processing' ''', renewed)
+    renewed_ids = {task_id for _, task_id, _ in renewed}
+    
+    requeued = []
+    with queue_lock:
+        for task_id, priority, queue_name, worker_id in expired_tasks:
+            if task_id in renewed_ids:
+                continue
+            # Fenced on the lease so a completion or release that got there first stands
+            c.execute('''UPDATE tasks SET status = 'pending', worker_id = NULL,
+                         lease_expires_at = NULL
+                         WHERE id = ? AND status = 'processing' AND lease_expires_at < ?''',
+                      (task_id, now))
+            if not c.rowcount:
+                continue
+            TASK_QUEUE.push(task_id, priority, queue_name)
+            drop_leases(worker_id, [task_id])
+            publish_task_event(task_id, 'pending', queue_name)
+            requeued.append(task_id)
+        trace_requeued(c, requeued)
+        notify_tasks_available(len(requeued))
+    
+    if requeued:
+        TASKS_REQUEUED.inc(len(requeued), 'lease_expired')
+        logger.warning(f"Requeued {len(requeued)} tasks with expired leases.")
+
+def recover_task_queue():
+    # Rebuild TASK_QUEUE from the tasks table before serving requests
+    started = time.perf_counter()
+    conn = acquire_db()
+    try:
+        c = conn.cursor()
+        # Processing tasks without a live lease have no owner after a restart
+        c.execute('''SELECT id FROM tasks WHERE status = 'processing'
+                     AND (lease_expires_at IS NULL OR lease_expires_at < ?)''',
+                  (time.time(),))
+        trace_requeued(c, [row[0] for row in c.fetchall()])
+        c.execute('''UPDATE tasks SET status = 'pending', worker_id = NULL,
+                     lease_expires_at = NULL
+                     WHERE status = 'processing'
+                     AND (lease_expires_at IS NULL OR lease_expires_at < ?)''',
+                  (time.time(),))
+        requeued = c.rowcount
+        conn.commit()
+        
+        c.execute('''SELECT id, priority, queue FROM tasks
+                     WHERE status = 'pending' ORDER BY id''')
+        entries = []
+        while True:
+            rows = c.fetchmany(RECOVERY_BATCH_SIZE)
+            if not rows:
+                break
+            entries.extend(rows)
+        
+        # Blocked tasks wait only on parents that are still unfinished; a parent
+        # missing from tasks has been archived, so it completed
+        c.execute('''SELECT t.id, t.priority, t.queue, d.parent_id, p.status
+                     FROM tasks t JOIN task_deps d ON d.task_id = t.id
+                     LEFT JOIN tasks p ON p.id = d.parent_id
+                     WHERE t.status = 'blocked' ''')
+        waiting = {}
+        for task_id, priority, queue_name, parent_id, parent_status in c.fetchall():
+            unfinished = waiting.setdefault(task_id, (set(), priority, queue_name))[0]
+            if parent_status is not None and parent_status != 'completed':
+                unfinished.add(parent_id)
+        ready = [(task_id, priority, queue_name) for task_id, (unfinished, priority, queue_name)
+                 in waiting.items() if not unfinished]
+        # Children whose parents completed just before a crash
+        c.executemany("UPDATE tasks SET status = 'pending' WHERE id = ?", [(entry[0],) for entry in ready])
+        conn.commit()
+        
+        # Placement of every unfinished task, needed before it is routed
+        c.execute('''SELECT id, requires, min_cores, min_memory, affinity_key FROM tasks
+                     WHERE status IN ('pending', 'blocked', 'processing')
+                     AND (requires IS NOT NULL OR min_cores > 0 OR min_memory > 0
+                          OR affinity_key IS NOT NULL)''')
+        specs = c.fetchall()
+        
+        # One bulk load heapifies each queue once instead of pushing row by row
+        with queue_lock:
+            for task_id, requires, min_cores, min_memory, affinity_key in specs:
+                TASK_QUEUE.set_spec(task_id, (split_tags(requires), min_cores, min_memory), affinity_key)
+            TASK_QUEUE.extend(entries + ready)
+            for task_id, entry in waiting.items():
+                if entry[0]:
+                    blocked_tasks[task_id] = entry
+                    for parent_id in entry[0]:
+                        task_dependents.setdefault(parent_id, set()).add(task_id)
+        recovered = len(entries) + len(ready)
+        blocked = len(waiting) - len(ready)
+    finally:
+        release_db(conn)
+    
+    RECOVERY_STATS.update({
+        'recovered_tasks': recovered,
+        'blocked_tasks': blocked,
+        'requeued_expired_leases': requeued,
+        'recovery_seconds': time.perf_counter() - started,
+    })
+    logger.info(f"Recovered {recovered} pending and {blocked} blocked tasks "
+                f"({requeued} from expired leases) in {RECOVERY_STATS['recovery_seconds']:.3f}s")
+
+def load_archived_task(c, task_id):
+    c.execute('SELECT payload FROM tasks_archive WHERE id = ?', (task_id,))
+    row = c.fetchone()
+    return json.loads(zlib.decompress(row[0])) if row else None
+
+def archive_completed_tasks(conn):
+    # Move one bounded batch of expired completed tasks into tasks_archive
+    c = conn.cursor()
+    cutoff = datetime.now() - timedelta(seconds=ARCHIVE_RETENTION)
+    c.execute(f'''{TASK_SELECT} WHERE status = 'completed' AND completed_at < ?
+                  ORDER BY completed_at LIMIT ?''',
+              (cutoff, ARCHIVE_BATCH_SIZE))
+    rows = c.fetchall()
+    if not rows:
+        return 0
+    
+    archived_at = datetime.now()
+    c.executemany('INSERT OR REPLACE INTO tasks_archive (id, archived_at, payload) VALUES (?, ?, ?)',
+                  [(row[0], archived_at, zlib.compress(json.dumps(dict(zip(TASK_COLUMNS, row))).encode()))
+                   for row in rows])
+    c.executemany('DELETE FROM tasks WHERE id = ?', [(row[0],) for row in rows])
+    # A completed child no longer needs its edges
+    c.executemany('DELETE FROM task_deps WHERE task_id = ?', [(row[0],) for row in rows])
+    c.executemany('DELETE FROM task_traces WHERE task_id = ?', [(row[0],) for row in rows])
+    conn.commit()
+    return len(rows)
+
+def archive_loop():
+    conn = connect_db()
+    while True:
+        time.sleep(ARCHIVE_INTERVAL)
+        try:
+            archived = 0
+            while True:
+                count = archive_completed_tasks(conn)
+                archived += count
+                if count < ARCHIVE_BATCH_SIZE:
+                    break
+                # Yield the write lock between batches
+                time.sleep(ARCHIVE_BATCH_PAUSE)
             
-            conn.commit()
+            if archived:
+                conn.execute(f'PRAGMA incremental_vacuum({VACUUM_PAGES})').fetchall()
+                logger.info(f"Archived {archived} completed tasks")
         
         except sqlite3.Error as e:
-            logger.error(f"Worker check failed: {str(e)}")
-        finally:
-            conn.close()
+            logger.error(f"Archive pass failed: {str(e)}")
+            if conn.in_transaction:
+                conn.rollback()
+
+def requeue_worker_tasks(worker_id):
+    conn = acquire_db()
+    try:
+        c = conn.cursor()
+        c.execute('''SELECT id, priority, queue FROM tasks 
+                     WHERE worker_id = ? AND status = 'processing' ''',
+                  (worker_id,))
+        failed_tasks = c.fetchall()
+        
+        with queue_lock:
+            for task_id, _, _ in failed_tasks:
+                c.execute('''UPDATE tasks SET status = 'pending', 
+                             worker_id = NULL, lease_expires_at = NULL
+                             WHERE id = ?''',
+                          (task_id,))
+            trace_requeued(c, [row[0] for row in failed_tasks])
+            timed_commit(conn)
+            # Its affinity backlog is re-routed along with its leases
+            rerouted = TASK_QUEUE.drop_worker(worker_id)
+            for entry in failed_tasks:
+                TASK_QUEUE.push(*entry)
+            notify_tasks_available(len(failed_tasks) + rerouted)
+        
+        with workers_lock:
+            worker_leases.pop(worker_id, None)
+            for task_id, _, _ in failed_tasks:
+                lease_started.pop(task_id, None)
+                lease_queues.pop(task_id, None)
+        TASKS_REQUEUED.inc(len(failed_tasks), 'worker_failed')
+        for task_id, _, queue_name in failed_tasks:
+            publish_task_event(task_id, 'pending', queue_name)
+        
+        logger.warning(f"Worker {worker_id} marked as failed. Requeued {len(failed_tasks)} tasks.")
+    
+    except sqlite3.Error as e:
+        logger.error(f"Requeue for worker {worker_id} failed: {str(e)}")
+    finally:
+        release_db(conn)
+
+def expire_workers(now):
+    # Caller holds workers_lock; pops every worker whose deadline has passed
+    failed = []
+    while worker_deadlines and worker_deadlines[0][0] <= now:
+        deadline, worker_id = heapq.heappop(worker_deadlines)
+        last_heartbeat = worker_heartbeats.get(worker_id)
+        if last_heartbeat is None:
+            continue
+        if last_heartbeat + WORKER_TIMEOUT > now:
+            # Heartbeats arrived since this entry was pushed
+            heapq.heappush(worker_deadlines, (last_heartbeat + WORKER_TIMEOUT, worker_id))
+            continue
+        
+        del worker_heartbeats[worker_id]
+        failed_workers.add(worker_id)
+        # Queued under the lock so a racing revival is written after this
+        write = queue_write('''UPDATE workers SET status = 'failed', last_heartbeat = ?
+                               WHERE id = ?''',
+                            (datetime.fromtimestamp(last_heartbeat), worker_id))
+        failed.append((worker_id, write))
+    return failed
+
+def check_workers():
+    next_lease_check = time.time() + HEARTBEAT_INTERVAL
+    while True:
+        with liveness_changed:
+            now = time.time()
+            failed = expire_workers(now)
+            if not failed:
+                # Sleep until the earliest worker deadline or the next lease sweep
+                wake_at = next_lease_check
+                if worker_deadlines:
+                    wake_at = min(wake_at, worker_deadlines[0][0])
+                liveness_changed.wait(max(wake_at - now, 0))
+        
+        for worker_id, write in failed:
+            try:
+                wait_for_write(write)
+            except sqlite3.Error as e:
+                logger.error(f"Worker check failed: {str(e)}")
+            requeue_worker_tasks(worker_id)
+        
+        if time.time() >= next_lease_check:
+            next_lease_check = time.time() + HEARTBEAT_INTERVAL
+            conn = acquire_db()
+            try:
+                requeue_expired_leases(conn.cursor())
+                timed_commit(conn)
+            except sqlite3.Error as e:
+                logger.error(f"Lease check failed: {str(e)}")
+            finally:
+                release_db(conn)
+
+# Async mode: an ASGI front end that holds connections on an event loop and runs
+# the Flask handlers on a bounded thread pool
+ASYNC_EXECUTOR_SIZE = 32  # Threads available for handler and database work
+ASYNC_CONTROL_EXECUTOR_SIZE = 4  # Threads reserved for worker control traffic
+CONTROL_PATHS = {'/register', '/task/complete', '/release', '/report'}
+CONTROL_PATH_PREFIXES = ('/heartbeat/',)
+ASYNC_BUFFER_LIMIT = 1024 * 1024  # Larger responses (e.g. blobs) are streamed, not buffered
+NO_WAIT_ENVIRON_KEY = 'scheduler.no_wait'
+REPARK_ENVIRON_KEY = 'scheduler.repark'  # Set by a handler that found nothing after the wait
+LONG_POLL_PATHS = {'/get_task', '/claim', '/claim_batch'}
+
+async_state = {}
+
+def start_async_state():
+    if async_state:
+        return
+    loop = asyncio.get_running_loop()
+    waiters = deque()
+    
+    def wake_waiters(count):
+        while waiters and count > 0:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(True)
+                count -= 1
+    
+    async_state.update({
+        'loop': loop,
+        'waiters': waiters,
+        'executor': ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_SIZE,
+                                       thread_name_prefix='asgi'),
+        'control_executor': ThreadPoolExecutor(max_workers=ASYNC_CONTROL_EXECUTOR_SIZE,
+                                               thread_name_prefix='asgi-control'),
+    })
+    with queue_lock:
+        queue_listeners.append(
+            lambda count: loop.call_soon_threadsafe(wake_waiters, count))
+
+def has_work_for(worker_id):
+    with queue_lock:
+        return TASK_QUEUE.has_work_for(worker_id)
+
+async def wait_for_tasks_async(timeout, worker_id=None, shared_only=False):
+    # shared_only waits for tasks an anonymous /get_task can see, which never includes
+    # constrained or affinity tasks even when has_work_for(None) could steal them
+    loop = async_state['loop']
+    deadline = loop.time() + timeout
+    while timeout > 0:
+        if shared_only:
+            if len(TASK_QUEUE.shared):
+                return
+        elif len(TASK_QUEUE.shared) or not TASK_QUEUE.restricted():
+            if len(TASK_QUEUE):
+                return
+        elif await loop.run_in_executor(async_state['executor'], has_work_for, worker_id):
+            # Checking requirements and affinity needs queue_lock, so it runs off the loop
+            return
+        future = loop.create_future()
+        async_state['waiters'].append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return
+        timeout = deadline - loop.time()
+
+def handler_executor(path):
+    # Heartbeats and completions skip the queue behind a burst of submissions
+    if path in CONTROL_PATHS or path.startswith(CONTROL_PATH_PREFIXES):
+        return async_state['control_executor']
+    return async_state['executor']
+
+def scope_mimetype(scope):
+    for name, value in scope['headers']:
+        if name == b'content-type':
+            return wire.mimetype_of(value.decode('latin-1'))
+    return None
+
+def requested_wait(scope, body):
+    # Returns (seconds to wait, worker id or None) for a long-poll request
+    if scope['path'] not in LONG_POLL_PATHS:
+        return 0, None
+    try:
+        if scope['method'] == 'GET':
+            query = parse_qs(scope['query_string'].decode('latin-1'))
+            value = query.get('wait', [0])[0]
+            worker_id = None
+        else:
+            if WIRE_MSGPACK and scope_mimetype(scope) in wire.MSGPACK_MIMETYPES:
+                data = wire.unpack(body) or {}
+            else:
+                data = json.loads(body or b'{}') or {}
+            value = data.get('wait', 0)
+            worker_id = data.get('worker_id')
+        return min(max(float(value or 0), 0), MAX_LONG_POLL), worker_id
+    except (AttributeError, TypeError, ValueError):
+        return 0, None
+
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        NO_WAIT_ENVIRON_KEY: True,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+def run_wsgi(environ):
+    # Runs on the executor; buffers the whole body unless the response streams
+    response = {}
+    
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                               for name, value in headers]
+    
+    iterable = app.wsgi_app(environ, start_response)
+    length = next((int(value) for name, value in response['headers'] if name == b'content-length'), None)
+    streaming = length is None or length > ASYNC_BUFFER_LIMIT
+    if streaming:
+        return response, iter(iterable), iterable
+    try:
+        return response, iter([b''.join(iterable)]), None
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+async def watch_tasks_async(scope, receive, send, body):
+    # Native event-loop /watch so open streams do not each pin a pool thread
+    loop = async_state['loop']
+    args = {key: values[0] for key, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        data = {}
+    parsed = parse_watch_request(args, data if isinstance(data, dict) else {})
+    if parsed is None:
+        await send_json(send, 400, {'error': 'Provide task ids and/or a queue to watch'})
+        return
+    task_ids, queue_name = parsed
+    
+    events = asyncio.Queue()
+    
+    def deliver(event):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+    
+    subscribe(task_ids, queue_name, deliver)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        try:
+            snapshot = await loop.run_in_executor(async_state['executor'], watch_snapshot, task_ids)
+        except sqlite3.Error as e:
+            logger.error(f"Database error: {str(e)}")
+            await send_json(send, 500, {'error': 'Database operation failed'})
+            return
+        
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'),
+                                (b'cache-control', b'no-cache')]})
+        remaining = set(task_ids)
+        finished = False
+        for event in snapshot:
+            await send({'type': 'http.response.body', 'body': format_sse(event).encode(),
+                        'more_body': True})
+            if watch_finished(event, remaining) and not queue_name:
+                finished = True
+                break
+        
+        while not finished:
+            getter = asyncio.ensure_future(events.get())
+            done, _ = await asyncio.wait({getter, disconnected}, timeout=WATCH_KEEPALIVE,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                getter.cancel()
+                return
+            if getter not in done:
+                getter.cancel()
+                chunk = ': keepalive\n\n'
+            else:
+                event = getter.result()
+                chunk = format_sse(event)
+                finished = watch_finished(event, remaining) and not queue_name
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        unsubscribe(task_ids, queue_name, deliver)
+
+async def asgi_app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                start_async_state()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    
+    start_async_state()
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    
+    if scope['path'] == '/watch':
+        await watch_tasks_async(scope, receive, send, body)
+        return
+    
+    # Idle long-polls wait here on the loop instead of occupying a pool thread
+    loop = async_state['loop']
+    executor = handler_executor(scope['path'])
+    wait, worker_id = requested_wait(scope, body)
+    deadline = loop.time() + wait
+    while True:
+        await wait_for_tasks_async(wait, worker_id, shared_only=scope['path'] == '/get_task')
+        environ = build_environ(scope, body)
+        response, chunks, closable = await loop.run_in_executor(executor, run_wsgi, environ)
+        wait = deadline - loop.time()
+        if not environ.get(REPARK_ENVIRON_KEY) or wait <= 0:
+            break
+        # Another fetch claimed the task first: drop the empty reply and wait out the deadline
+        if closable is not None and hasattr(closable, 'close'):
+            await loop.run_in_executor(executor, closable.close)
+    await send({'type': 'http.response.start', 'status': response['status'],
+                'headers': response['headers']})
+    try:
+        while True:
+            chunk = await loop.run_in_executor(executor, next, chunks, None)
+            if chunk is None:
+                break
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        if closable is not None and hasattr(closable, 'close'):
+            await loop.run_in_executor(executor, closable.close)
+    await send({'type': 'http.response.body', 'body': b''})
+
+def run_async_server(host, port):
+    try:
+        import uvicorn
+    except ImportError:
+        logger.error("Async mode requires uvicorn: pip install uvicorn")
+        sys.exit(1)
+    uvicorn.run(asgi_app, host=host, port=port, log_level='warning')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Distributed task scheduler coordinator')
+    parser.add_argument('--mode', choices=['threaded', 'async'], default='threaded',
+                        help='Thread-per-connection Flask server or asyncio/ASGI server')
+    parser.add_argument('--async-executor-size', type=int, default=ASYNC_EXECUTOR_SIZE,
+                        help='Handler threads in async mode')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--db', default=DB_PATH, help='SQLite database file')
+    parser.add_argument('--db-pool-size', type=int, default=DB_POOL_SIZE)
+    parser.add_argument('--db-cache-size-kb', type=int, default=DB_CACHE_SIZE_KB)
+    parser.add_argument('--db-mmap-size', type=int, default=DB_MMAP_SIZE)
+    parser.add_argument('--shard-id', type=int, default=SHARD_ID,
+                        help='Index of this shard, from 0 to --num-shards - 1')
+    parser.add_argument('--num-shards', type=int, default=NUM_SHARDS,
+                        help=f'Coordinator processes sharing the load (at most {MAX_SHARDS})')
+    parser.add_argument('--blob-dir', default=BLOB_DIR, help='Directory for large payloads and results')
+    parser.add_argument('--blob-threshold', type=int, default=BLOB_THRESHOLD,
+                        help='Bytes above which a description or result goes to the blob store')
+    parser.add_argument('--blob-compression', choices=['zlib', 'zstd', 'none'], default=BLOB_COMPRESSION,
+                        help='Compression for stored blobs (zstd needs the zstandard package)')
+    parser.add_argument('--archive-retention', type=int, default=ARCHIVE_RETENTION,
+                        help='Seconds to keep completed tasks before archiving them')
+    parser.add_argument('--idempotency-cache-size', type=int, default=IDEMPOTENCY_CACHE_SIZE,
+                        help='Recent idempotency keys kept in memory')
+    parser.add_argument('--idempotency-ttl', type=int, default=IDEMPOTENCY_TTL,
+                        help='Seconds an idempotency key stays in the memory cache')
+    parser.add_argument('--submit-rate', type=float, default=SUBMIT_RATE,
+                        help='Tasks per second each client may submit (0 = unlimited)')
+    parser.add_argument('--submit-burst', type=int, default=SUBMIT_BURST,
+                        help='Tasks a client may submit at once before its rate applies')
+    parser.add_argument('--queue-high-water', type=int, default=QUEUE_HIGH_WATER,
+                        help='Pending tasks at which submissions get 429 (0 = unlimited)')
+    parser.add_argument('--no-tracing', action='store_true',
+                        help='Do not record per-task lifecycle traces')
+    parser.add_argument('--lease-duration', type=int, default=LEASE_DURATION,
+                        help='Seconds a lease lasts; live workers have theirs renewed')
+    parser.add_argument('--steal-threshold', type=int, default=STEAL_THRESHOLD,
+                        help="Affinity backlog at which other workers may take a worker's tasks")
+    parser.add_argument('--local-queue-limit', type=int, default=LOCAL_QUEUE_LIMIT,
+                        help='Affinity tasks queued for one worker before the rest are shared')
+    parser.add_argument('--queue-weight', action='append', default=[], metavar='NAME=WEIGHT',
+                        help='Dequeue weight for a named queue (repeatable)')
+    return parser.parse_args()
 
 if __name__ == '__main__':
+    args = parse_args()
+    if not 1 <= args.num_shards <= MAX_SHARDS or not 0 <= args.shard_id < args.num_shards:
+        sys.exit(f"--shard-id must be in [0, --num-shards) and --num-shards in [1, {MAX_SHARDS}]")
+    SHARD_ID = args.shard_id
+    NUM_SHARDS = args.num_shards
+    DB_PATH = args.db
+    DB_POOL_SIZE = args.db_pool_size
+    DB_CACHE_SIZE_KB = args.db_cache_size_kb
+    DB_MMAP_SIZE = args.db_mmap_size
+    ASYNC_EXECUTOR_SIZE = args.async_executor_size
+    ARCHIVE_RETENTION = args.archive_retention
+    BLOB_DIR = args.blob_dir
+    BLOB_THRESHOLD = args.blob_threshold
+    BLOB_COMPRESSION = args.blob_compression
+    try:
+        BLOB_STORE = BlobStore(BLOB_DIR, BLOB_COMPRESSION)
+    except RuntimeError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    for spec in args.queue_weight:
+        name, _, weight = spec.partition('=')
+        QUEUE_WEIGHTS[name] = int(weight)
+    TASK_QUEUE.weights.update(QUEUE_WEIGHTS)
+    LEASE_DURATION = max(args.lease_duration, 1)
+    STEAL_THRESHOLD = max(args.steal_threshold, 1)
+    LOCAL_QUEUE_LIMIT = max(args.local_queue_limit, 0)
+    TASK_QUEUE.steal_threshold = STEAL_THRESHOLD
+    TASK_QUEUE.local_limit = LOCAL_QUEUE_LIMIT
+    IDEMPOTENCY_CACHE_SIZE = args.idempotency_cache_size
+    IDEMPOTENCY_TTL = args.idempotency_ttl
+    IDEMPOTENCY_CACHE = KeyCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+    SUBMIT_RATE = args.submit_rate
+    SUBMIT_BURST = max(args.submit_burst, 1)
+    QUEUE_HIGH_WATER = args.queue_high_water
+    SUBMIT_LIMITER = RateLimiter(SUBMIT_RATE, SUBMIT_BURST, MAX_RATE_LIMIT_CLIENTS)
+    TRACING = not args.no_tracing
+    
+    init_db()
+    init_db_pool()
+    init_task_ids()
+    recover_task_queue()
+    load_worker_liveness()
+    
+    # Start the group-commit writer
+    writer_thread = threading.Thread(target=write_behind_loop)
+    writer_thread.daemon = True
+    writer_thread.start()
+    
+    # Start the archiver for old completed tasks
+    archive_thread = threading.Thread(target=archive_loop)
+    archive_thread.daemon = True
+    archive_thread.start()
+    
     # Start background thread for worker monitoring
     monitor_thread = threading.Thread(target=check_workers)
     monitor_thread.daemon = True
     monitor_thread.start()
     
-    # Start Flask server
-    app.run(host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
+    # Start the HTTP server
+    if args.mode == 'async':
+        run_async_server(args.host, args.port)
+    else:
+        app.run(host=args.host, port=args.port, threaded=True)
\ No newline at end of file
@@ -0,0 +1,49 @@
+import time
+from collections import OrderedDict
+
+
+# Bounded LRU of recently seen idempotency keys, each remembered for ttl
+# seconds after it was stored. Lookups that hit move the key to the young
+# end; stores evict from the old end once capacity is exceeded.
+# Callers are expected to hold a lock around every call.
+class KeyCache:
+    def __init__(self, capacity, ttl):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (task_id, expires_at), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {'capacity': 0, 'expired': 0}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, now=None):
+        # Returns the task id stored for key, or None
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[1] <= (now if now is not None else time.monotonic()):
+            del self.entries[key]
+            self.evictions['expired'] += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, task_id, now=None):
+        now = now if now is not None else time.monotonic()
+        self.entries[key] = (task_id, now + self.ttl)
+        self.entries.move_to_end(key)
+        # Expired entries at the old end go first, then whatever exceeds capacity
+        while self.entries:
+            oldest_key, (_, expires_at) = next(iter(self.entries.items()))
+            if expires_at <= now:
+                self.evictions['expired'] += 1
+            elif len(self.entries) > self.capacity:
+                self.evictions['capacity'] += 1
+            else:
+                break
+            del self.entries[oldest_key]
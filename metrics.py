@@ -0,0 +1,195 @@
+import bisect
+import threading
+import time
+import weakref
+
+# Bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600, 4 * 3600)
+
+# Every thread records into its own shard, so observations take no lock and
+# never contend. A scrape sums the live shards plus everything retired by
+# threads that have exited (the threaded server uses a thread per request).
+_local = threading.local()
+_shards_lock = threading.Lock()
+_live_shards = {}  # id(shard) -> shard for threads still running
+_retired = {}  # (metric, label value) -> series merged from finished threads
+_metrics = []  # Registration order, which is also exposition order
+
+
+class _ShardOwner:
+    # Lives only in the thread-local, so it is collected when the thread exits
+    pass
+
+
+def _merge(target, shard):
+    for key, series in list(shard.items()):
+        merged = target.get(key)
+        if merged is None:
+            target[key] = list(series)
+        else:
+            for i, value in enumerate(series):
+                merged[i] += value
+
+
+def _retire(shard):
+    with _shards_lock:
+        _live_shards.pop(id(shard), None)
+        _merge(_retired, shard)
+
+
+def _new_shard():
+    shard = {}
+    owner = _ShardOwner()
+    _local.owner = owner
+    _local.shard = shard
+    with _shards_lock:
+        _live_shards[id(shard)] = shard
+    weakref.finalize(owner, _retire, shard)
+    return shard
+
+
+def _snapshot():
+    totals = {}
+    with _shards_lock:
+        shards = list(_live_shards.values())
+        _merge(totals, _retired)
+    for shard in shards:
+        _merge(totals, shard)
+    return totals
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(label, value, extra=''):
+    parts = [f'{label}="{_escape(value)}"'] if label else []
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        _metrics.append(self)
+
+    def inc(self, amount=1, label_value=''):
+        try:
+            shard = _local.shard
+        except AttributeError:
+            shard = _new_shard()
+        series = shard.get((self, label_value))
+        if series is None:
+            series = shard[(self, label_value)] = [0]
+        series[0] += amount
+
+    def render(self, totals, lines):
+        lines.append(f'# HELP {self.name} {self.help}')
+        lines.append(f'# TYPE {self.name} counter')
+        for (metric, label_value), series in totals.items():
+            if metric is self:
+                lines.append(f'{self.name}{_labels(self.label, label_value)} {series[0]}')
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, label=None):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.label = label
+        _metrics.append(self)
+
+    def observe(self, value, label_value=''):
+        try:
+            shard = _local.shard
+        except AttributeError:
+            shard = _new_shard()
+        series = shard.get((self, label_value))
+        if series is None:
+            # One count per bucket, the +Inf bucket, then the running sum
+            series = shard[(self, label_value)] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self, totals, lines):
+        lines.append(f'# HELP {self.name} {self.help}')
+        lines.append(f'# TYPE {self.name} histogram')
+        for (metric, label_value), series in sorted(
+                ((key, series) for key, series in totals.items() if key[0] is self),
+                key=lambda item: str(item[0][1])):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{bound:g}"'
+                lines.append(f'{self.name}_bucket{_labels(self.label, label_value, le)} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f'{self.name}_bucket{_labels(self.label, label_value, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label, label_value)} {series[-1]}')
+            lines.append(f'{self.name}_count{_labels(self.label, label_value)} {cumulative}')
+
+
+class TimedLock:
+    # A threading.Lock that records how long contended acquisitions waited.
+    # The uncontended path is a single non-blocking acquire and is not timed.
+    # Usable wherever a Lock is, including as the lock of a Condition.
+    def __init__(self, histogram, name):
+        self._lock = threading.Lock()
+        self.histogram = histogram
+        self.name = name
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        started = time.perf_counter()
+        acquired = self._lock.acquire(True, timeout)
+        self.histogram.observe(time.perf_counter() - started, self.name)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
+
+
+def gauge(lines, name, help_text, samples, label=None):
+    # samples is a number, or {label value: number} when label is given
+    _samples(lines, name, help_text, 'gauge', samples, label)
+
+
+def counter(lines, name, help_text, samples, label=None):
+    # For totals kept elsewhere, e.g. by a data structure under its own lock
+    _samples(lines, name, help_text, 'counter', samples, label)
+
+
+def _samples(lines, name, help_text, kind, samples, label):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+    if label is None:
+        lines.append(f'{name} {samples}')
+        return
+    for label_value, value in sorted(samples.items(), key=lambda item: str(item[0])):
+        lines.append(f'{name}{_labels(label, label_value)} {value}')
+
+
+def render(extra_lines=()):
+    # Prometheus text exposition format 0.0.4
+    totals = _snapshot()
+    lines = []
+    for metric in _metrics:
+        metric.render(totals, lines)
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
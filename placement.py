@@ -0,0 +1,212 @@
+from task_queue import TaskQueue
+from key_cache import KeyCache
+
+NO_REQUIREMENTS = (frozenset(), 0, 0)  # (tags, cores, memory in MB)
+UNKNOWN_PROFILE = (0, 0, frozenset())  # Workers that never described themselves: (cores, memory, tags)
+
+
+def satisfies(profile, requirements):
+    cores, memory, tags = profile
+    required_tags, required_cores, required_memory = requirements
+    return required_tags <= tags and required_cores <= cores and required_memory <= memory
+
+
+# Capability- and affinity-aware dispatch with the TaskQueue interface.
+# Tasks live in one of three kinds of TaskQueue:
+#   shared       - no requirements; any worker may take them
+#   constrained  - one queue per distinct (tags, cores, memory) requirement,
+#                  offered only to workers whose profile satisfies it
+#   local        - per worker: tasks whose affinity key that worker ran last,
+#                  routed there so they hit its warm caches
+# A claim takes from the worker's local queue first, then the best head by
+# priority and age among the queues it may use. That includes the local
+# queues of other workers whose backlog has reached steal_threshold, so a
+# slow worker's affinity backlog is stolen instead of waiting on it. A worker
+# with nothing else it may run steals from any local queue, however short,
+# so affinity never leaves a task waiting on a busy worker while others idle.
+# A local queue also stops accepting new tasks at local_limit; they go to the
+# general queues instead.
+# Tasks without requirements or affinity never get a spec and cost nothing
+# extra. Callers are expected to hold queue_lock around every call.
+class Dispatcher:
+    def __init__(self, weights=None, steal_threshold=8, local_limit=64,
+                 affinity_capacity=100000, affinity_ttl=3600):
+        self.weights = dict(weights or {})
+        self.steal_threshold = steal_threshold
+        self.local_limit = local_limit
+        self.shared = self._new_queue()
+        self.constrained = {}  # requirements -> TaskQueue
+        self.local = {}  # worker_id -> TaskQueue
+        self.location = {}  # task_id -> the TaskQueue holding it
+        self.specs = {}  # task_id -> (requirements, affinity key) for tasks that have either
+        self.profiles = {}  # worker_id -> (cores, memory, tags)
+        self.affinity = KeyCache(affinity_capacity, affinity_ttl)  # affinity key -> worker_id
+        self.steals = 0
+        self.restricted_pushed = False  # Set when a push lands outside the shared queue; cleared by the caller
+
+    def _new_queue(self):
+        task_queue = TaskQueue()
+        task_queue.weights = self.weights  # Shared, so weight updates reach every queue
+        return task_queue
+
+    def __len__(self):
+        return len(self.location)
+
+    def __contains__(self, task_id):
+        return task_id in self.location
+
+    def _queues(self):
+        yield self.shared
+        yield from self.constrained.values()
+        yield from self.local.values()
+
+    def depth(self, queue_name):
+        return sum(task_queue.depth(queue_name) for task_queue in self._queues())
+
+    def depths(self):
+        depths = {}
+        for task_queue in self._queues():
+            for queue_name, count in task_queue.depths().items():
+                depths[queue_name] = depths.get(queue_name, 0) + count
+        return depths
+
+    def restricted(self):
+        # True while some queued task cannot be taken by every worker
+        return len(self.location) > len(self.shared)
+
+    def set_spec(self, task_id, requirements=NO_REQUIREMENTS, affinity_key=None):
+        # Declare a task's placement before it is pushed; kept until forget()
+        if requirements != NO_REQUIREMENTS or affinity_key is not None:
+            self.specs[task_id] = (requirements, affinity_key)
+
+    def forget(self, task_id):
+        self.specs.pop(task_id, None)
+
+    def set_worker(self, worker_id, profile):
+        self.profiles[worker_id] = profile or UNKNOWN_PROFILE
+
+    def drop_worker(self, worker_id):
+        # A departed worker's local backlog goes back through routing; returns how many tasks moved
+        self.profiles.pop(worker_id, None)
+        local = self.local.pop(worker_id, None)
+        if not local:
+            return 0
+        entries = [(task_id, priority, queue_name)
+                   for task_id, (queue_name, priority) in local.index.items()]
+        for task_id, _, _ in entries:
+            del self.location[task_id]
+        self.extend(entries)
+        return len(entries)
+
+    def _route(self, task_id, now=None):
+        spec = self.specs.get(task_id)
+        if spec is None:
+            return self.shared
+        requirements, affinity_key = spec
+        if affinity_key is not None:
+            owner = self.affinity.get(affinity_key, now)
+            profile = self.profiles.get(owner)
+            if profile is not None and satisfies(profile, requirements):
+                local = self.local.get(owner)
+                if local is None:
+                    local = self.local[owner] = self._new_queue()
+                if len(local) < self.local_limit:
+                    return local
+        if requirements == NO_REQUIREMENTS:
+            return self.shared
+        task_queue = self.constrained.get(requirements)
+        if task_queue is None:
+            task_queue = self.constrained[requirements] = self._new_queue()
+        return task_queue
+
+    def push(self, task_id, priority=0, queue_name='default'):
+        if task_id in self.location:
+            return
+        task_queue = self._route(task_id)
+        task_queue.push(task_id, priority, queue_name)
+        self.location[task_id] = task_queue
+        if task_queue is not self.shared:
+            self.restricted_pushed = True
+
+    def extend(self, entries):
+        routed = {}
+        for entry in entries:
+            if entry[0] in self.location:
+                continue
+            task_queue = self._route(entry[0])
+            routed.setdefault(id(task_queue), (task_queue, []))[1].append(entry)
+            self.location[entry[0]] = task_queue
+        for task_queue, queue_entries in routed.values():
+            task_queue.extend(queue_entries)
+            if task_queue is not self.shared:
+                self.restricted_pushed = True
+
+    def _prune(self, task_queue, task_id):
+        # Constrained queues exist only while they hold tasks, so distinct
+        # requirements cannot pile up empty queues that every claim scans
+        if not len(task_queue) and task_queue is not self.shared:
+            spec = self.specs.get(task_id)
+            if spec is not None and self.constrained.get(spec[0]) is task_queue:
+                del self.constrained[spec[0]]
+
+    def remove(self, task_id):
+        task_queue = self.location.pop(task_id, None)
+        if task_queue is None or not task_queue.remove(task_id):
+            return False
+        self._prune(task_queue, task_id)
+        return True
+
+    def _candidates(self, worker_id, steal_threshold):
+        # (queue, stolen) for non-empty queues this worker may take from, besides its own local queue
+        profile = self.profiles.get(worker_id, UNKNOWN_PROFILE)
+        if len(self.shared):
+            yield self.shared, False
+        for requirements, task_queue in self.constrained.items():
+            if len(task_queue) and satisfies(profile, requirements):
+                yield task_queue, False
+        for owner, task_queue in self.local.items():
+            if owner != worker_id and len(task_queue) >= steal_threshold:
+                spec = self.specs.get(task_queue.peek()[0])
+                if spec is None or satisfies(profile, spec[0]):
+                    yield task_queue, True
+
+    def has_work_for(self, worker_id):
+        if len(self.local.get(worker_id, ())):
+            return True
+        return next(self._candidates(worker_id, 1), None) is not None
+
+    def _best(self, worker_id, steal_threshold):
+        best = None
+        for candidate, stolen in self._candidates(worker_id, steal_threshold):
+            task_id, priority, _ = candidate.peek()
+            if best is None or (-priority, task_id) < best[0]:
+                best = ((-priority, task_id), candidate, stolen)
+        return best
+
+    def pop_for(self, worker_id, now=None):
+        # Returns (task_id, priority, queue_name) for this worker, or None
+        task_queue = self.local.get(worker_id)
+        if not task_queue:
+            # Short backlogs are only stolen when the worker would otherwise sit idle
+            best = self._best(worker_id, self.steal_threshold) or self._best(worker_id, 1)
+            if best is None:
+                return None
+            _, task_queue, stolen = best
+            self.steals += stolen
+        entry = task_queue.pop()
+        del self.location[entry[0]]
+        self._prune(task_queue, entry[0])
+        spec = self.specs.get(entry[0])
+        if spec is not None and spec[1] is not None:
+            # The worker that runs a key last has the warmest cache for the next one
+            self.affinity.put(spec[1], worker_id, now)
+        return entry
+
+    def pop(self):
+        # Workers that do not identify themselves only get unrestricted tasks
+        return self.pop_for(None)
+
+    def peek(self):
+        if not len(self.shared):
+            return None
+        return self.shared.peek()
@@ -0,0 +1,35 @@
+import time
+from collections import OrderedDict
+
+
+# Per-client token buckets. A client earns `rate` tokens a second up to
+# `burst` and spends one per task it submits. A request costing more than
+# the burst is admitted once the bucket is full and leaves it in debt, so
+# large batches are paced instead of refused forever. Buckets of the least
+# recently seen clients are dropped once max_clients is exceeded.
+# Callers are expected to hold a lock around every call.
+class RateLimiter:
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()  # client -> (tokens, updated_at), least recently seen first
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def acquire(self, client, cost=1, now=None):
+        # Returns 0 if admitted, else the seconds until the request would be
+        now = now if now is not None else time.monotonic()
+        tokens, updated_at = self.buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        needed = min(cost, self.burst)
+        if tokens >= needed:
+            tokens -= cost
+            wait = 0
+        else:
+            wait = (needed - tokens) / self.rate
+        self.buckets[client] = (tokens, now)
+        while len(self.buckets) > self.max_clients:
+            self.buckets.popitem(last=False)
+        return wait
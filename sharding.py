@@ -0,0 +1,30 @@
+import bisect
+import hashlib
+
+MAX_SHARDS = 1024  # Sharded task ids are seq * MAX_SHARDS + shard id
+RING_REPLICAS = 100  # Points per shard on the hash ring
+
+
+def shard_for_task(task_id, num_shards):
+    # Unsharded deployments keep plain sequential ids, all on shard 0
+    return task_id % MAX_SHARDS if num_shards > 1 else 0
+
+
+def hash_key(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+# Consistent hashing of task keys onto shard indexes. Each shard owns
+# RING_REPLICAS points on the ring and a key goes to the next point
+# clockwise, so adding a shard only moves the keys that now land on it.
+# The same key always reaches the same shard, which keeps idempotency
+# keys deduplicated across retries.
+class HashRing:
+    def __init__(self, shards, replicas=RING_REPLICAS):
+        points = sorted((hash_key(f'{shard}:{i}'), shard) for shard in shards for i in range(replicas))
+        self.hashes = [point for point, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    def shard_for(self, key):
+        i = bisect.bisect(self.hashes, hash_key(key))
+        return self.shards[i % len(self.shards)]
@@ -0,0 +1,106 @@
+import heapq
+
+DEFAULT_QUEUE = 'default'
+
+
+# Named priority queues with weighted fair dequeue across queues.
+# Each named queue is a heap keyed on (-priority, task_id), so higher
+# priorities go first and equal priorities keep submission order. An id
+# index makes removal O(1); removed entries are skipped lazily on pop.
+# A queue name's heap, count and credit are dropped once it empties, so
+# client-chosen names do not accumulate for every later pop to scan.
+# Callers are expected to hold queue_lock around every call.
+class TaskQueue:
+    def __init__(self, weights=None):
+        self.weights = dict(weights or {})
+        self.heaps = {}  # queue name -> heap of (-priority, task_id)
+        self.index = {}  # task_id -> (queue name, priority) for live entries
+        self.counts = {}  # queue name -> number of live entries; only non-empty queues
+        self.credits = {}  # Smooth weighted round-robin state per queue
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, task_id):
+        return task_id in self.index
+
+    def depth(self, queue_name):
+        return self.counts.get(queue_name, 0)
+
+    def depths(self):
+        return dict(self.counts)
+
+    def push(self, task_id, priority=0, queue_name=DEFAULT_QUEUE):
+        if task_id in self.index:
+            return
+        self.index[task_id] = (queue_name, priority)
+        self.counts[queue_name] = self.counts.get(queue_name, 0) + 1
+        heapq.heappush(self.heaps.setdefault(queue_name, []), (-priority, task_id))
+
+    def extend(self, entries):
+        # Bulk load (task_id, priority, queue_name) entries with one heapify per queue
+        touched = set()
+        for task_id, priority, queue_name in entries:
+            if task_id in self.index:
+                continue
+            self.index[task_id] = (queue_name, priority)
+            self.counts[queue_name] = self.counts.get(queue_name, 0) + 1
+            self.heaps.setdefault(queue_name, []).append((-priority, task_id))
+            touched.add(queue_name)
+        for queue_name in touched:
+            heapq.heapify(self.heaps[queue_name])
+
+    def remove(self, task_id):
+        entry = self.index.pop(task_id, None)
+        if entry is None:
+            return False
+        queue_name = entry[0]
+        self.counts[queue_name] -= 1
+        if not self.counts[queue_name]:
+            del self.counts[queue_name]
+            del self.heaps[queue_name]
+            self.credits.pop(queue_name, None)
+        return True
+
+    def pop(self):
+        # Returns (task_id, priority, queue_name), or None when every queue is empty
+        queue_name = self._select_queue(advance=True)
+        if queue_name is None:
+            return None
+        task_id, priority = self._head(queue_name)
+        heapq.heappop(self.heaps[queue_name])
+        self.remove(task_id)
+        return task_id, priority, queue_name
+
+    def peek(self):
+        queue_name = self._select_queue(advance=False)
+        if queue_name is None:
+            return None
+        task_id, priority = self._head(queue_name)
+        return task_id, priority, queue_name
+
+    def _head(self, queue_name):
+        # Discard stale heap entries until the head is live
+        heap = self.heaps[queue_name]
+        while True:
+            neg_priority, task_id = heap[0]
+            if self.index.get(task_id) == (queue_name, -neg_priority):
+                return task_id, -neg_priority
+            heapq.heappop(heap)
+
+    def _select_queue(self, advance):
+        # Smooth weighted round-robin over the non-empty queues
+        total = 0
+        best = None
+        best_credit = None
+        for queue_name in self.counts:
+            weight = self.weights.get(queue_name, 1)
+            credit = self.credits.get(queue_name, 0) + weight
+            if advance:
+                self.credits[queue_name] = credit
+            total += weight
+            if best is None or credit > best_credit:
+                best, best_credit = queue_name, credit
+        if advance and best is not None:
+            self.credits[best] -= total
+        return best
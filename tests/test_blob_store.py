@@ -0,0 +1,39 @@
+import pytest
+
+from blob_store import parse_range
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-9', (0, 10)),
+    ('bytes=10-19', (10, 20)),
+    ('bytes=90-200', (90, 100)),
+    ('bytes=10-', (10, 100)),
+    ('bytes=-10', (90, 100)),
+    ('bytes=-500', (0, 100)),
+    ('bytes=5-5', (5, 6)),
+])
+def test_satisfiable_ranges(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize('header', [
+    None,
+    '',
+    'items=0-9',
+    'bytes=0-9,20-29',
+    'bytes=a-9',
+    'bytes=0-b',
+    'bytes=9-0',
+])
+def test_missing_unsupported_or_invalid_ranges_are_ignored(header):
+    assert parse_range(header, 100) is None
+
+
+@pytest.mark.parametrize('header', ['bytes=100-', 'bytes=100-200', 'bytes=-0'])
+def test_unsatisfiable_ranges(header):
+    assert parse_range(header, 100) is False
+
+
+def test_empty_blobs_satisfy_no_range():
+    assert parse_range('bytes=0-', 0) is False
+    assert parse_range('bytes=-10', 0) == (0, 0)
@@ -0,0 +1,40 @@
+from key_cache import KeyCache
+
+
+def test_hits_and_misses():
+    cache = KeyCache(10, 60)
+    cache.put('a', 1, now=0)
+    assert cache.get('a', now=1) == 1
+    assert cache.get('b', now=1) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entries_expire_after_ttl():
+    cache = KeyCache(10, 60)
+    cache.put('a', 1, now=0)
+    assert cache.get('a', now=59) == 1
+    assert cache.get('a', now=60) is None
+    assert len(cache) == 0
+    assert cache.evictions['expired'] == 1
+
+
+def test_least_recently_used_is_evicted_at_capacity():
+    cache = KeyCache(2, 60)
+    cache.put('a', 1, now=0)
+    cache.put('b', 2, now=0)
+    assert cache.get('a', now=1) == 1
+    cache.put('c', 3, now=1)
+    assert cache.get('b', now=1) is None
+    assert cache.get('a', now=1) == 1
+    assert cache.get('c', now=1) == 3
+    assert cache.evictions['capacity'] == 1
+
+
+def test_expired_entries_go_before_capacity_evictions():
+    cache = KeyCache(2, 10)
+    cache.put('a', 1, now=0)
+    cache.put('b', 2, now=5)
+    cache.put('c', 3, now=12)
+    assert len(cache) == 2
+    assert cache.evictions == {'capacity': 0, 'expired': 1}
+    assert cache.get('b', now=12) == 2
@@ -0,0 +1,162 @@
+import random
+
+from placement import Dispatcher, NO_REQUIREMENTS
+
+GPU = (frozenset({'gpu'}), 0, 0)
+BIG = (frozenset(), 8, 0)
+PLAIN_WORKER = (1, 1024, frozenset())
+GPU_WORKER = (8, 4096, frozenset({'gpu'}))
+
+
+def make_dispatcher(**kwargs):
+    dispatcher = Dispatcher(**kwargs)
+    dispatcher.set_worker(1, PLAIN_WORKER)
+    dispatcher.set_worker(2, GPU_WORKER)
+    return dispatcher
+
+
+def push(dispatcher, task_id, requirements=NO_REQUIREMENTS, affinity_key=None, priority=0):
+    dispatcher.set_spec(task_id, requirements, affinity_key)
+    dispatcher.push(task_id, priority)
+
+
+def bind_affinity(dispatcher, worker_id, affinity_key, task_id):
+    # A worker owns a key once it has run a task with it
+    push(dispatcher, task_id, affinity_key=affinity_key)
+    assert dispatcher.pop_for(worker_id)[0] == task_id
+
+
+def test_unconstrained_tasks_go_to_the_shared_queue():
+    dispatcher = make_dispatcher()
+    dispatcher.push(1)
+    assert dispatcher.location[1] is dispatcher.shared
+    assert not dispatcher.restricted()
+    assert not dispatcher.restricted_pushed
+    assert dispatcher.peek() == (1, 0, 'default')
+    assert dispatcher.pop() == (1, 0, 'default')
+    assert len(dispatcher) == 0
+
+
+def test_constrained_tasks_only_reach_workers_that_satisfy_them():
+    dispatcher = make_dispatcher()
+    push(dispatcher, 1, GPU)
+    assert dispatcher.constrained[GPU].peek()[0] == 1
+    assert dispatcher.restricted()
+    assert dispatcher.restricted_pushed
+    assert dispatcher.peek() is None
+    assert dispatcher.pop() is None
+    assert not dispatcher.has_work_for(1)
+    assert dispatcher.pop_for(1) is None
+    assert dispatcher.has_work_for(2)
+    assert dispatcher.pop_for(2)[0] == 1
+
+
+def test_claims_take_the_best_head_across_queues():
+    dispatcher = make_dispatcher()
+    dispatcher.push(1, priority=0)
+    push(dispatcher, 2, BIG, priority=5)
+    push(dispatcher, 3, GPU, priority=0)
+    assert [dispatcher.pop_for(2)[0] for _ in range(3)] == [2, 1, 3]
+
+
+def test_affinity_routes_to_the_worker_that_last_ran_the_key():
+    dispatcher = make_dispatcher()
+    bind_affinity(dispatcher, 1, 'key', 1)
+    push(dispatcher, 2, affinity_key='key')
+    assert dispatcher.location[2] is dispatcher.local[1]
+    dispatcher.push(3)
+    # The local backlog comes before older shared work
+    assert dispatcher.pop_for(1)[0] == 2
+
+
+def test_affinity_falls_back_when_the_owner_cannot_run_the_task():
+    dispatcher = make_dispatcher()
+    bind_affinity(dispatcher, 1, 'key', 1)
+    push(dispatcher, 2, GPU, affinity_key='key')
+    assert dispatcher.location[2] is dispatcher.constrained[GPU]
+
+
+def test_full_local_queues_spill_to_the_general_queues():
+    dispatcher = make_dispatcher(local_limit=2)
+    bind_affinity(dispatcher, 1, 'key', 1)
+    for task_id in (2, 3, 4):
+        push(dispatcher, task_id, affinity_key='key')
+    assert len(dispatcher.local[1]) == 2
+    assert dispatcher.location[4] is dispatcher.shared
+
+
+def test_short_backlogs_are_only_stolen_by_idle_workers():
+    dispatcher = make_dispatcher(steal_threshold=3)
+    bind_affinity(dispatcher, 1, 'key', 1)
+    push(dispatcher, 2, affinity_key='key', priority=5)
+    dispatcher.push(3)
+    # Worker 2 has shared work, so the higher-priority local task stays with its owner
+    assert dispatcher.pop_for(2)[0] == 3
+    assert dispatcher.steals == 0
+    # With nothing else to run it steals, however short the backlog
+    assert dispatcher.has_work_for(2)
+    assert dispatcher.pop_for(2)[0] == 2
+    assert dispatcher.steals == 1
+
+
+def test_long_backlogs_are_stolen_by_priority_and_age():
+    dispatcher = make_dispatcher(steal_threshold=2)
+    bind_affinity(dispatcher, 1, 'key', 1)
+    push(dispatcher, 2, affinity_key='key')
+    push(dispatcher, 3, affinity_key='key')
+    dispatcher.push(4)
+    assert dispatcher.pop_for(2)[0] == 2
+    assert dispatcher.steals == 1
+    # The backlog fell below the threshold, so shared work comes first again
+    assert dispatcher.pop_for(2)[0] == 4
+
+
+def test_stealing_respects_requirements():
+    dispatcher = make_dispatcher()
+    bind_affinity(dispatcher, 2, 'key', 1)
+    push(dispatcher, 2, GPU, affinity_key='key')
+    assert dispatcher.location[2] is dispatcher.local[2]
+    assert not dispatcher.has_work_for(1)
+    assert dispatcher.pop_for(1) is None
+
+
+def test_empty_constrained_queues_are_pruned():
+    dispatcher = make_dispatcher()
+    push(dispatcher, 1, GPU)
+    push(dispatcher, 2, BIG)
+    assert dispatcher.pop_for(2)[0] == 1
+    assert GPU not in dispatcher.constrained
+    assert dispatcher.remove(2)
+    assert BIG not in dispatcher.constrained
+    assert not dispatcher.remove(2)
+
+
+def test_dropped_workers_hand_their_backlog_back():
+    dispatcher = make_dispatcher()
+    bind_affinity(dispatcher, 1, 'key', 1)
+    push(dispatcher, 2, affinity_key='key')
+    assert dispatcher.drop_worker(1) == 1
+    assert 1 not in dispatcher.local
+    assert dispatcher.location[2] is dispatcher.shared
+
+
+def test_has_work_for_agrees_with_pop_for():
+    rng = random.Random(7)
+    requirements = [NO_REQUIREMENTS, GPU, BIG]
+    for _ in range(50):
+        dispatcher = make_dispatcher(steal_threshold=rng.randint(1, 4), local_limit=rng.randint(1, 4))
+        dispatcher.set_worker(3, None)
+        task_id = 0
+        for _ in range(200):
+            worker_id = rng.randint(1, 3)
+            if rng.random() < 0.5:
+                task_id += 1
+                push(dispatcher, task_id, rng.choice(requirements),
+                     rng.choice([None, 'a', 'b', 'c']), rng.randint(0, 2))
+                continue
+            if rng.random() < 0.1 and task_id:
+                dispatcher.remove(rng.randint(1, task_id))
+                continue
+            expected = dispatcher.has_work_for(worker_id)
+            assert (dispatcher.pop_for(worker_id) is not None) == expected
+        assert len(dispatcher) == sum(len(task_queue) for task_queue in dispatcher._queues())
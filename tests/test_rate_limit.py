@@ -0,0 +1,39 @@
+import pytest
+
+from rate_limit import RateLimiter
+
+
+def test_burst_then_rate():
+    limiter = RateLimiter(rate=10, burst=5)
+    assert all(limiter.acquire('a', now=0) == 0 for _ in range(5))
+    assert limiter.acquire('a', now=0) == pytest.approx(0.1)
+    assert limiter.acquire('a', now=0.1) == 0
+
+
+def test_clients_have_separate_buckets():
+    limiter = RateLimiter(rate=1, burst=1)
+    assert limiter.acquire('a', now=0) == 0
+    assert limiter.acquire('a', now=0) > 0
+    assert limiter.acquire('b', now=0) == 0
+
+
+def test_batches_larger_than_the_burst_are_paced_not_refused():
+    limiter = RateLimiter(rate=10, burst=5)
+    assert limiter.acquire('a', cost=20, now=0) == 0
+    # The batch left the bucket 15 tokens in debt; one more token takes 1.6 seconds
+    assert limiter.acquire('a', now=0) == pytest.approx(1.6)
+    assert limiter.acquire('a', now=1.6) == 0
+
+
+def test_tokens_do_not_accumulate_past_the_burst():
+    limiter = RateLimiter(rate=10, burst=2)
+    assert limiter.acquire('a', now=0) == 0
+    assert limiter.acquire('a', cost=2, now=100) == 0
+    assert limiter.acquire('a', now=100) > 0
+
+
+def test_least_recently_seen_clients_are_dropped():
+    limiter = RateLimiter(rate=1, burst=1, max_clients=2)
+    for client in ('a', 'b', 'a', 'c'):
+        limiter.acquire(client, now=0)
+    assert list(limiter.buckets) == ['a', 'c']
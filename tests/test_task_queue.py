@@ -0,0 +1,59 @@
+from task_queue import TaskQueue
+
+
+def test_higher_priorities_first_then_submission_order():
+    task_queue = TaskQueue()
+    task_queue.push(3, 0)
+    task_queue.push(1, 0)
+    task_queue.push(2, 5)
+    assert task_queue.peek() == (2, 5, 'default')
+    assert [task_queue.pop()[0] for _ in range(3)] == [2, 1, 3]
+    assert task_queue.pop() is None
+    assert task_queue.peek() is None
+
+
+def test_duplicate_pushes_are_ignored():
+    task_queue = TaskQueue()
+    task_queue.push(1, 0)
+    task_queue.push(1, 9)
+    task_queue.extend([(1, 3, 'other')])
+    assert len(task_queue) == 1
+    assert task_queue.pop() == (1, 0, 'default')
+
+
+def test_removed_tasks_are_skipped():
+    task_queue = TaskQueue()
+    task_queue.extend([(1, 0, 'default'), (2, 0, 'default'), (3, 0, 'default')])
+    assert task_queue.remove(1)
+    assert not task_queue.remove(1)
+    assert 1 not in task_queue
+    assert task_queue.depth('default') == 2
+    assert task_queue.pop()[0] == 2
+
+
+def test_weighted_round_robin_across_queues():
+    task_queue = TaskQueue({'heavy': 3})
+    task_queue.extend([(task_id, 0, 'heavy') for task_id in range(100)])
+    task_queue.extend([(task_id, 0, 'light') for task_id in range(100, 200)])
+    names = [task_queue.pop()[2] for _ in range(40)]
+    assert names.count('heavy') == 30
+    assert names.count('light') == 10
+    # Smooth: the light queue is never starved for a whole cycle
+    assert all('light' in names[start:start + 4] for start in range(0, 40, 4))
+
+
+def test_empty_queue_names_are_dropped():
+    task_queue = TaskQueue()
+    for task_id in range(10):
+        task_queue.push(task_id, 0, f'queue-{task_id}')
+    for task_id in range(5):
+        task_queue.remove(task_id)
+    while task_queue.pop() is not None:
+        pass
+    assert task_queue.counts == {}
+    assert task_queue.heaps == {}
+    assert task_queue.credits == {}
+    assert task_queue.depths() == {}
+    task_queue.push(20, 0, 'queue-1')
+    assert task_queue.depths() == {'queue-1': 1}
+    assert task_queue.pop() == (20, 0, 'queue-1')
@@ -0,0 +1,39 @@
+import pytest
+
+import wire
+
+pytest.importorskip('msgpack')
+
+
+def test_frames_round_trip():
+    documents = [{'id': 1, 'description': 'x'}, [1, 2, 3], 'text', None, {'blob': b'\x00' * 300}]
+    assert wire.unpack_frames(wire.pack_frames(documents)) == documents
+
+
+def test_empty_body_has_no_frames():
+    assert wire.unpack_frames(b'') == []
+
+
+def test_truncated_frames_are_rejected():
+    data = wire.pack_frames([{'id': 1}, {'id': 2}])
+    for cut in (1, 3, len(data) - 1):
+        with pytest.raises(ValueError):
+            wire.unpack_frames(data[:cut])
+
+
+def test_wrong_frame_length_is_rejected():
+    body = wire.pack({'id': 1})
+    with pytest.raises(ValueError):
+        wire.unpack_frames(wire.FRAME_HEADER.pack(wire.FRAME_MARKER, len(body) + 1) + body + b'\xc0')
+
+
+def test_oversized_frame_header_is_rejected():
+    with pytest.raises(ValueError):
+        wire.unpack_frames(wire.FRAME_HEADER.pack(wire.FRAME_MARKER, wire.MAX_FRAME_SIZE + 1) + b'\xc0')
+
+
+def test_unframed_msgpack_is_rejected():
+    with pytest.raises(ValueError):
+        wire.unpack_frames(wire.pack({'id': 1}))
+    with pytest.raises(ValueError):
+        wire.unpack_frames(wire.pack(5) + wire.pack({'id': 1}))
@@ -0,0 +1,115 @@
+import struct
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+MSGPACK_MIMETYPES = {MSGPACK_MIMETYPE, 'application/x-msgpack'}
+FRAMES_MIMETYPE = 'application/x-msgpack-frames'  # A batch as length-prefixed msgpack documents
+FORMATS = ('json', 'msgpack')
+# Each frame is its document's byte length as a msgpack uint32 (0xce, then 4 bytes
+# big-endian) followed by the document. Readers can skip frames by length, and
+# the whole body is still one msgpack stream, so it decodes in a single pass.
+FRAME_HEADER = struct.Struct('>BI')
+FRAME_MARKER = 0xce
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+_msgpack = None
+
+
+def load_msgpack():
+    # msgpack is optional; only needed once a peer asks for it. Cached because
+    # pack() and unpack() run for every message.
+    global _msgpack
+    if _msgpack is None:
+        try:
+            import msgpack
+        except ImportError:
+            raise RuntimeError("the msgpack wire format requires msgpack: pip install msgpack")
+        _msgpack = msgpack
+    return _msgpack
+
+
+def available():
+    try:
+        load_msgpack()
+    except RuntimeError:
+        return False
+    return True
+
+
+def mimetype_of(content_type):
+    return (content_type or '').split(';', 1)[0].strip().lower()
+
+
+def pack(obj):
+    # Values msgpack has no type for (e.g. datetimes) are sent as strings, as in JSON responses
+    return load_msgpack().packb(obj, default=str)
+
+
+def unpack(data):
+    # Raises ValueError if data is not exactly one msgpack document
+    try:
+        return load_msgpack().unpackb(data)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid msgpack: {e}")
+
+
+def pack_frames(objects):
+    # Per-frame work stays in C calls bound outside the loop; batches are the hot case
+    pack_object = load_msgpack().Packer(default=str).pack
+    pack_header = FRAME_HEADER.pack
+    parts = []
+    for obj in objects:
+        body = pack_object(obj)
+        parts.append(pack_header(FRAME_MARKER, len(body)))
+        parts.append(body)
+    return b''.join(parts)
+
+
+def unpack_frames(data):
+    # Returns the documents in order; raises ValueError on a truncated, oversized or invalid frame
+    unpacker = load_msgpack().Unpacker(max_buffer_size=max(len(data), 1))
+    unpacker.feed(data)
+    objects = []
+    end = 0  # Where the last complete frame ended
+    try:
+        for size in unpacker:
+            start = unpacker.tell()
+            if start - end != FRAME_HEADER.size or not isinstance(size, int) or size > MAX_FRAME_SIZE:
+                raise ValueError("Invalid frame header")
+            objects.append(next(unpacker))
+            end = unpacker.tell()
+            if end - start != size:
+                raise ValueError("Frame length does not match its document")
+    except StopIteration:
+        raise ValueError("Truncated frame")
+    except TypeError as e:
+        raise ValueError(f"Invalid msgpack: {e}")
+    if end != len(data):
+        raise ValueError("Truncated frame")
+    return objects
+
+
+# Helpers for requests-based peers (worker, client, benchmarks)
+
+def encode_request(payload, wire_format):
+    # Keyword arguments for session.post(): the body in wire_format, asking for replies in it too
+    if wire_format == 'msgpack':
+        return {'data': pack(payload),
+                'headers': {'Content-Type': MSGPACK_MIMETYPE, 'Accept': MSGPACK_MIMETYPE}}
+    return {'json': payload}
+
+
+def encode_batch(items, wire_format, frames=False):
+    # Like encode_request for a list of items. A plain msgpack array is the cheapest to
+    # encode and decode; frames only pay off when a reader streams or skips items by length.
+    if wire_format == 'msgpack' and frames:
+        return {'data': pack_frames(items),
+                'headers': {'Content-Type': FRAMES_MIMETYPE, 'Accept': MSGPACK_MIMETYPE}}
+    return encode_request(items, wire_format)
+
+
+def decode_response(response):
+    # The server answers in msgpack only when asked, and errors may still be JSON
+    if mimetype_of(response.headers.get('Content-Type')) in MSGPACK_MIMETYPES:
+        return unpack(response.content)
+    return response.json()
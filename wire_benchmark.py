@@ -0,0 +1,118 @@
+import time
+import logging
+import sys
+import json
+import argparse
+
+import wire
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Configuration
+ITERATIONS = 5000  # Encodes and decodes timed per message and codec
+BATCH_SIZE = 100  # Tasks per batched message (claim response, report, submit batch)
+RESULT_SIZE = 64  # Characters per simulated result
+
+# Codecs as the peers use them: requests and jsonify both emit compact JSON
+CODECS = {
+    'json': (lambda obj: json.dumps(obj, separators=(',', ':')).encode(), json.loads),
+    'msgpack': (wire.pack, wire.unpack),
+}
+BATCH_CODECS = {
+    **CODECS,
+    'msgpack-frames': (wire.pack_frames, wire.unpack_frames),
+}
+
+def task_row(task_id):
+    # Shaped like a row the coordinator hands out from /claim_batch
+    return {
+        'id': task_id, 'description': f'bench-{task_id}', 'status': 'processing', 'result': None,
+        'worker_id': 7, 'created_at': '2026-01-01 12:00:00.000000', 'completed_at': None,
+        'lease_expires_at': 1767268860.25, 'priority': 0, 'queue': 'default',
+        'description_blob': None, 'result_blob': None, 'requires': None, 'min_cores': 0,
+        'min_memory': 0, 'affinity_key': None,
+    }
+
+def sample_messages(batch_size):
+    # (name, message, is a list of items) for the hot routes
+    now = time.time()
+    return [
+        ('submit', {'description': 'bench-1', 'priority': 0, 'queue': 'default',
+                    'idempotency_key': '0123456789abcdef0123456789abcdef'}, False),
+        ('submit_batch', [{'description': f'bench-{i}', 'idempotency_key': f'{i:032x}'}
+                          for i in range(batch_size)], True),
+        ('claim_batch_response', {'tasks': [task_row(i) for i in range(batch_size)],
+                                  'lease_duration': 60}, False),
+        ('report', {'worker_id': 7, 'name': 'Worker-1234', 'capacity': 5,
+                    'cores': 8, 'memory_mb': 16000, 'tags': [],
+                    'results': [{'task_id': i, 'result': 'x' * RESULT_SIZE,
+                                 'started_at': now, 'finished_at': now + 0.5}
+                                for i in range(batch_size)],
+                    'failed': []}, False),
+        ('heartbeat', {'worker_id': 7, 'name': 'Worker-1234', 'capacity': 5,
+                       'results': [], 'failed': []}, False),
+    ]
+
+def cpu_per_call(function, argument, iterations):
+    started = time.process_time()
+    for _ in range(iterations):
+        function(argument)
+    return (time.process_time() - started) / iterations
+
+def measure(encode, decode, message, iterations):
+    body = encode(message)
+    if decode(body) != message:
+        raise RuntimeError("Codec did not round-trip the message")
+    encode_seconds = cpu_per_call(encode, message, iterations)
+    decode_seconds = cpu_per_call(decode, body, iterations)
+    return {
+        'bytes': len(body),
+        'encode_us': encode_seconds * 1e6,
+        'decode_us': decode_seconds * 1e6,
+        'total_us': (encode_seconds + decode_seconds) * 1e6,
+    }
+
+def run_benchmark(args):
+    results = {}
+    for name, message, is_batch in sample_messages(args.batch_size):
+        codecs = BATCH_CODECS if is_batch else CODECS
+        results[name] = {codec: measure(encode, decode, message, args.iterations)
+                         for codec, (encode, decode) in codecs.items()}
+        baseline = results[name]['json']['total_us']
+        for codec, measured in results[name].items():
+            measured['cpu_vs_json'] = measured['total_us'] / baseline if baseline else None
+        logger.info(f"{name}: " + ', '.join(f"{codec} {measured['total_us']:.1f}us/{measured['bytes']}B"
+                                           for codec, measured in results[name].items()))
+    return {
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'messages': results,
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Per-message CPU cost of the JSON and msgpack wire formats')
+    parser.add_argument('--iterations', type=int, default=ITERATIONS,
+                        help='Encodes and decodes timed per message and codec')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Tasks per batched message')
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    args.iterations = max(args.iterations, 1)
+    args.batch_size = max(args.batch_size, 1)
+    if not wire.available():
+        sys.exit("The wire benchmark needs msgpack: pip install msgpack")
+    results = run_benchmark(args)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        logger.info(f"Results written to {args.output}")
+    else:
+        print(output)
@@ -4,9 +4,17 @@ from urllib3.util.retry import Retry
 import time
 import threading
 import random
+import os
 from datetime import datetime
 import logging
 import sys
+import signal
+import argparse
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from sharding import shard_for_task
+import wire
 
 # Configure logging
 logging.basicConfig(
@@ -20,8 +28,47 @@ logger = logging.getLogger(__name__)
 
 # Configuration
 MASTER_URL = 'http://localhost:5000'
-WORKER_ID = None
+SHARD_URLS = []  # One URL per coordinator shard, in shard order; empty means MASTER_URL alone
+CLAIM_STRATEGY = 'round-robin'  # Or 'least-loaded' to favour shards with the most work per worker
+WORKER_IDS = {}  # shard index -> the id that shard assigned us
 WORKER_NAME = f"Worker-{random.randint(1000, 9999)}"
+PREFETCH_SIZE = 4  # Tasks claimed per batch
+PREFETCH_LOW_WATER = 2  # Refill the buffer when it drops below this many tasks
+CONCURRENCY = 1  # Tasks executed at the same time
+POOL_KIND = 'thread'  # 'thread' or 'process'
+LONG_POLL_TIMEOUT = 20  # Seconds the coordinator may hold an idle fetch open
+BLOB_FETCH_ATTEMPTS = 3  # Interrupted blob downloads resume with a Range request
+REPORT_BATCH_SIZE = 100  # Finished tasks per /report; a full batch is sent at once
+REPORT_INTERVAL = 0.5  # Longest a finished task waits to be reported, in seconds
+HEARTBEAT_INTERVAL = 3  # A shard that has had no report for this long gets an empty one
+MIN_TASK_DURATION = 1  # Simulated processing time range in seconds
+MAX_TASK_DURATION = 10
+FAILURE_RATE = 0.1  # Chance a simulated task fails
+WORKER_TAGS = []  # Capabilities advertised to coordinators, e.g. gpu; tasks may require them
+WORKER_CORES = None  # Advertised cores; None means os.cpu_count()
+WORKER_MEMORY_MB = None  # Advertised memory; None means the machine's physical memory
+WIRE_FORMAT = 'json'  # Or 'msgpack' (needs the msgpack package) for cheaper encoding
+
+# Latest (pending tasks, active workers) per shard, from heartbeat replies
+shard_loads = {}
+next_shard = 0  # Round-robin position
+
+# Claimed tasks waiting to run, paired with their local lease deadline
+task_buffer = deque()
+# The coordinator renews leases while we report, so an accepted report pushes every
+# deadline on that shard out to: shard -> (monotonic time the report was sent) + lease duration
+lease_durations = {}  # shard -> seconds, from claim replies
+leases_renewed_until = {}
+# Tasks executing on the pool: future -> (task, lease_deadline)
+running_tasks = {}
+# Finished tasks waiting for the reporter thread:
+# shard -> [(task_id, result or None if failed, started_at, finished_at)]
+outboxes = {}
+outbox_since = {}  # shard -> when its oldest unreported task finished
+reports_in_flight = 0  # Finished tasks taken by the reporter but not yet acknowledged
+report_now = False  # Set to send every outbox without waiting for REPORT_INTERVAL
+report_ready = threading.Condition()  # Notified when an outbox starts or fills up, or a report is sent
+executor = None
 
 # Configure HTTP session with retry
 session = requests.Session()
@@ -34,134 +81,412 @@ adapter = HTTPAdapter(max_retries=retry_strategy)
 session.mount("http://", adapter)
 session.mount("https://", adapter)
 
+def worker_capacity():
+    # Running and buffered tasks; the coordinator never leases us more than this
+    return CONCURRENCY + PREFETCH_SIZE
+
+def free_slots():
+    # Finished tasks keep their leases until reported, so they take slots too
+    unreported = sum(len(outbox) for outbox in list(outboxes.values())) + reports_in_flight
+    return worker_capacity() - len(running_tasks) - len(task_buffer) - unreported
+
+def physical_memory_mb():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+def worker_profile():
+    # Coordinators only hand us tasks whose requirements these satisfy
+    return {
+        'cores': WORKER_CORES if WORKER_CORES is not None else os.cpu_count() or 1,
+        'memory_mb': WORKER_MEMORY_MB if WORKER_MEMORY_MB is not None else physical_memory_mb(),
+        'tags': WORKER_TAGS,
+    }
+
+def shard_urls():
+    return SHARD_URLS or [MASTER_URL]
+
+def task_shard(task_id):
+    return shard_for_task(task_id, len(shard_urls()))
+
 def register_worker():
-    global WORKER_ID
+    # Register with every shard not yet registered; True once all are
+    for shard, url in enumerate(shard_urls()):
+        if shard in WORKER_IDS:
+            continue
+        try:
+            response = session.post(
+                f'{url}/register',
+                **wire.encode_request({'name': WORKER_NAME, 'capacity': worker_capacity(), **worker_profile()},
+                                      WIRE_FORMAT),
+                timeout=10
+            )
+            if response.status_code == 200:
+                data = wire.decode_response(response)
+                if data.get('shard_id', 0) != shard:
+                    logger.error(f"{url} reports shard {data.get('shard_id')}, expected {shard}")
+                    return False
+                WORKER_IDS[shard] = data['worker_id']
+                logger.info(f"Registered with shard {shard} as Worker ID: {WORKER_IDS[shard]}")
+            else:
+                logger.error(f"Registration failed: {response.text}")
+                return False
+        except Exception as e:
+            logger.error(f"Registration error: {str(e)}")
+            return False
+    return True
+
+def queue_report(task_id, result, started_at=None, finished_at=None):
+    # Hand a finished task to the reporter; a falsy result means it failed and should be requeued
+    shard = task_shard(task_id)
+    with report_ready:
+        outbox = outboxes.setdefault(shard, [])
+        if not outbox:
+            outbox_since[shard] = time.monotonic()
+        outbox.append((task_id, result, started_at, finished_at))
+        if len(outbox) == 1 or len(outbox) >= REPORT_BATCH_SIZE:
+            # The reporter may be sleeping until the next heartbeat; let it pick up the new deadline
+            report_ready.notify()
+
+def request_report():
+    # Send every outbox now instead of at its REPORT_INTERVAL deadline
+    global report_now
+    with report_ready:
+        report_now = True
+        report_ready.notify_all()
+
+def take_reports(shard):
+    # Caller holds report_ready; leftovers keep their age so they follow right after
+    outbox = outboxes.get(shard, [])
+    entries, outboxes[shard] = outbox[:REPORT_BATCH_SIZE], outbox[REPORT_BATCH_SIZE:]
+    return entries
+
+def send_report(shard, entries):
+    # One request carries our heartbeat plus the shard's finished tasks; True once accepted
+    sent_at = time.monotonic()
     try:
         response = session.post(
-            f'{MASTER_URL}/register',
-            json={'name': WORKER_NAME},
+            f'{shard_urls()[shard]}/report',
+            **wire.encode_request({
+                'worker_id': WORKER_IDS[shard],
+                'name': WORKER_NAME,
+                'capacity': worker_capacity(),
+                **worker_profile(),
+                'results': [{'task_id': task_id, 'result': result,
+                             'started_at': started_at, 'finished_at': finished_at}
+                            for task_id, result, started_at, finished_at in entries if result],
+                'failed': [entry[0] for entry in entries if not entry[1]]
+            }, WIRE_FORMAT),
             timeout=10
         )
         if response.status_code == 200:
-            WORKER_ID = response.json()['worker_id']
-            logger.info(f"Registered as Worker ID: {WORKER_ID}")
+            data = wire.decode_response(response)
+            shard_loads[shard] = (data.get('pending', 0), data.get('active_workers', 1))
+            if shard in lease_durations:
+                leases_renewed_until[shard] = sent_at + lease_durations[shard]
+            if entries:
+                logger.info(f"Reported {data['completed']} completed and {len(entries) - data['completed']} "
+                            f"failed tasks to shard {shard}")
             return True
-        else:
-            logger.error(f"Registration failed: {response.text}")
-            return False
+        logger.warning(f"Report failed: {response.text}")
     except Exception as e:
-        logger.error(f"Registration error: {str(e)}")
-        return False
+        logger.error(f"Report error: {str(e)}")
+    return False
 
-def send_heartbeat():
+def report_loop():
+    # Replaces per-task completions and separate heartbeats: each shard gets a report when a
+    # batch fills, when its oldest result has waited REPORT_INTERVAL, or every HEARTBEAT_INTERVAL
+    global report_now, reports_in_flight
+    last_report = {}
     while True:
-        try:
-            response = session.post(
-                f'{MASTER_URL}/heartbeat/{WORKER_ID}',
-                json={'name': WORKER_NAME},
-                timeout=5
-            )
-            if response.status_code != 200:
-                logger.warning(f"Heartbeat failed: {response.text}")
-        except Exception as e:
-            logger.error(f"Heartbeat error: {str(e)}")
+        due = {}
+        with report_ready:
+            while not due:
+                now = time.monotonic()
+                wake = now + HEARTBEAT_INTERVAL
+                for shard in range(len(shard_urls())):
+                    pending = outboxes.get(shard)
+                    deadlines = [last_report.get(shard, 0) + HEARTBEAT_INTERVAL]
+                    if pending:
+                        deadlines.append(outbox_since[shard] + REPORT_INTERVAL)
+                    send_now = pending and (report_now or len(pending) >= REPORT_BATCH_SIZE)
+                    if send_now or min(deadlines) <= now:
+                        due[shard] = take_reports(shard)
+                        reports_in_flight += len(due[shard])
+                    wake = min(wake, *deadlines)
+                report_now = False
+                if not due:
+                    report_ready.wait(max(wake - now, 0.01))
         
-        time.sleep(3)
+        for shard, entries in due.items():
+            sent = send_report(shard, entries)
+            with report_ready:
+                reports_in_flight -= len(entries)
+                if not sent:
+                    # Keep them for the next attempt; the coordinator's lease expiry is the backstop
+                    outboxes[shard] = entries + outboxes.get(shard, [])
+                report_ready.notify_all()
+            if sent:
+                last_report[shard] = time.monotonic()
+            else:
+                time.sleep(1)
+
+def flush_reports():
+    # Send everything still waiting, on shutdown
+    with report_ready:
+        pending = {shard: entries for shard, entries in outboxes.items() if entries}
+        outboxes.clear()
+    for shard, entries in pending.items():
+        for start in range(0, len(entries), REPORT_BATCH_SIZE):
+            send_report(shard, entries[start:start + REPORT_BATCH_SIZE])
+
+def fetch_blob(base_url, blob_hash):
+    # Download a large payload, resuming from where an interrupted attempt stopped
+    data = bytearray()
+    for attempt in range(BLOB_FETCH_ATTEMPTS):
+        headers = {'Range': f'bytes={len(data)}-'} if data else {}
+        try:
+            with requests.get(f'{base_url}/blob/{blob_hash}', headers=headers,
+                              stream=True, timeout=30) as response:
+                if response.status_code not in (200, 206):
+                    raise RuntimeError(f"Blob fetch failed: {response.status_code}")
+                if response.status_code == 200:
+                    data.clear()
+                for chunk in response.iter_content(64 * 1024):
+                    data.extend(chunk)
+            break
+        except requests.RequestException as e:
+            logger.warning(f"Blob {blob_hash} download interrupted: {str(e)}")
+            if attempt == BLOB_FETCH_ATTEMPTS - 1:
+                raise
+    if hashlib.sha256(data).hexdigest() != blob_hash:
+        raise RuntimeError(f"Blob {blob_hash} failed its checksum")
+    return bytes(data)
 
-def process_task(task):
+def execute_task(task, worker_name, duration_range=(1, 10), failure_rate=0.1, blob_url=None):
+    # Runs on the executor pool, so it must not touch the HTTP session.
+    # Returns the result string, or None if the task failed.
     task_id = task['id']
-    logger.info(f"Starting task {task_id}: {task['description']}")
-    
-    # Acknowledge task first
-    try:
-        ack_response = session.post(
-            f'{MASTER_URL}/acknowledge_task/{task_id}',
-            json={'worker_id': WORKER_ID},
-            timeout=5
-        )
-        if ack_response.status_code != 200:
-            logger.error(f"Failed to acknowledge task {task_id}")
-            return
-    except Exception as e:
-        logger.error(f"Acknowledge failed: {str(e)}")
-        return
+    description = task['description']
+    if task.get('description_blob'):
+        # Large payloads are stored by hash; fetched here so the dispatch loop never waits on them
+        payload = fetch_blob(blob_url, task['description_blob'])
+        description = f"<{len(payload)} byte payload>"
+    logger.info(f"Starting task {task_id}: {description}")
     
     # Simulate work with random processing time
-    processing_time = random.randint(1, 10)
-    for i in range(processing_time):
-        time.sleep(1)
-        logger.info(f"Processing task {task_id} ({i+1}/{processing_time})")
+    processing_time = random.uniform(*duration_range)
+    remaining = processing_time
+    step = 0
+    while remaining > 0:
+        time.sleep(min(remaining, 1))
+        remaining -= 1
+        step += 1
+        logger.info(f"Processing task {task_id} ({step}/{int(processing_time + 0.999)})")
     
-    # Random chance of failure (10%)
-    if random.random() < 0.1:
+    # Random chance of failure
+    if random.random() < failure_rate:
         logger.error(f"Simulated failure processing task {task_id}")
-        return
+        return None
     
-    # Complete the task
-    result = f"Successfully processed by {WORKER_NAME} in {processing_time}s"
-    try:
-        response = session.post(
-            f'{MASTER_URL}/task/complete',
-            json={
-                'task_id': task_id,
-                'worker_id': WORKER_ID,
-                'result': result
-            },
-            timeout=10
-        )
-        if response.status_code == 200:
-            logger.info(f"Completed task {task_id}")
-        else:
-            logger.error(f"Completion failed: {response.text}")
-    except Exception as e:
-        logger.error(f"Completion error: {str(e)}")
+    return f"Successfully processed by {worker_name} in {processing_time:.2f}s"
+
+def run_task(task, *args, **kwargs):
+    # Pool entry point; returns (result, started_at, finished_at) so the coordinator can trace the run
+    started_at = time.time()
+    result = execute_task(task, *args, **kwargs)
+    return result, started_at, time.time()
+
+def simulation_settings():
+    # Passed explicitly so process pools see the command-line values
+    return (MIN_TASK_DURATION, MAX_TASK_DURATION), FAILURE_RATE
+
+def choose_shard():
+    global next_shard
+    count = len(shard_urls())
+    if CLAIM_STRATEGY == 'least-loaded':
+        # Most pending tasks per active worker; falls through when every shard looks idle
+        loads = {shard: pending / max(workers, 1) for shard, (pending, workers) in shard_loads.items()
+                 if shard < count and pending}
+        if loads:
+            return max(loads, key=loads.get)
+    shard = next_shard % count
+    next_shard = shard + 1
+    return shard
+
+def refill_task_buffer(wait=0):
+    # With wait > 0 the coordinator parks the request until tasks arrive
+    wanted = PREFETCH_SIZE - len(task_buffer)
+    shard = choose_shard()
+    if wait and len(shard_urls()) > 1:
+        # Do not sit on one idle shard while another has work
+        wait = max(1, wait // len(shard_urls()))
+    response = session.post(
+        f'{shard_urls()[shard]}/claim_batch',
+        **wire.encode_request({'worker_id': WORKER_IDS[shard], 'max_tasks': wanted, 'wait': wait}, WIRE_FORMAT),
+        timeout=10 + wait
+    )
+    if response.status_code != 200:
+        logger.error(f"Unexpected response: {response.status_code}")
+        return False
+    
+    data = wire.decode_response(response)
+    lease_durations[shard] = data['lease_duration']
+    lease_deadline = time.monotonic() + data['lease_duration']
+    for task in data['tasks']:
+        task_buffer.append((task, lease_deadline))
+    if not data['tasks'] and shard in shard_loads:
+        # Stale load hints should not keep pointing at an empty shard
+        shard_loads[shard] = (0, shard_loads[shard][1])
+    return True
+
+def release_tasks(task_ids):
+    # Hand leased tasks back to their shards' queues
+    by_shard = {}
+    for task_id in task_ids:
+        by_shard.setdefault(task_shard(task_id), []).append(task_id)
+    
+    released = True
+    for shard, shard_task_ids in by_shard.items():
+        try:
+            response = session.post(
+                f'{shard_urls()[shard]}/release',
+                **wire.encode_request({'worker_id': WORKER_IDS[shard], 'task_ids': shard_task_ids}, WIRE_FORMAT),
+                timeout=5
+            )
+            if response.status_code != 200:
+                logger.error(f"Release failed: {response.text}")
+                released = False
+        except Exception as e:
+            logger.error(f"Release error: {str(e)}")
+            released = False
+    return released
+
+def release_unfinished_tasks():
+    # Hand back prefetched and interrupted tasks so they are not stranded until their lease expires
+    task_ids = [task['id'] for task, _ in task_buffer]
+    task_ids += [task['id'] for task, _ in running_tasks.values()]
+    if task_ids and release_tasks(task_ids):
+        task_buffer.clear()
+        running_tasks.clear()
+        logger.info(f"Released {len(task_ids)} unfinished tasks")
+
+def create_executor():
+    if POOL_KIND == 'process':
+        return ProcessPoolExecutor(max_workers=CONCURRENCY)
+    return ThreadPoolExecutor(max_workers=CONCURRENCY)
 
 def fetch_and_process_tasks():
     backoff = 1  # Initial backoff time in seconds
     max_backoff = 30  # Maximum backoff time
     
     while True:
-        try:
-            response = session.get(
-                f'{MASTER_URL}/get_task',
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                task = response.json()
-                if 'id' in task:
-                    # Mark as processing first
-                    session.post(
-                        f'{MASTER_URL}/task/complete',
-                        json={
-                            'task_id': task['id'],
-                            'worker_id': WORKER_ID,
-                            'result': None
-                        },
-                        timeout=5
-                    )
-                    process_task(task)
-                    backoff = 1  # Reset backoff on success
-                else:
-                    logger.info("No tasks available")
+        if len(task_buffer) < PREFETCH_LOW_WATER:
+            # Only block on the coordinator when there is nothing to run meanwhile
+            idle = not task_buffer and not running_tasks
+            if free_slots() < PREFETCH_SIZE - len(task_buffer):
+                # The coordinator would refuse leases still held by unreported results; send them now
+                request_report()
+                if idle:
+                    with report_ready:
+                        report_ready.wait_for(lambda: free_slots() > 0, HEARTBEAT_INTERVAL)
+            try:
+                if not refill_task_buffer(LONG_POLL_TIMEOUT if idle else 0) and idle:
                     time.sleep(backoff)
                     backoff = min(backoff * 2, max_backoff)
-            elif response.status_code == 404:
-                logger.info("No tasks in queue")
-                time.sleep(backoff)
-                backoff = min(backoff * 2, max_backoff)
-            else:
-                logger.error(f"Unexpected response: {response.status_code}")
-                time.sleep(backoff)
-                backoff = min(backoff * 2, max_backoff)
+                    continue
+            except Exception as e:
+                logger.error(f"Fetch error: {str(e)}")
+                if idle:
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, max_backoff)
+                    continue
         
-        except Exception as e:
-            logger.error(f"Fetch error: {str(e)}")
-            time.sleep(backoff)
-            backoff = min(backoff * 2, max_backoff)
+        # Keep every execution slot busy while tasks are buffered
+        while task_buffer and len(running_tasks) < CONCURRENCY:
+            task, lease_deadline = task_buffer.popleft()
+            deadline = max(lease_deadline, leases_renewed_until.get(task_shard(task['id']), 0))
+            if time.monotonic() >= deadline:
+                # The coordinator has already requeued this task
+                logger.warning(f"Lease expired for prefetched task {task['id']}, skipping")
+                continue
+            future = executor.submit(run_task, task, WORKER_NAME, *simulation_settings(),
+                                     blob_url=shard_urls()[task_shard(task['id'])])
+            running_tasks[future] = (task, lease_deadline)
+        
+        backoff = 1  # Reset backoff once the coordinator answers
+        if not running_tasks:
+            logger.info("No tasks in queue")
+            continue
+        
+        done, _ = wait(running_tasks, return_when=FIRST_COMPLETED)
+        for future in done:
+            task, _ = running_tasks.pop(future)
+            try:
+                result, started_at, finished_at = future.result()
+            except Exception as e:
+                logger.error(f"Task {task['id']} raised: {str(e)}")
+                result, started_at, finished_at = None, None, None
+            # Results and failures go out in batched reports; failed tasks are requeued
+            # then rather than waiting for their lease to expire
+            queue_report(task['id'], result, started_at, finished_at)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Distributed task scheduler worker')
+    parser.add_argument('--master', default=MASTER_URL, help='Coordinator URL when not sharded')
+    parser.add_argument('--shards', help='Comma-separated coordinator URLs, in shard order')
+    parser.add_argument('--claim-strategy', choices=['round-robin', 'least-loaded'], default=CLAIM_STRATEGY,
+                        help='How to pick the shard for each claim')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY,
+                        help='Number of tasks to run at the same time')
+    parser.add_argument('--pool', choices=['thread', 'process'], default=POOL_KIND,
+                        help='Run tasks on a thread pool or a process pool')
+    parser.add_argument('--prefetch', type=int, default=PREFETCH_SIZE,
+                        help='Claimed tasks to keep buffered beyond the running ones')
+    parser.add_argument('--report-batch', type=int, default=REPORT_BATCH_SIZE,
+                        help='Finished tasks that trigger an immediate report')
+    parser.add_argument('--report-interval', type=float, default=REPORT_INTERVAL,
+                        help='Longest a finished task waits to be reported, in seconds')
+    parser.add_argument('--min-duration', type=float, default=MIN_TASK_DURATION,
+                        help='Shortest simulated task in seconds (0 allowed)')
+    parser.add_argument('--max-duration', type=float, default=MAX_TASK_DURATION,
+                        help='Longest simulated task in seconds (0 allowed)')
+    parser.add_argument('--failure-rate', type=float, default=FAILURE_RATE,
+                        help='Probability that a simulated task fails')
+    parser.add_argument('--wire', choices=wire.FORMATS, default=WIRE_FORMAT,
+                        help='Encoding for coordinator traffic (msgpack needs the msgpack package)')
+    parser.add_argument('--tags', default='', help='Comma-separated capabilities this worker offers, e.g. gpu,ssd')
+    parser.add_argument('--cores', type=int, help='Cores to advertise (default: all of them)')
+    parser.add_argument('--memory-mb', type=int, help='Memory to advertise in MB (default: physical memory)')
+    return parser.parse_args()
+
+def handle_sigterm(signum, frame):
+    sys.exit(0)
 
 if __name__ == '__main__':
-    logger.info(f"Starting worker {WORKER_NAME}")
+    args = parse_args()
+    MASTER_URL = args.master
+    if args.shards:
+        SHARD_URLS = [url.strip().rstrip('/') for url in args.shards.split(',') if url.strip()]
+    CLAIM_STRATEGY = args.claim_strategy
+    CONCURRENCY = max(args.concurrency, 1)
+    POOL_KIND = args.pool
+    PREFETCH_SIZE = max(args.prefetch, 1)
+    PREFETCH_LOW_WATER = min(PREFETCH_LOW_WATER, PREFETCH_SIZE)
+    REPORT_BATCH_SIZE = min(max(args.report_batch, 1), 1000)
+    REPORT_INTERVAL = max(args.report_interval, 0)
+    MIN_TASK_DURATION = max(args.min_duration, 0)
+    MAX_TASK_DURATION = max(args.max_duration, MIN_TASK_DURATION)
+    FAILURE_RATE = min(max(args.failure_rate, 0), 1)
+    WORKER_TAGS = sorted({tag.strip() for tag in args.tags.split(',') if tag.strip()})
+    WORKER_CORES = args.cores
+    WORKER_MEMORY_MB = args.memory_mb
+    WIRE_FORMAT = args.wire
+    if WIRE_FORMAT == 'msgpack' and not wire.available():
+        sys.exit("--wire msgpack requires msgpack: pip install msgpack")
+    
+    logger.info(f"Starting worker {WORKER_NAME} with {CONCURRENCY} {POOL_KIND} slots")
     
     # Attempt registration with retries
     registration_attempts = 0
@@ -173,14 +498,23 @@ if __name__ == '__main__':
         logger.info(f"Retrying registration in {wait_time} seconds...")
         time.sleep(wait_time)
     
-    if not WORKER_ID:
+    if len(WORKER_IDS) < len(shard_urls()):
         logger.error("Failed to register worker after multiple attempts. Exiting.")
         sys.exit(1)
     
-    # Start heartbeat thread
-    heartbeat_thread = threading.Thread(target=send_heartbeat)
-    heartbeat_thread.daemon = True
-    heartbeat_thread.start()
+    # Start the reporter thread; its reports double as heartbeats
+    reporter_thread = threading.Thread(target=report_loop)
+    reporter_thread.daemon = True
+    reporter_thread.start()
     
     # Start task processing
-    fetch_and_process_tasks()
\ No newline at end of file
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    executor = create_executor()
+    try:
+        fetch_and_process_tasks()
+    except KeyboardInterrupt:
+        logger.info("Worker terminated by user")
+    finally:
+        flush_reports()
+        release_unfinished_tasks()
+        executor.shutdown(wait=False, cancel_futures=True)